@@ -86,6 +86,8 @@ class UserCommand(object):
         user_parser.add_argument('-s', '--protocol', type=str, help='protocol')
         user_parser.add_argument('-d', '--depth', type=int, default=0,
                                  help='listing depths. Default: current level')
+        user_parser.add_argument('-c', '--concurrency', type=int,
+                                 help='number of directories to read at once (default=1)')
         user_parser.add_argument('-w', '--wait', type=int, help='client-side timeout (in seconds)'
                                  , default=10)
         user_parser.set_defaults(func=self.list)
@@ -100,6 +102,8 @@ class UserCommand(object):
         user_parser.add_argument('-s', '--protocol', type=str, help='protocol')
         user_parser.add_argument('-T', '--timeout', type=int, help='gfal2 CORE (global) '
                                                                    'timeout for remove')
+        user_parser.add_argument('-P', '--parallel', type=int,
+                                 help='number of files to remove at once (default=1)')
         user_parser.set_defaults(func=self.remove)
         # copy
         user_parser = subparsers.add_parser('copy',
@@ -113,6 +117,8 @@ class UserCommand(object):
         user_parser.add_argument('-p', '--priority', type=int)
         user_parser.add_argument('-b', '--block', action='store_true')
         user_parser.add_argument('-o', '--overwrite', action='store_true')
+        user_parser.add_argument('-P', '--parallel', type=int,
+                                 help='number of files to transfer at once (default=1)')
         user_parser.add_argument('-s', '--protocol', type=str, help='protocol')
         user_parser.set_defaults(func=self.copy)
         # rename
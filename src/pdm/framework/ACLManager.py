@@ -2,6 +2,8 @@
 """ Access Control for Flask Wrapper. """
 
 import urllib
+import threading
+from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
 import flask
@@ -17,6 +19,20 @@ def set_session_state(logged_in=False):
     session['logged_in'] = logged_in
 
 
+class _RuleNode(object):
+    """ A node of the ACL rule path trie. Each node is one segment of a
+        rule path. rules are the expanded entries of a rule ending at
+        this node & tail_rules those of a rule ending with a '*' after it.
+    """
+    __slots__ = ('children', 'wildcard', 'rules', 'tail_rules')
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.rules = None
+        self.tail_rules = None
+
+
 class ACLManager(object):
     """ Access Control List manager for Flask Wrapper.
         Keeps a list of users who are allowed to access resources
@@ -29,15 +45,24 @@ class ACLManager(object):
     AUTH_MODE_SESSION = 3
     AUTH_MODE_ALLOW_ALL = 4
 
-    def __init__(self, logger):
+    def __init__(self, logger, token_cache_size=1024):
         """ Create an empty instance of ACLManager (no predfined groups or
             rules. Test mode is disabled by default.
+            token_cache_size - The maximum number of verified tokens to
+                               remember, 0 disables the cache.
         """
         self.__log = logger
         self.__test_mode = ACLManager.AUTH_MODE_NONE
         self.__test_data = None
         self.__groups = {}
         self.__rules = {}
+        # Rules compiled into a path trie for each method
+        self.__rule_trie = {}
+        self.__token_cache = OrderedDict()
+        self.__token_cache_size = token_cache_size
+        self.__token_cache_lock = threading.Lock()
+        self.__token_cache_hits = 0
+        self.__token_cache_misses = 0
 
     def __check_entry(self, entry, allow_group):
         """ Checks an entry is in a valid format and expands groups.
@@ -90,7 +115,34 @@ class ACLManager(object):
             res_path = "%s%%GET" % res_path
         if res_path in self.__rules:
             raise ValueError("Duplicate auth rule for path '%s'." % res_path)
-        self.__rules[res_path] = self.__check_entry(entry, True)
+        entries = self.__check_entry(entry, True)
+        self.__rules[res_path] = entries
+        self.__compile_rule(res_path, entries)
+
+    def __compile_rule(self, res_path, entries):
+        """ Adds a rule to the path trie of its method.
+            A '?' segment matches any single request segment and a '*'
+            in the last position matches one or more trailing segments.
+            A '*' anywhere else is just a normal path segment.
+            Returns None.
+        """
+        rule_path, rule_method = res_path.split('%', 1)
+        node = self.__rule_trie.setdefault(rule_method, _RuleNode())
+        rule_parts = rule_path.split('/')
+        tail = rule_parts[-1] == '*'
+        if tail:
+            rule_parts = rule_parts[:-1]
+        for rule_part in rule_parts:
+            if rule_part == '?':
+                if node.wildcard is None:
+                    node.wildcard = _RuleNode()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(rule_part, _RuleNode())
+        if tail:
+            node.tail_rules = entries
+        else:
+            node.rules = entries
 
     def test_mode(self, auth_mode, auth_data=None):
         """ Enabled test mode, where the authentication info is pre-set for
@@ -99,8 +151,53 @@ class ACLManager(object):
         self.__test_mode = auth_mode
         self.__test_data = auth_data
 
-    @staticmethod
-    def __get_real_request_auth():
+    def token_cache_stats(self):
+        """ Gets the verified token cache statistics.
+            Returns a dict of hits, misses & size (current entries).
+        """
+        with self.__token_cache_lock:
+            return {'hits': self.__token_cache_hits,
+                    'misses': self.__token_cache_misses,
+                    'size': len(self.__token_cache)}
+
+    def __verify_token(self, raw_token):
+        """ Verifies a raw token with the app token service, remembering
+            the result so that the signature check and expiry parsing
+            are only done once for tokens that are presented repeatedly.
+            Tokens are cached per token service, so a token is never
+            accepted on the strength of a check by a different service.
+            Returns a tuple of (token value, expiry datetime or None).
+            Raises ValueError if the token isn't valid.
+        """
+        cache_key = (current_app.token_svc, raw_token)
+        with self.__token_cache_lock:
+            entry = self.__token_cache.pop(cache_key, None)
+            if entry is not None:
+                self.__token_cache_hits += 1
+                self.__token_cache[cache_key] = entry
+                return deepcopy(entry[0]), entry[1]
+            self.__token_cache_misses += 1
+        token_value = current_app.token_svc.check(raw_token)
+        exp_value = None
+        # Check if this looks like a standard token with an expiry value
+        if isinstance(token_value, dict) and 'expiry' in token_value:
+            exp_value = datetime.strptime(token_value['expiry'],
+                                          '%Y-%m-%dT%H:%M:%S.%f')
+        if self.__token_cache_size > 0:
+            with self.__token_cache_lock:
+                self.__token_cache[cache_key] = (deepcopy(token_value), exp_value)
+                while len(self.__token_cache) > self.__token_cache_size:
+                    self.__token_cache.popitem(last=False)
+        return token_value, exp_value
+
+    def __forget_token(self, raw_token):
+        """ Removes a token from the verified token cache.
+            Returns None.
+        """
+        with self.__token_cache_lock:
+            self.__token_cache.pop((current_app.token_svc, raw_token), None)
+
+    def __get_real_request_auth(self):
         """ Fills the details of the presented credentials into the
             request object.
         """
@@ -115,17 +212,13 @@ class ACLManager(object):
         if 'X-Token' in request.headers:
             raw_token = request.headers['X-Token']
             try:
-                token_value = current_app.token_svc.check(raw_token)
-                # Check if this looks like a standard token with an expiry value
-                if isinstance(token_value, dict):
-                    if 'expiry' in token_value:
-                        exp_str = token_value['expiry']
-                        exp_value = datetime.strptime(exp_str, '%Y-%m-%dT%H:%M:%S.%f')
-                        if exp_value < datetime.utcnow():
-                            # Token has already expired
-                            current_app.log.info("Request %s token has expired (at %s)",
-                                                 request.uuid, exp_str)
-                            return "403 Expired Token", 403
+                token_value, exp_value = self.__verify_token(raw_token)
+                if exp_value is not None and exp_value < datetime.utcnow():
+                    # Token has already expired
+                    self.__forget_token(raw_token)
+                    current_app.log.info("Request %s token has expired (at %s)",
+                                         request.uuid, token_value['expiry'])
+                    return "403 Expired Token", 403
                 request.token = token_value
                 request.raw_token = raw_token
                 request.token_ok = True
@@ -177,43 +270,35 @@ class ACLManager(object):
                 return True
         return False
 
-    @staticmethod
-    def __match_path(req_detail, rule_detail):
-        """ Checks whether a request path matches a rule path.
-            The rule path can contiain wildcards * or ?.
-            Although the * wildcard can only be in the last position.
-            Returns True if the rule_detail pattern matches req_detail.
+    def __match_path(self, req_path, req_method):
+        """ Finds all of the rules whose path pattern matches a request.
+            req_path - The request path.
+            req_method - The request method.
+            Returns a list of the expanded entries of each matching rule.
         """
-        req_path, req_method = req_detail.split('%')
-        rule_path, rule_method = rule_detail.split('%')
-        if req_method != rule_method:
-            return False # Wrong method
-        req_parts = req_path.split('/')
-        rule_parts = rule_path.split('/')
-        # If the request path is shorter than the rule, then it
-        # can't possibly match
-        if len(req_parts) < len(rule_parts):
-            return False
-        # If the rule ends in a wildcard, ignore all bits of the
-        # request path that match the wildcard
-        if rule_parts[-1] == '*':
-            rule_parts = rule_parts[0:-1]
-            req_parts = req_parts[0:len(rule_parts)]
-        # If the request is longer than the rule (considering *),
-        # the request can't match
-        if len(req_parts) > len(rule_parts):
-            return False
-        # Now check each segment of the path to match either
-        # directly or by wildcard
-        for part_num in xrange(0, len(rule_parts)):
-            req_part = req_parts[part_num]
-            rule_part = rule_parts[part_num]
-            if rule_part == '?':
-                continue
-            if req_part != rule_part:
-                return False
-        # Everything matched, so the rule matches the request
-        return True
+        node = self.__rule_trie.get(req_method)
+        if node is None:
+            return []
+        matches = []
+        nodes = [node]
+        for req_part in req_path.split('/'):
+            next_nodes = []
+            for node in nodes:
+                # There is at least this segment left to match the *
+                if node.tail_rules is not None:
+                    matches.append(node.tail_rules)
+                child = node.children.get(req_part)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.wildcard is not None:
+                    next_nodes.append(node.wildcard)
+            nodes = next_nodes
+            if not nodes:
+                break
+        for node in nodes:
+            if node.rules is not None:
+                matches.append(node.rules)
+        return matches
 
     @staticmethod
     def __do_abort():
@@ -240,11 +325,11 @@ class ACLManager(object):
             Raises a Flask 403 abort if access should be denied.
         """
         # Work out the request URI
-        real_path = request.path
+        req_path = request.path
         # Strip a trailing slash, as long as it isn't the only char
-        if real_path.endswith('/') and len(real_path) > 1:
-            real_path = real_path[:-1]
-        real_path = "%s%%%s" % (real_path, request.method)
+        if req_path.endswith('/') and len(req_path) > 1:
+            req_path = req_path[:-1]
+        real_path = "%s%%%s" % (req_path, request.method)
         # Now check the auth rules for this path
         if real_path in self.__rules:
             if self.__matches_rules(self.__rules[real_path]):
@@ -255,12 +340,11 @@ class ACLManager(object):
             self.__do_abort()
         # No specific rule for this path, try generic rules
         did_match = False
-        for rule_path in self.__rules.iterkeys():
-            if self.__match_path(real_path, rule_path):
-                did_match = True
-                if self.__matches_rules(self.__rules[rule_path]):
-                    # Access allowed via a generic rule
-                    return
+        for rules in self.__match_path(req_path, request.method):
+            did_match = True
+            if self.__matches_rules(rules):
+                # Access allowed via a generic rule
+                return
         reason = "no matching auth rule"
         if did_match:
             reason = "all wildcard rules denied access"
@@ -7,6 +7,7 @@ from collections import Mapping
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.types import TypeEngine, DateTime
 
 
 # pylint: disable=too-few-public-methods
@@ -42,10 +43,25 @@ class DictMixin(object):
     # No fields excluded by default
     __excluded_fields__ = []
 
+    @classmethod
+    def _column_names(cls):
+        """
+        Tuple of the names of the (not excluded) model columns.
+
+        This is worked out on first use for each model class, subclasses get their own.
+        """
+        names = cls.__dict__.get('_DictMixin__column_names')
+        if names is None:
+            names = tuple(column.name for column in cls.__table__.columns
+                          if column.name not in cls.__excluded_fields__)
+            cls.__column_names = names
+            cls.__column_set = frozenset(names)
+        return names
+
     @property
     def columns(self):
         """list of db model column names."""
-        return [name for name, _ in self]
+        return list(self._column_names())
 
     # This doesn't match the return from a normal mapping which is just keys.
     # This is necessary to allow dictionary conversion as dict constructor
@@ -55,18 +71,22 @@ class DictMixin(object):
     # until we can update we have to do it this way.
     def __iter__(self):
         """Iterator through db columns."""
-        return ((column.name, getattr(self, column.name)) for column in self.__table__.columns
-                if column.name not in self.__excluded_fields__)
+        # Loaded column values are read straight from the instance state, skipping the
+        # SQLAlchemy attribute descriptors. Anything else (e.g. expired) goes through getattr.
+        state = self.__dict__
+        return ((name, state[name] if name in state else getattr(self, name))
+                for name in self._column_names())
 
     def __getitem__(self, item):
         """Get specific column value."""
-        if item not in self.columns:
+        self._column_names()
+        if item not in self.__column_set:
             raise KeyError("Invalid attribute name: %s" % item)
         return getattr(self, item)
 
     def __len__(self):
         """Returns number of db columns."""
-        return len(self.columns)
+        return len(self._column_names())
 Mapping.register(DictMixin)  # pylint: disable=no-member
 
 
@@ -79,13 +99,31 @@ class JSONMixin(DictMixin):
     for SQLAlchemy based table classes.
     """
 
+    @classmethod
+    def _datetime_columns(cls):
+        """
+        Tuple of the names of the columns which may hold a datetime.
+
+        Only these are checked for conversion by encode_for_json. Columns of an unknown
+        (non SQLAlchemy) type are included in case they do.
+        """
+        names = cls.__dict__.get('_JSONMixin__datetime_columns')
+        if names is None:
+            column_types = {column.name: column.type for column in cls.__table__.columns}
+            names = tuple(name for name in cls._column_names()
+                          if not isinstance(column_types[name], TypeEngine) or
+                          isinstance(getattr(column_types[name], 'impl', column_types[name]),
+                                     DateTime))
+            cls.__datetime_columns = names
+        return names
+
     def encode_for_json(self):
         """Return an object that can be encoded with the default JSON encoder."""
-        ret = {}
-        for key, value in self:
+        ret = dict(iter(self))
+        for name in self._datetime_columns():
+            value = ret[name]
             if isinstance(value, datetime):
-                value = value.isoformat()
-            ret[key] = value
+                ret[name] = value.isoformat()
         return ret
 
     def json(self):
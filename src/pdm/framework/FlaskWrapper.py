@@ -10,7 +10,7 @@ import logging
 
 from pdm.framework.Tokens import TokenService
 from pdm.framework.ACLManager import ACLManager
-from pdm.framework.Database import MemSafeSQLAlchemy, JSONTableEncoder
+from pdm.framework.Database import MemSafeSQLAlchemy, JSONMixin, JSONTableEncoder
 
 from flask import Flask, Response, current_app, request
 from flask.testing import FlaskClient
@@ -19,8 +19,13 @@ from flask.testing import FlaskClient
 def jsonify(obj):
     """ Works just like Flask's jsonify method, but doesn't care about the
         input type.
+        Lists of table rows are converted up front rather than one row at
+        a time through the encoder default hook.
         Returns a Flask response object.
     """
+    if isinstance(obj, list):
+        obj = [item.encode_for_json() if isinstance(item, JSONMixin) else item
+               for item in obj]
     return Response(json.dumps(obj, cls=JSONTableEncoder),
                     mimetype='application/json')
 
@@ -122,17 +127,19 @@ class FlaskServer(Flask):
                 setattr(self.__db.tables, tbl_name, tbl_inst)
 
     def __init__(self, server_name, logger=logging.getLogger(),
-                 debug=False, token_key=None):
+                 debug=False, token_key=None, token_cache_size=1024):
         """ Constructs the server.
             logger - The main logger to use.
             debug - If set to true, enable flask debug mode
                     (Which includes far more details in returned errors, etc...)
+            token_cache_size - The maximum number of verified tokens the
+                               ACLManager keeps, 0 to disable the cache.
         """
         Flask.__init__(self, server_name)
         self.debug = debug
         self.before_request(self.__init_handler)
         self.after_request(self.__access_log)
-        self.__acl_manager = ACLManager(logger)
+        self.__acl_manager = ACLManager(logger, token_cache_size)
         self.__update_dbctx(None)
         self.__db_classes = []
         self.__db_insts = []
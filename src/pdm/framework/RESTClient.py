@@ -3,8 +3,12 @@
 """
 
 import json
+import threading
+from cookielib import DefaultCookiePolicy
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from requests.packages.urllib3.util.retry import Retry
 
 from pdm.utils.config import ConfigSystem
 
@@ -45,6 +49,14 @@ class RESTException(RuntimeError):
 class RESTClient(object):
     """ A REST client base class. """
 
+    # Methods which are safe to re-send if the server may have seen them.
+    # Failures to connect are retried for all methods.
+    RETRY_METHODS = frozenset(['HEAD', 'GET', 'OPTIONS'])
+
+    # Shared sessions (connection pools), keyed by (url, ssl_opts, pool_opts).
+    __sessions = {}
+    __sessions_lock = threading.Lock()
+
     def __locate(self, service):
         """ Returns the URL (endpoint) for a given service.
         """
@@ -65,6 +77,45 @@ class RESTClient(object):
             ssl_opts = (cafile, cert, key)
         return ssl_opts
 
+    @staticmethod
+    def __get_session(key):
+        """ Gets the shared session for a given key, creating it if needed.
+            key - Tuple of (url, ssl_opts, pool_opts), where pool_opts is
+                  (pool_size, keep_alive, retries, retry_backoff).
+            The session is shared by all clients with the same key and is
+            safe to use from multiple threads as no per-client state is
+            stored on it.
+            Returns a requests.Session object.
+        """
+        with RESTClient.__sessions_lock:
+            session = RESTClient.__sessions.get(key)
+            if session is None:
+                pool_size, keep_alive, retries, retry_backoff = key[2]
+                session = requests.Session()
+                # The session is shared between users, so never keep cookies.
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                if not keep_alive:
+                    session.headers['Connection'] = 'close'
+                max_retries = Retry(total=retries,
+                                    backoff_factor=retry_backoff,
+                                    method_whitelist=RESTClient.RETRY_METHODS)
+                adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=max_retries)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                RESTClient.__sessions[key] = session
+            return session
+
+    @staticmethod
+    def close_sessions():
+        """ Closes all shared sessions and their pooled connections.
+            New sessions are created as required by later requests.
+            Returns None.
+        """
+        with RESTClient.__sessions_lock:
+            for session in RESTClient.__sessions.itervalues():
+                session.close()
+            RESTClient.__sessions.clear()
+
     def __init__(self, service, ssl_opts=None, token=None):
         """ Initialise a client for a given service.
             service - The common name of the service to contact.
@@ -79,6 +130,10 @@ class RESTClient(object):
         self.__ssl_opts = self.__get_ssl_opts(ssl_opts, client_conf)
         self.__token = token
         self.__timeout = client_conf.pop("timeout", 20)
+        self.__pool_opts = (client_conf.pop("pool_size", 10),
+                            client_conf.pop("keep_alive", True),
+                            client_conf.pop("retries", 3),
+                            client_conf.pop("retry_backoff", 0.2))
         # Check that all config parameters were consumed
         if client_conf:
             keys = ', '.join(client_conf.keys())
@@ -118,8 +173,10 @@ class RESTClient(object):
         request_args['verify'] = cafile
         request_args['cert'] = client_cert
         request_args['timeout'] = self.__timeout
+        session = self.__get_session((self.__url, tuple(self.__ssl_opts),
+                                      self.__pool_opts))
         try:
-            resp = requests.request(method, full_url, **request_args)
+            resp = session.request(method, full_url, **request_args)
         except RequestException as err:
             raise RESTException(None, str(err))
         #pylint: disable=no-member
@@ -116,7 +116,9 @@ class ExecutableServer(object):
         # Create Flask server & config basics
         logger = self.__init_log(wsgi_name, wsgi_config)
         server_name = wsgi_config.pop("static", wsgi_name)
-        app_server = FlaskServer(server_name, logger, self.__debug, secret)
+        token_cache_size = wsgi_config.pop("token_cache_size", 1024)
+        app_server = FlaskServer(server_name, logger, self.__debug, secret,
+                                 token_cache_size)
         db_uri = wsgi_config.pop("db", None)
         if db_uri:
             app_server.enable_db(db_uri)
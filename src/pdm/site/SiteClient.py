@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 """ Site service client module. """
 
+import copy
+import time
+import threading
+from collections import OrderedDict
+
 from pdm.framework.RESTClient import RESTClient
 
 class SiteClient(RESTClient):
@@ -9,9 +14,60 @@ class SiteClient(RESTClient):
         of parameters & return values.
     """
 
-    def __init__(self):
-        """ Create the site client. """
+    def __init__(self, cache_ttl=0, cache_size=256):
+        """ Create the site client.
+            cache_ttl - Optional time (s) for which the site list, site
+                        details and endpoints are cached. 0 (default)
+                        disables caching.
+            cache_size - Maximum number of responses to cache, the least
+                         recently used are dropped first.
+            The cache may be shared by threads using the same client.
+        """
         super(SiteClient, self).__init__('site')
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        self._cache = OrderedDict()  # uri: (expiry time, response)
+        self._cache_lock = threading.Lock()
+
+    def __cached_get(self, uri):
+        """ Get uri, from the cache if caching is enabled and the
+            response there hasn't expired.
+            Returns a copy of the response so callers may modify it.
+        """
+        if not self._cache_ttl:
+            return self.get(uri)
+        now = time.time()
+        with self._cache_lock:
+            entry = self._cache.pop(uri, None)
+            if entry is not None and entry[0] > now:
+                self._cache[uri] = entry
+                return copy.deepcopy(entry[1])
+        # Not held while fetching, so other requests aren't held up by this one.
+        entry = (now + self._cache_ttl, self.get(uri))
+        with self._cache_lock:
+            self._cache[uri] = entry
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return copy.deepcopy(entry[1])
+
+    def invalidate(self, site_id=None):
+        """ Drop cached responses about site_id (and the site list) so
+            they are fetched again on next use, or all cached responses
+            if site_id is None. Call this when a site has been changed.
+        """
+        with self._cache_lock:
+            if site_id is None:
+                self._cache.clear()
+                return
+            for uri in ('site', 'site/%u' % site_id, 'endpoint/%u' % site_id):
+                self._cache.pop(uri, None)
+
+    def set_token(self, token):
+        """ Set the token to use for future requests.
+            Drops any cached responses as what is visible depends on the token.
+        """
+        super(SiteClient, self).set_token(token)
+        self.invalidate()
 
     def get_service_info(self):
         """ Get information about the service.
@@ -21,29 +77,33 @@ class SiteClient(RESTClient):
     def get_sites(self):
         """ Gets a list of all visible sites.
         """
-        return self.get('site')
+        return self.__cached_get('site')
 
     def get_site(self, site_id):
         """ Gets all details about a specific site. """
-        return self.get('site/%u' % site_id)
+        return self.__cached_get('site/%u' % site_id)
 
     def add_site(self, site_info):
         """ Adds a site to the database.
             site_info is a dictionary of details.
         """
-        return self.post('site', site_info)
+        site_id = self.post('site', site_info)
+        self.invalidate(site_id)
+        return site_id
 
     def del_site(self, site_id):
         """ Deletes a site. """
         self.delete('site/%u' % site_id)
+        self.invalidate(site_id)
 
     def get_endpoints(self, site_id):
         """ Gets a list of site gridftp endpoints. """
-        return self.get('endpoint/%u' % site_id)
+        return self.__cached_get('endpoint/%u' % site_id)
 
     def del_user(self, user_id):
         """ Deletes all data relating to user_id. """
         self.delete('user/%u' % user_id)
+        self.invalidate()
 
     def get_session_info(self, site_id):
         """ Get session info for user at site. """
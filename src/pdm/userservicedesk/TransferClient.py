@@ -15,25 +15,36 @@ class TransferClient(object):
     Transfer management client API. To list, copy and remove files from remote site.
     """
 
-    def __init__(self, user_token):
+    def __init__(self, user_token, site_cache_ttl=None):
         """
         Constructor initialises all service clients involved in the transfer management:
         EndpointService, CredService and finally the WorkqueueService.
 
         :param user_token: user token
+        :param site_cache_ttl: time (s) the site list is cached for, None (default) to keep it
+                               for the lifetime of the client. It is only fetched when needed.
         """
 
         self.__user_token = user_token
         # endpoint
-        self.__site_client = SiteClient()
+        self.__site_client = SiteClient(
+            cache_ttl=float('inf') if site_cache_ttl is None else site_cache_ttl)
         self.__site_client.set_token(user_token)
-        self.__sitelist = self.__site_client.get_sites()
         # get user id
         self.__user_id = HRService.get_token_userid(user_token)
         # work queue client
         self.__wq_client = WorkqueueClient()
         self.__wq_client.set_token(user_token)
 
+    @property
+    def __sitelist(self):
+        """
+        Sites visible to the user, cached by the site client.
+
+        :return: list of site dictionaries.
+        """
+        return self.__site_client.get_sites()
+
     def list(self, src_site, src_filepath, **kwargs):
         """
         List a given path. As for all client calls it need a user token set in a request beforehand.
@@ -181,14 +192,17 @@ class TransferClient(object):
 
         return response
 
-    def jobs(self):
+    def jobs(self, limit=None, offset=0, since=None):
         """
         Get user jobs' info.
 
+        :param limit: maximum number of jobs to return (None = all)
+        :param offset: number of jobs to skip
+        :param since: only return jobs updated since this UTC time (datetime or ISO string)
         :return: forwarded response from \
         :func:`WorkqueueClient.jobs() <pdm.workqueue.WorkqueueClient.WorkqueueClient.jobs>`.
         """
-        response = self.__wq_client.jobs()
+        response = self.__wq_client.jobs(limit=limit, offset=offset, since=since)
         return response
 
     def elements(self, job_id):
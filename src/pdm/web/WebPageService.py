@@ -4,7 +4,8 @@
 import json
 import hashlib
 import stat
-import time
+import threading
+from collections import OrderedDict
 from operator import itemgetter
 
 import jinja2
@@ -39,13 +40,35 @@ def gravatar_hash(email_add):
 jinja2.filters.FILTERS['gravatar_hash'] = gravatar_hash
 
 
+def transfer_client():
+    """
+    Get a TransferClient for the session's token.
+
+    Clients are shared by all the requests using the same token so that the site list they
+    hold is only fetched once per site_cache_ttl rather than for every request. Requests are
+    served by several threads, so a shared client (its SiteClient cache and RESTClient
+    sessions) must be safe to use from more than one thread at a time.
+
+    Returns:
+        TransferClient: The client for the user's token.
+    """
+    token = flask.session['token']
+    with current_app.transfer_clients_lock:
+        tclient = current_app.transfer_clients.pop(token, None)
+        if tclient is None:
+            tclient = TransferClient(token, site_cache_ttl=current_app.site_cache_ttl)
+        current_app.transfer_clients[token] = tclient
+        while len(current_app.transfer_clients) > current_app.transfer_clients_size:
+            current_app.transfer_clients.popitem(last=False)
+    return tclient
+
+
 @export_ext("/web", redir="/web/datamover?return_to=%(return_to)s")
 class WebPageService(object):
     """The Datamover's web page service."""
 
     @staticmethod
     @startup
-    # pylint: disable=unused-argument
     def startup_web(config):
         """Configure the web service."""
         current_app.log.info("Web interface starting")
@@ -53,6 +76,11 @@ class WebPageService(object):
         current_app.hrutils = HRUtils()
         current_app.siteclient = SiteClient()
         current_app.site_map = {}
+        # TransferClients by token, least recently used first.
+        current_app.transfer_clients = OrderedDict()
+        current_app.transfer_clients_lock = threading.Lock()
+        current_app.transfer_clients_size = config.pop('transfer_clients', 256)
+        current_app.site_cache_ttl = config.pop('site_cache_ttl', 60)
 
     @staticmethod
     @export_ext("/")
@@ -260,16 +288,14 @@ class WebPageService(object):
     @export_ext("js/jobs")
     def jobs():
         """List a user's jobs."""
-        token = flask.session['token']
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         return json.dumps(tclient.jobs())
 
     @staticmethod
     @export_ext("js/jobs/<int:job_id>/elements")
     def elements(job_id):
         """List elements for a given user's job."""
-        token = flask.session['token']
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         elements = tclient.elements(job_id)
         return json.dumps(elements)
 
@@ -277,8 +303,7 @@ class WebPageService(object):
     @export_ext("js/jobs/<int:job_id>/elements/<int:element_id>/output")
     def element_output(job_id, element_id):
         """Get output for element from a given user's job."""
-        token = flask.session['token']
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         attempts = []
         try:
             attempts = tclient.output(job_id, element_id)[0]
@@ -307,8 +332,7 @@ class WebPageService(object):
         dst_site = request.data['dst_sitename']
         if dst_site not in current_app.site_map:
             abort(404, description="Destination site not known.")
-        token = flask.session['token']
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         tclient.copy(src_site,
                      request.data['src_filepath'],
                      dst_site,
@@ -324,8 +348,7 @@ class WebPageService(object):
         site = request.data['sitename']
         if site not in current_app.site_map:
             abort(404, description="Site not known.")
-        token = flask.session['token']
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         tclient.remove(site, request.data['filepath'])
         return '', 200
 
@@ -337,8 +360,7 @@ class WebPageService(object):
         site = request.data['sitename']
         if site not in current_app.site_map:
             abort(404, description="Site not known.")
-        token = flask.session['token']
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         tclient.mkdir(site, request.data['dst_filepath'])
         return '', 200
 
@@ -350,8 +372,7 @@ class WebPageService(object):
         site = request.data['sitename']
         if site not in current_app.site_map:
             abort(404, description="Site not known.")
-        token = flask.session['token']
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         tclient.rename(site, request.data['src_filepath'], request.data['dst_filepath'])
         return '', 200
 
@@ -379,24 +400,23 @@ class WebPageService(object):
             return render_template("loginform.html", sitename=sitename,
                                    voms_auth=voms_auth, vos=vos), 403
 
-        tclient = TransferClient(token)
+        tclient = transfer_client()
         jobinfo = tclient.list(sitename, filepath, depth=1)
+        if not jobinfo:
+            abort(404, description="Site %s not found" % sitename)
+        # The listing is collected with js_list_status rather than waiting for it here.
+        return json.dumps({'job_id': jobinfo['id']})
 
-        listing_output = []
-        if jobinfo:
-            time.sleep(1)
-            status = tclient.status(jobinfo['id'])
-            while status['status'] not in ('DONE', 'FAILED'):
-                time.sleep(1)  # seconds
-                status = tclient.status(jobinfo['id'])
-
-            if status['status'] == 'DONE':
-                listing_output = [dict(f, is_dir=stat.S_ISDIR(f['st_mode'])) for f in
-                                  tclient.output(jobinfo['id'], 0, -1)[0][0]['listing'].values()[0]]
-            elif jobinfo['status'] == 'FAILED':
-                current_app.log.error("Failed to obtain a listing for job %d", jobinfo['id'])
-            else:
-                current_app.log.warning("Timeout. Last status is %s for job id %d",
-                                        status['status'], jobinfo['id'])
-
-        return json.dumps(listing_output)
+    @staticmethod
+    @export_ext("js/list/<int:job_id>")
+    def js_list_status(job_id):
+        """Get the status of a listing job and the listing once it is done."""
+        tclient = transfer_client()
+        status = tclient.status(job_id)
+        result = {'job_id': job_id, 'status': status['status']}
+        if status['status'] == 'DONE':
+            result['listing'] = [dict(f, is_dir=stat.S_ISDIR(f['st_mode'])) for f in
+                                 tclient.output(job_id, 0, -1)[0][0]['listing'].values()[0]]
+        elif status['status'] == 'FAILED':
+            current_app.log.error("Failed to obtain a listing for job %d", job_id)
+        return json.dumps(result)
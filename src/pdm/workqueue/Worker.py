@@ -11,9 +11,10 @@ import subprocess
 import shutil
 import asyncore
 import logging
+import hashlib
 import threading
 from cStringIO import StringIO
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from pprint import pformat
 from datetime import datetime
 from contextlib import contextmanager
@@ -28,32 +29,77 @@ from pdm.utils.X509 import X509Utils
 from pdm.utils.daemon import Daemon
 from pdm.utils.config import getConfig
 
-from .WorkqueueDB import COMMANDMAP, PROTOCOLMAP, JobType
+from .WorkqueueDB import COMMANDMAP, PROTOCOLMAP, JobType, JobProtocol
 
 
-@contextmanager
-def temporary_ca_dir(cas, dir_path=None, template_dir=None):
+class CADirCache(object):
     """
-    Context for creating a temporary CA directory.
+    Cache of CA directories for jobs.
 
-    Temporary directory is automatically removed when exiting context.
+    Directories are keyed on a hash of the CAs and template dir (including its modification
+    time, so updates to the template are picked up) they are made from. They are reference
+    counted while jobs use them and once there are more than max_size those not in use are
+    removed, least recently used first.
+    """
 
-    Args:
-        cas (list): List of CA certs in string form.
-        dir_path (str): Path to use for temporary ca directory. If None (default) then a
-                        random dir_path is created.
-        template_dir (str): Path to a directory to use as a template for the temporary
-                            ca dir. All certs in this directory are duplicated in the new one.
-                            If None (default) then don't use a template directory.
+    def __init__(self, max_size=16):
+        """Initialisation."""
+        self._max_size = max_size
+        self._entries = OrderedDict()  # key: [ca_dir, refcount], least recently used first
+
+    @staticmethod
+    def _key(cas, template_dir):
+        """Hash the CAs and template dir."""
+        key = hashlib.sha1()
+        if template_dir is not None:
+            try:
+                mtime = os.stat(template_dir).st_mtime
+            except OSError:
+                mtime = None
+            key.update('%s\0%r\0' % (template_dir, mtime))
+        for ca_pem in cas:
+            key.update(ca_pem)
+            key.update('\0')
+        return key.hexdigest()
+
+    @contextmanager
+    def ca_dir(self, cas, template_dir=None):
+        """
+        Context for using a CA directory.
+
+        Args:
+            cas (list): List of CA certs in string form.
+            template_dir (str): Path to a directory to use as a template for the ca dir. All
+                                certs in this directory are duplicated in the new one.
+                                If None (default) then don't use a template directory.
+
+        Returns:
+            str: The ca dir.
+        """
+        key = self._key(cas, template_dir)
+        entry = self._entries.pop(key, None)
+        if entry is None or not os.path.isdir(entry[0]):
+            entry = [X509Utils.add_ca_to_dir(cas, template_dir=template_dir), 0]
+        self._entries[key] = entry
+        entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            entry[1] -= 1
+            self._evict(self._max_size)
 
-    Returns:
-        str: The temporary ca dir.
-    """
-    ca_dir = X509Utils.add_ca_to_dir(cas,
-                                     dir_path=dir_path,
-                                     template_dir=template_dir)
-    yield ca_dir
-    shutil.rmtree(ca_dir, ignore_errors=True)
+    def _evict(self, max_size):
+        """Remove unused directories, least recently used first, down to max_size."""
+        for key, (ca_dir, refcount) in self._entries.items():
+            if len(self._entries) <= max_size:
+                break
+            if not refcount:
+                del self._entries[key]
+                shutil.rmtree(ca_dir, ignore_errors=True)
+
+    def clear(self):
+        """Remove all the directories not in use."""
+        self._evict(0)
 
 
 @contextmanager
@@ -117,15 +163,25 @@ class BufferingDispatcher(asyncore.file_dispatcher):
 
 
 class StdOutDispatcher(asyncore.file_dispatcher):
-    """Asynchronous dispatcher for subprocess stdout."""
+    """
+    Asynchronous dispatcher for subprocess stdout.
+
+    For a persistent executor (which runs many jobs) the job is only complete once the
+    executor reports it is done with the job rather than once all the elements are returned.
+    Closing the dispatcher only closes its duplicate of the fd so the executor carries on.
+    Forcing the completion of a persistent job's elements leaves the dispatcher open to read
+    the rest of the executor's output for the job.
+    """
 
-    def __init__(self, fd, tokens, stderr_dispatcher, callback):
+    def __init__(self, fd, tokens, stderr_dispatcher, callback, persistent=False):
         """Initialisation."""
         asyncore.file_dispatcher.__init__(self, fd)
         self._fd = fd
         self._tokens = tokens
         self._stderr_dispatcher = stderr_dispatcher
         self._callback = callback
+        self._persistent = persistent
+        self.done = False  # whether a persistent executor reported it was done with the job
         self._logger = logging.getLogger(self.__class__.__name__)
         self._buffer = ''
         self._log_dict = defaultdict(StringIO)
@@ -137,7 +193,7 @@ class StdOutDispatcher(asyncore.file_dispatcher):
     def readable(self):
         """Readable status of fd."""
         # Note as we use self._fd directly (rather than self.recv) close is not called automatically
-        if not self._tokens:
+        if not self._tokens and not self._persistent:
             self.close()
             return False
         return True
@@ -162,11 +218,32 @@ class StdOutDispatcher(asyncore.file_dispatcher):
             self._callback('worker/jobs/{job_id}/elements/{element_id}',
                            *element_id.split('.'), token=token, data=data)
         self._tokens.clear()  # will cause readable to close fd on next iteration.
+        if self._persistent:
+            return  # the executor's Done for the job is still to be read.
         try:
             self.close()  # fd possibly already closed
         except OSError:
             pass
 
+    @staticmethod
+    def _normalise_listing(done_element):
+        """
+        Get the listing data to upload from a done element.
+
+        The listing roots are converted from URLs to paths. A compact listing, one list of
+        values per entry, is passed on as is along with its column names.
+        """
+        normalised_listing = {}
+        for root, entries in done_element['Listing'].iteritems():
+            root = urlsplit(root).path
+            if root.startswith('/~'):
+                root = root.lstrip('/')
+            normalised_listing[root] = entries
+        data = {'listing': normalised_listing}
+        if 'Columns' in done_element:
+            data['columns'] = done_element['Columns']
+        return data
+
     def handle_read(self):
         """Handle read events."""
         self._buffer += self.recv(8192)
@@ -181,6 +258,16 @@ class StdOutDispatcher(asyncore.file_dispatcher):
                 self.close()
                 return
 
+            if 'Done' in done_element:  # persistent executor finished with the job
+                self.done = True
+                if self._tokens:
+                    # Elements the executor never returned have failed, whatever it says.
+                    self.force_complete(returncode=done_element['Done'] or 1,
+                                        extra_log='Executor finished the job without '
+                                                  'returning this element.')
+                self.close()
+                return
+
             element_id = done_element['id']
             if 'domain' in done_element:
                 self._log_dict[element_id].write('{domain} -- {stage} -- {desc}\n'
@@ -194,6 +281,16 @@ class StdOutDispatcher(asyncore.file_dispatcher):
                                   "to WorkqueueService.", element_id)
                 self._callback('worker/jobs/{job_id}/elements/{element_id}/monitoring',
                                *element_id.split('.'), token=token, data=done_element)
+            elif 'Listing' in done_element and 'Code' not in done_element:
+                token = self._tokens.get(element_id)
+                if token is None:
+                    self._logger.error("No token found for job %s", element_id)
+                    continue
+                self._logger.info("Uploading partial listing for job.element %s "
+                                  "to WorkqueueService.", element_id)
+                self._callback('worker/jobs/{job_id}/elements/{element_id}/listing',
+                               *element_id.split('.'), token=token,
+                               data=self._normalise_listing(done_element))
             elif 'Code' in done_element:
                 log = self._log_dict.pop(element_id, StringIO())
                 log.write(self._stderr_dispatcher.buffer)
@@ -212,16 +309,14 @@ class StdOutDispatcher(asyncore.file_dispatcher):
 
                 if not element_id:  # whole job failure
                     self.force_complete(returncode=returncode)
-                    return
+                    continue
 
+                token = self._tokens.pop(element_id, None)
+                if token is None:  # e.g. already timed out
+                    self._logger.error("No token found for job %s", element_id)
+                    continue
                 if 'Listing' in done_element:
-                    data['listing'] = {}
-                    for root, listing in done_element['Listing'].iteritems():
-                        root = urlsplit(root).path
-                        if root.startswith('/~'):
-                            root = root.lstrip('/')
-                        data['listing'][root] = listing
-                token = self._tokens.pop(element_id)
+                    data.update(self._normalise_listing(done_element))
                 self._logger.info("Uploading output log for job.element %s to WorkqueueService.",
                                   element_id)
                 self._callback('worker/jobs/{job_id}/elements/{element_id}',
@@ -249,6 +344,31 @@ class Worker(RESTClient, Daemon):  # pylint: disable=too-many-instance-attribute
         self._alg = conf.pop('algorithm', 'BY_NUMBER').upper()
         self._alg_args = conf.pop('algorithm.args', {})
         self._interpoll_sleep_time = conf.pop('poll_time', 2)
+        # Number of jobs (subprocesses) to run concurrently.
+        self._slots = conf.pop('slots', 1)
+        # Time (s) the WorkqueueService may hold a request open waiting for work (0 disables).
+        # Must be shorter than the client timeout.
+        self._long_poll_time = conf.pop('long_poll_time', 0)
+        # Results are buffered for up to upload_flush_time (s) and sent back to the
+        # WorkqueueService in batches of at most upload_batch_size (0 disables batching).
+        self._upload_flush_time = conf.pop('upload_flush_time', 1)
+        self._upload_batch_size = conf.pop('upload_batch_size', 500)
+        # A batch that fails to upload is retried with the next flush up to upload_retries
+        # times before its results are uploaded one at a time.
+        self._upload_retries = conf.pop('upload_retries', 3)
+        self._upload_failures = 0
+        self._upload_queue = []
+        self._upload_queue_start = None
+        # Listings for COPY/REMOVE jobs are streamed back in parts of about this many
+        # entries so that elements can be processed before the listing finishes (0 disables).
+        self._listing_chunk_size = conf.pop('listing_chunk_size', 1000)
+        self._listing_concurrency = conf.pop('listing_concurrency', 1)
+        # Run gridftp jobs in long lived executor processes, reused from one job to the next,
+        # rather than starting a new script process for every job.
+        self._persistent_executors = conf.pop('persistent_executors', False)
+        self._executors = []
+        # CA dirs are reused by jobs needing the same CAs, keeping up to this many.
+        self._ca_dirs = CADirCache(conf.pop('ca_dir_cache_size', 16))
         self._timeouts = {JobType.LIST: 120,
                           JobType.COPY: 3600,
                           JobType.REMOVE: 120,
@@ -262,9 +382,10 @@ class Worker(RESTClient, Daemon):  # pylint: disable=too-many-instance-attribute
         self._script_path = conf.pop('script_path',
                                      os.path.join(os.path.dirname(__file__), 'scripts'))
         self._script_path = os.path.abspath(self._script_path)
-        self._site_client = SiteClient()
+        # Site endpoints and CAs rarely change so are cached for site_cache_ttl (s).
+        self._site_client = SiteClient(cache_ttl=conf.pop('site_cache_ttl', 300))
         self._n_shot = n_shot
-        self._current_process = None
+        self._processes = set()
 
         # Check for unused config options
         if conf:
@@ -282,11 +403,27 @@ class Worker(RESTClient, Daemon):  # pylint: disable=too-many-instance-attribute
     def terminate(self, *_):
         """Terminate worker daemon."""
         Daemon.terminate(self, *_)
-        if self._current_process is not None:
-            self._current_process.terminate()
+        for process in list(self._processes):
+            process.terminate()
 
     def _upload(self, target, job_id, element_id, token, data):
-        """Upload results to WorkqueueService."""
+        """Upload results to WorkqueueService (or queue them for the next batch upload)."""
+        # Partial listings are large and unblock new work, so they are never held back.
+        if self._upload_flush_time and not target.endswith('/listing'):
+            if not self._upload_queue:
+                self._upload_queue_start = time.time()
+            self._upload_queue.append({'job_id': int(job_id),
+                                       'element_id': int(element_id),
+                                       'token': token,
+                                       'monitoring': target.endswith('/monitoring'),
+                                       'payload': data})
+            if len(self._upload_queue) >= self._upload_batch_size:
+                self._flush_uploads(force=True)
+            return
+        self._put_result(target, job_id, element_id, token, data)
+
+    def _put_result(self, target, job_id, element_id, token, data):
+        """Upload a single result to WorkqueueService."""
         self._logger.debug("Uploading following data for job.element %s.%s to WorkqueueService: %s",
                            job_id, element_id, pformat(data))
         self.set_token(token)
@@ -297,7 +434,63 @@ class Worker(RESTClient, Daemon):  # pylint: disable=too-many-instance-attribute
         finally:
             self.set_token(None)
 
-    # pylint: disable=too-many-locals, too-many-branches, too-many-statements
+    def _flush_uploads(self, force=False):
+        """
+        Upload queued results to WorkqueueService in a single request.
+
+        Args:
+            force (bool): Upload the queue even if the flush window has not yet elapsed.
+        """
+        if not self._upload_queue:
+            return
+        if not force and time.time() - self._upload_queue_start < self._upload_flush_time:
+            return
+        results, self._upload_queue = self._upload_queue, []
+        self._logger.debug("Uploading batch of %d results to WorkqueueService: %s",
+                           len(results), pformat(results))
+        try:
+            responses = self.put('worker/jobs/elements', data=results)
+        except (RESTException, Timeout) as err:
+            if getattr(err, 'code', None) == 404:
+                self._logger.warning("WorkqueueService does not accept batches of results, "
+                                     "uploading them one at a time.")
+                self._upload_flush_time = 0  # no more batching
+                self._put_results(results)
+                return
+            self._upload_failures += 1
+            if self._upload_failures > self._upload_retries:
+                self._logger.exception("Error trying to PUT back batch of outputs from "
+                                       "subcommand, uploading them one at a time.")
+                self._upload_failures = 0
+                self._put_results(results)
+                return
+            self._logger.exception("Error trying to PUT back batch of outputs from subcommand, "
+                                   "will retry (%d of %d).", self._upload_failures,
+                                   self._upload_retries)
+            self._upload_queue[:0] = results
+            self._upload_queue_start = time.time()
+            return
+        self._upload_failures = 0
+        for response in responses:
+            if response['code'] != 200:
+                self._logger.error("WorkqueueService rejected result for job.element %s.%s "
+                                   "(%s): %s", response['job_id'], response['element_id'],
+                                   response['code'], response.get('description'))
+
+    def _put_results(self, results):
+        """
+        Upload queued results to WorkqueueService one at a time.
+
+        Args:
+            results (list): The queued results, as built by _upload.
+        """
+        for result in results:
+            target = 'worker/jobs/{job_id}/elements/{element_id}'
+            if result['monitoring']:
+                target += '/monitoring'
+            self._put_result(target, result['job_id'], result['element_id'],
+                             result['token'], result['payload'])
+
     def run(self):
         """Daemon main method."""
         # remove any proxy left around as will mess up copy jobs.
@@ -306,125 +499,298 @@ class Worker(RESTClient, Daemon):  # pylint: disable=too-many-instance-attribute
         except OSError:
             pass
 
-        while self.should_run:
-            self._logger.info("Getting workload from WorkqueueService.")
-            try:
-                workload = self.post('worker/jobs', data={'types': self._types,
-                                                          'algorithm': self._alg,
-                                                          'algorithm.args': self._alg_args})
-            except Timeout:
-                self._logger.warning("Timed out contacting the WorkqueueService.")
-                continue
-            except RESTException as err:
-                if err.code == 404:
-                    self._logger.info("WorkqueueService reports no work to be done.")
-                else:
-                    self._logger.exception("Error trying to get work from WorkqueueService.")
-                time.sleep(self._interpoll_sleep_time)
-                continue
-            self._logger.info("Workload of %d job elements acquired from WorkqueueService.",
-                              sum(len(job['elements']) for job in workload))
-
-            for job in workload:
-                self._logger.info("Processing job %d", job['id'])
-                self._logger.debug("Job %d: %s", job['id'], pformat(job))
-                # Get CAs and endpoints for job.
-                cas = []
-                credentials = [job['src_credentials']]
-                template_ca_dir = self._system_ca_dir
-                src_endpoint_dict = self._site_client.get_endpoints(job['src_siteid'])
-                src_endpoints = src_endpoint_dict['endpoints']
+        running_jobs = []
+        polling = True
+        next_poll = 0
+        # Run the loop one iteration at a time so queued results are flushed
+        # even while the subprocesses are quiet.
+        loop_timeout = min(self._upload_flush_time, 2) or 2
+        while polling or running_jobs:
+            free_slots = self._slots - len(running_jobs)
+            # Only ask for as many jobs as there are free slots. While jobs are running poll
+            # without waiting so their output keeps being handled, at most once per poll_time.
+            if polling and free_slots > 0 and (not running_jobs or time.time() >= next_poll):
+                polling = self.should_run
+                if polling:
+                    for job in self._get_workload(free_slots, wait=not running_jobs):
+                        job_runner = self._run_job(job)
+                        if next(job_runner, False):
+                            running_jobs.append(job_runner)
+                    if running_jobs:
+                        next_poll = time.time() + self._interpoll_sleep_time
+            if running_jobs:
+                asyncore.loop(timeout=loop_timeout, count=1)
+                self._flush_uploads()
+                running_jobs = [job_runner for job_runner in running_jobs
+                                if next(job_runner, False)]
+        # Results still queued after a failed upload are not left behind.
+        self._flush_uploads(force=True)
+        results, self._upload_queue = self._upload_queue, []
+        self._put_results(results)
+        self._close_executors()
+        self._ca_dirs.clear()
+
+    def _get_executor(self):
+        """Get an idle persistent executor, starting a new one if there are none."""
+        while self._executors:
+            executor = self._executors.pop()
+            if executor.poll() is None:
+                return executor
+            self._processes.discard(executor)
+            self._logger.warning("Persistent executor exited with return: %s",
+                                 executor.returncode)
+        self._logger.info("Starting new persistent executor.")
+        executor = subprocess.Popen([os.path.join(self._script_path, 'pdm_gfal2_executor.py')],
+                                    bufsize=0,
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        self._processes.add(executor)
+        return executor
+
+    # pylint: disable=too-many-arguments
+    def _executor_timeout(self, job, executor, stdout_dispatcher, elapsed, timeout, timed_out):
+        """
+        Time out a job running in a persistent executor.
+
+        Once the job has run for timeout seconds its outstanding elements are failed while the
+        executor is left to finish with the job, so that it can be reused. Should it still not
+        have finished after a further timeout seconds it is taken to be hung and killed.
+
+        Args:
+            job (dict): The job being run.
+            executor (subprocess.Popen): The executor running the job.
+            stdout_dispatcher (StdOutDispatcher): The dispatcher reading the executor output.
+            elapsed (float): How long the job has been running for.
+            timeout (int/float): The job timeout.
+            timed_out (bool): Whether the job's elements have already been timed out.
+
+        Returns:
+            bool: Whether the job's elements have been timed out.
+        """
+        if not timed_out and elapsed > timeout:
+            self._logger.error("Job %s timed out in persistent executor.", job['id'])
+            stdout_dispatcher.force_complete(returncode=-9, extra_log='Operation timed out!')
+            return True
+        if timed_out and elapsed > 2 * timeout and executor.poll() is None:
+            self._logger.error("Persistent executor hung on job %s, killing it.", job['id'])
+            executor.kill()
+        return timed_out
+
+    def _close_executors(self):
+        """Shut down the idle persistent executors."""
+        while self._executors:
+            executor = self._executors.pop()
+            executor.stdin.close()  # executor exits at the end of its input
+            executor.wait()
+            self._processes.discard(executor)
+
+    def _get_workload(self, max_jobs, wait=True):
+        """
+        Get a workload from the WorkqueueService.
+
+        Args:
+            max_jobs (int): The maximum number of jobs to claim.
+            wait (bool): Whether to wait (long-poll/sleep) if there is no work to be done.
+
+        Returns:
+            list: The claimed jobs with their elements.
+        """
+        self._logger.info("Getting workload from WorkqueueService.")
+        request_data = {'types': self._types,
+                        'algorithm': self._alg,
+                        'algorithm.args': self._alg_args,
+                        'max_jobs': max_jobs}
+        if self._long_poll_time and wait:
+            request_data['wait'] = self._long_poll_time
+        poll_start = time.time()
+        try:
+            workload = self.post('worker/jobs', data=request_data)
+        except Timeout:
+            self._logger.warning("Timed out contacting the WorkqueueService.")
+            return []
+        except RESTException as err:
+            if err.code == 404:
+                self._logger.info("WorkqueueService reports no work to be done.")
+            else:
+                self._logger.exception("Error trying to get work from WorkqueueService.")
+            if wait:
+                # Only sleep for whatever part of the poll time a long-poll didn't already wait.
+                time.sleep(max(self._interpoll_sleep_time - (time.time() - poll_start), 0))
+            return []
+        self._logger.info("Workload of %d job elements acquired from WorkqueueService.",
+                          sum(len(job['elements']) for job in workload))
+        return workload
+
+    # pylint: disable=too-many-locals, too-many-branches, too-many-statements
+    def _run_job(self, job):
+        """
+        Run a job in a subprocess.
+
+        This is a generator which starts the subprocess and then yields True each time it is
+        advanced until the job has finished, so that many jobs can be run concurrently from
+        the one asyncore loop. The temporary proxy files and ca dir for the job live until the
+        generator is exhausted (or closed).
+
+        Args:
+            job (dict): The job, with its claimed elements, as returned by the WorkqueueService.
+        """
+        self._logger.info("Processing job %d", job['id'])
+        self._logger.debug("Job %d: %s", job['id'], pformat(job))
+        # Get CAs and endpoints for job.
+        cas = []
+        credentials = [job['src_credentials']]
+        template_ca_dir = self._system_ca_dir
+        src_endpoint_dict = self._site_client.get_endpoints(job['src_siteid'])
+        src_endpoints = src_endpoint_dict['endpoints']
+        if 'cas' in src_endpoint_dict:
+            cas.extend(src_endpoint_dict['cas'])
+            template_ca_dir = None
+
+        if job['type'] in (JobType.COPY, JobType.RENAME):
+            dst_endpoint_dict = self._site_client.get_endpoints(job['dst_siteid'])
+            dst_endpoints = dst_endpoint_dict['endpoints']
+
+        if job['type'] == JobType.COPY:
+            credentials.append(job['dst_credentials'])
+            template_ca_dir = self._system_ca_dir
+            if 'cas' in dst_endpoint_dict:
+                cas.extend(dst_endpoint_dict['cas'])
                 if 'cas' in src_endpoint_dict:
-                    cas.extend(src_endpoint_dict['cas'])
                     template_ca_dir = None
 
-                if job['type'] in (JobType.COPY, JobType.RENAME):
-                    dst_endpoint_dict = self._site_client.get_endpoints(job['dst_siteid'])
-                    dst_endpoints = dst_endpoint_dict['endpoints']
-
-                if job['type'] == JobType.COPY:
-                    credentials.append(job['dst_credentials'])
-                    template_ca_dir = self._system_ca_dir
-                    if 'cas' in dst_endpoint_dict:
-                        cas.extend(dst_endpoint_dict['cas'])
-                        if 'cas' in src_endpoint_dict:
-                            template_ca_dir = None
-
-                # Set up element id/token map and job stdin data
-                token_map = {}
-                data = {'files': []}
-                options = job['extra_opts']
-                if options is not None:
-                    data.update(options=options)
-                protocol = PROTOCOLMAP[job['protocol']]
-                for element in job['elements']:
-                    element_id = "%d.%d" % (job['id'], element['id'])
-                    token_map[element_id] = element['token']
-                    src = (element_id,
-                           urlunsplit((protocol,
-                                       random.choice(src_endpoints),
-                                       element['src_filepath'], '', '')))
-                    if element['type'] in (JobType.COPY, JobType.RENAME):
-                        data['files'].append(src + (urlunsplit((protocol,
-                                                                random.choice(dst_endpoints),
-                                                                element['dst_filepath'], '', '')),))
-                    # pylint: disable=bad-continuation
-                    elif element['type'] == JobType.MKDIR\
-                            or (element['type'] == JobType.REMOVE and
-                                element['src_filepath'].endswith('/')):
-                        data.setdefault('dirs', []).append(src)
-                    else:
-                        data['files'].append(src)
-
-                # Correct command, data options and credentials for LIST component of
-                # COPY/REMOVE/RENAME jobs.
-                command = shlex.split(COMMANDMAP[job['type']][job['protocol']])
-                if job['type'] != JobType.LIST\
-                        and len(job['elements']) == 1\
-                        and job['elements'][0]['type'] == JobType.LIST:
-                    command = shlex.split(COMMANDMAP[JobType.LIST][job['protocol']])
-                    data.pop('options', None)  # don't pass COPY/REMOVE options to scripts.
-                    if job['type'] == JobType.COPY and len(credentials) == 2:
-                        credentials.pop()  # remove dst_creds to get correct proxy env var
-                command[0] = os.path.join(self._script_path, command[0])
-                self._logger.info("Running elements in subprocess (%s).", command[0])
-
-                # run job in subprocess with temporary proxy files and ca dir
-                with temporary_proxy_files(*credentials) as proxy_env_vars,\
-                        temporary_ca_dir(cas, template_dir=template_ca_dir) as ca_dir:
-                    script_env = dict(os.environ, X509_CERT_DIR=ca_dir, **proxy_env_vars)
-                    if self._logger.isEnabledFor(logging.DEBUG):
-                        extra_env = {key: script_env[key] for key in
-                                     set(script_env.iterkeys()).difference(os.environ.iterkeys())}
-                        self._logger.debug("Extra environment variables: %s", pformat(extra_env))
-                    self._logger.debug("Sending subprocess the following data: %s", pformat(data))
-                    self._current_process = subprocess.Popen(command,
-                                                             bufsize=0,
-                                                             stdin=subprocess.PIPE,
-                                                             stdout=subprocess.PIPE,
-                                                             stderr=subprocess.PIPE,
-                                                             env=script_env)
-                    json.dump(data, self._current_process.stdin)
-                    self._current_process.stdin.write('\n')
-                    self._current_process.stdin.flush()
-                    # We have to close stdin to force the subprocess to handle the input
-                    # Otherwise it assumes there may be more data and hangs...
-                    self._current_process.stdin.close()
-                    stderr_dispatcher = BufferingDispatcher(self._current_process.stderr)
-                    stdout_dispatcher = StdOutDispatcher(self._current_process.stdout, token_map,
-                                                         stderr_dispatcher, self._upload)
-
-                    timeout = self._timeouts[job['type']]
-                    kill_timer = threading.Timer(timeout, self._current_process.kill)
-                    if isinstance(timeout, (int, float)):
-                        kill_timer.start()
-                    asyncore.loop(timeout=2)
-                    kill_timer.cancel()
-                    if self._current_process.wait():
-                        returncode = self._current_process.returncode
-                        extra_log = ''
-                        if returncode == -9:
-                            extra_log = 'Operation timed out!'
-                        stdout_dispatcher.force_complete(returncode=returncode, extra_log=extra_log)
-                        self._logger.error("Job %s failed with return: %s", job['id'], returncode)
-                        self._logger.info("Job stderr:\n%s", stderr_dispatcher.buffer)
+        # Set up element id/token map and job stdin data
+        token_map = {}
+        data = {'files': []}
+        options = job['extra_opts']
+        if options is not None:
+            data.update(options=options)
+        if job['type'] == JobType.LIST:
+            # ask for the listing as columns, the scripts not supporting it ignore this.
+            data['options'] = dict(options or {}, compact=True)
+        protocol = PROTOCOLMAP[job['protocol']]
+        for element in job['elements']:
+            element_id = "%d.%d" % (job['id'], element['id'])
+            # One token covers all of the claimed elements, older services sent one each.
+            token_map[element_id] = element.get('token', job.get('token'))
+            src = (element_id,
+                   urlunsplit((protocol,
+                               random.choice(src_endpoints),
+                               element['src_filepath'], '', '')))
+            if element['type'] in (JobType.COPY, JobType.RENAME):
+                data['files'].append(src + (urlunsplit((protocol,
+                                                        random.choice(dst_endpoints),
+                                                        element['dst_filepath'], '', '')),))
+            # pylint: disable=bad-continuation
+            elif element['type'] == JobType.MKDIR\
+                    or (element['type'] == JobType.REMOVE and
+                        element['src_filepath'].endswith('/')):
+                data.setdefault('dirs', []).append(src)
+            else:
+                data['files'].append(src)
+
+        # Correct command, data options and credentials for LIST component of
+        # COPY/REMOVE/RENAME jobs.
+        command = shlex.split(COMMANDMAP[job['type']][job['protocol']])
+        if job['type'] != JobType.LIST\
+                and len(job['elements']) == 1\
+                and job['elements'][0]['type'] == JobType.LIST:
+            command = shlex.split(COMMANDMAP[JobType.LIST][job['protocol']])
+            # don't pass COPY/REMOVE options to scripts.
+            data['options'] = {'compact': True}
+            if job['type'] in (JobType.COPY, JobType.REMOVE) and self._listing_chunk_size:
+                data['options']['chunk_size'] = self._listing_chunk_size
+            if self._listing_concurrency > 1:
+                data['options']['concurrency'] = self._listing_concurrency
+            if job['type'] == JobType.COPY and len(credentials) == 2:
+                credentials.pop()  # remove dst_creds to get correct proxy env var
+        command[0] = os.path.join(self._script_path, command[0])
+        self._logger.info("Running elements in subprocess (%s).", command[0])
+
+        # run job in subprocess with temporary proxy files and ca dir
+        with temporary_proxy_files(*credentials) as proxy_env_vars,\
+                self._ca_dirs.ca_dir(cas, template_dir=template_ca_dir) as ca_dir:
+            script_env = dict(os.environ, X509_CERT_DIR=ca_dir, **proxy_env_vars)
+            if self._logger.isEnabledFor(logging.DEBUG):
+                extra_env = {key: script_env[key] for key in
+                             set(script_env.iterkeys()).difference(os.environ.iterkeys())}
+                self._logger.debug("Extra environment variables: %s", pformat(extra_env))
+            self._logger.debug("Sending subprocess the following data: %s", pformat(data))
+            executor = None
+            if self._persistent_executors and job['protocol'] == JobProtocol.GRIDFTP:
+                process = executor = self._get_executor()
+                json.dump({'script': os.path.basename(command[0]),
+                           'env': dict(proxy_env_vars, X509_CERT_DIR=ca_dir),
+                           'data': data}, process.stdin)
+                process.stdin.write('\n')
+                process.stdin.flush()
+            else:
+                process = subprocess.Popen(command,
+                                           bufsize=0,
+                                           stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE,
+                                           env=script_env)
+                self._processes.add(process)
+                json.dump(data, process.stdin)
+                process.stdin.write('\n')
+                process.stdin.flush()
+                # We have to close stdin to force the subprocess to handle the input
+                # Otherwise it assumes there may be more data and hangs...
+                process.stdin.close()
+            stderr_dispatcher = BufferingDispatcher(process.stderr)
+            stdout_dispatcher = StdOutDispatcher(process.stdout, token_map,
+                                                 stderr_dispatcher, self._upload,
+                                                 persistent=executor is not None)
+
+            timeout = self._timeouts[job['type']]
+            if not isinstance(timeout, (int, float)):
+                timeout = None
+            kill_timer = threading.Timer(timeout, process.kill)
+            # An executor is shared by many jobs so rather than being killed when this one
+            # times out only the job's elements are failed, see _executor_timeout.
+            if timeout is not None and executor is None:
+                kill_timer.start()
+            start_time = time.time()
+            timed_out = False
+            try:
+                # The asyncore loop itself is run by the caller. The stderr of an executor
+                # stays open between jobs.
+                while stdout_dispatcher.connected or\
+                        (executor is None and stderr_dispatcher.connected):
+                    if executor is not None and timeout is not None:
+                        timed_out = self._executor_timeout(job, executor, stdout_dispatcher,
+                                                           time.time() - start_time, timeout,
+                                                           timed_out)
+                    yield True
+            finally:
+                kill_timer.cancel()
+                self._processes.discard(process)
+            stopped = False
+            if executor is not None:
+                stderr_dispatcher.close()
+                if stdout_dispatcher.done and executor.poll() is None:
+                    self._processes.add(executor)
+                    self._executors.append(executor)
+                    self._flush_uploads(force=True)
+                    return
+                # The executor closed its output or exited without finishing the job.
+                self._logger.error("Persistent executor stopped during job %s.", job['id'])
+                if executor.poll() is None:
+                    executor.kill()
+                    stopped = True
+            returncode = process.wait()
+            if returncode or token_map:
+                extra_log = ''
+                if stopped:
+                    returncode = 1
+                    extra_log = 'Persistent executor stopped before finishing the job.'
+                elif returncode == -9:
+                    extra_log = 'Operation timed out!'
+                elif not returncode:
+                    returncode = 1
+                    extra_log = 'Exited without returning this element.'
+                stdout_dispatcher.force_complete(returncode=returncode, extra_log=extra_log)
+                self._logger.error("Job %s failed with return: %s", job['id'], returncode)
+                self._logger.info("Job stderr:\n%s", stderr_dispatcher.buffer)
+            self._flush_uploads(force=True)
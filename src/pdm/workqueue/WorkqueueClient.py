@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 """Client for Workqueue application."""
+from urllib import urlencode
+from datetime import datetime
+
 from pdm.framework.RESTClient import RESTClient
 
 from .WorkqueueDB import JobProtocol
@@ -141,13 +144,28 @@ class WorkqueueClient(RESTClient):
                                         'protocol': protocol,
                                         'extra_opts': kwargs})
 
-    def jobs(self):
+    def jobs(self, limit=None, offset=0, since=None):
         """
         Get all jobs for a user.
 
+        Args:
+            limit (int): The maximum number of jobs to return. (default: None = all)
+            offset (int): The number of jobs to skip, jobs are ordered by id. (default: 0)
+            since (datetime/str): Only return jobs updated at or after this UTC time, given as
+                                  a datetime or ISO format string. (default: None = all)
+
         Returns:
             list: The users jobs as dicts.
         """
+        query = {}
+        if limit is not None:
+            query['limit'] = limit
+        if offset:
+            query['offset'] = offset
+        if since is not None:
+            query['since'] = since.isoformat() if isinstance(since, datetime) else since
+        if query:
+            return self.get('jobs?' + urlencode(sorted(query.items())))
         return self.get('jobs')
 
     def job(self, job_id):
@@ -206,7 +224,8 @@ class WorkqueueClient(RESTClient):
             return self.get('jobs/%s/status' % job_id)
         return self.get('jobs/%s/elements/%s/status' % (job_id, element_id))
 
-    def output(self, job_id, element_id=None, attempt=None):
+    def output(self, job_id, element_id=None, attempt=None,  # pylint: disable=too-many-arguments
+               listing_limit=None, listing_offset=0):
         """
         Get job output.
 
@@ -225,6 +244,10 @@ class WorkqueueClient(RESTClient):
                               (default: None = all)
             attempt (int): The attempt number to get the output from. This may be negative in order
                            to index from the back. (default: None = all)
+            listing_limit (int): The maximum number of listing entries to return for LIST elements.
+                                 (default: None = all)
+            listing_offset (int): The number of listing entries to skip, entries are ordered by
+                                  path. (default: 0)
 
         Returns:
             list: List of lists with the outer list being the list of elements for the given job,
@@ -305,8 +328,15 @@ class WorkqueueClient(RESTClient):
               ]
             ]
         """
+        query = {}
+        if listing_limit is not None:
+            query['listing_limit'] = listing_limit
+        if listing_offset:
+            query['listing_offset'] = listing_offset
+        query = '?' + urlencode(sorted(query.items())) if query else ''
         if element_id is None:
-            return self.get('jobs/%s/output' % job_id)
+            return self.get('jobs/%s/output%s' % (job_id, query))
         if attempt is None:
-            return [self.get('jobs/%s/elements/%s/output' % (job_id, element_id))]
-        return [[self.get('jobs/%s/elements/%s/output/%s' % (job_id, element_id, attempt))]]
+            return [self.get('jobs/%s/elements/%s/output%s' % (job_id, element_id, query))]
+        return [[self.get('jobs/%s/elements/%s/output/%s%s'
+                          % (job_id, element_id, attempt, query))]]
@@ -1,14 +1,22 @@
 """Workqueue SQL DB Module."""
 import uuid
 import re
+import json
+import pickle
+import logging
+from collections import OrderedDict
 from datetime import datetime
+from itertools import islice
 
 from enum import unique, IntEnum
 from flask import current_app, abort
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, object_session
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import (Column, Integer, SmallInteger, ForeignKey,
-                        String, TEXT, TIMESTAMP, CheckConstraint, PickleType)
+from sqlalchemy import (Column, Integer, SmallInteger, BigInteger, ForeignKey,
+                        ForeignKeyConstraint, Index, String, TEXT, TIMESTAMP,
+                        CheckConstraint, case, inspect, select, text, literal_column, and_,
+                        func)
+from sqlalchemy.types import TypeDecorator, LargeBinary
 
 from pdm.framework.Database import JSONMixin
 from pdm.utils.db import managed_session
@@ -98,6 +106,8 @@ COMMANDMAP = {JobType.LIST: {JobProtocol.GRIDFTP: 'pdm_gfal2_ls.py',
                               JobProtocol.SSH: 'echo',
                               JobProtocol.DUMMY: 'dummy.sh mkdir'}}
 SHELLPATH_REGEX = re.compile(r'^[/~][a-zA-Z0-9/_.*~-]*$')
+# SHELLPATH_REGEX for many newline terminated paths at once.
+SHELLPATHS_REGEX = re.compile(r'(?:[/~][a-zA-Z0-9/_.*~-]*\n)*\Z')
 
 
 def shellpath_sanitise(path):
@@ -107,6 +117,23 @@ def shellpath_sanitise(path):
     return path
 
 
+def shellpaths_sanitise(paths):
+    """
+    Sanitise many paths for use in bash shell.
+
+    All of the paths are checked by a single regex match rather than one each. Only if that
+    fails are they checked one at a time, to raise the error for the offending path.
+    """
+    if not paths:
+        return paths
+    joined = '\n'.join(paths) + '\n'
+    # A newline within a path would otherwise split it into (valid) paths.
+    if joined.count('\n') != len(paths) or SHELLPATHS_REGEX.match(joined) is None:
+        for path in paths:
+            shellpath_sanitise(path)
+    return paths
+
+
 class SmartColumn(Column):  # pylint: disable=too-many-ancestors, abstract-method
     """SQLAlchemy model column that knows if it is a requirement or allowed attribute."""
 
@@ -127,22 +154,53 @@ class SmartColumn(Column):  # pylint: disable=too-many-ancestors, abstract-metho
         return self._required or self._allowed
 
 
+class JSONType(TypeDecorator):  # pylint: disable=abstract-method
+    """Column type storing JSON serialisable objects as compact JSON text."""
+
+    impl = TEXT
+
+    def process_bind_param(self, value, dialect):
+        """Encode value to JSON."""
+        if value is None:
+            return None
+        return json.dumps(value, separators=(',', ':'))
+
+    def process_result_value(self, value, dialect):
+        """Decode value from JSON."""
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            # Value written by the PickleType column this type replaced.
+            return pickle.loads(str(value))
+
+
 class SmartColumnAwareMixin(object):
     """Mixin class to facilitate grouping of required or allowed columns."""
 
     @classmethod
     def required_args(cls):
         """Get required args."""
-        # Note use getattr(column, 'required') instead of column.required
-        # to allow use with regular columns
-        return {column.name for column in cls.__table__.columns.values()
-                if getattr(column, 'required', False)}
+        # Worked out once per model class, subclasses get their own.
+        args = cls.__dict__.get('_SmartColumnAwareMixin__required_args')
+        if args is None:
+            # Note use getattr(column, 'required') instead of column.required
+            # to allow use with regular columns
+            args = frozenset(column.name for column in cls.__table__.columns.values()
+                             if getattr(column, 'required', False))
+            cls.__required_args = args
+        return args
 
     @classmethod
     def allowed_args(cls):
         """Get allowed args."""
-        return {column.name for column in cls.__table__.columns.values()
-                if getattr(column, 'allowed', False)}
+        args = cls.__dict__.get('_SmartColumnAwareMixin__allowed_args')
+        if args is None:
+            args = frozenset(column.name for column in cls.__table__.columns.values()
+                             if getattr(column, 'allowed', False))
+            cls.__allowed_args = args
+        return args
 
 
 class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
@@ -154,6 +212,12 @@ class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
             """Jobs table."""
 
             __tablename__ = 'jobs'
+            __table_args__ = (
+                # Claim queries select jobs by type in priority then id order.
+                Index('ix_jobs_type_priority', 'type', 'priority', 'id'),
+                # Per user job listings.
+                Index('ix_jobs_user_id', 'user_id', 'id'),
+            )
             id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
             user_id = SmartColumn(Integer, nullable=False, allowed=True, required=True)
             log_uid = SmartColumn(String(36), nullable=False, default=lambda: str(uuid.uuid4()))
@@ -161,7 +225,7 @@ class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
             dst_siteid = SmartColumn(Integer, allowed=True)
             src_filepath = SmartColumn(TEXT, nullable=False, required=True, allowed=True)
             dst_filepath = SmartColumn(TEXT, allowed=True)
-            extra_opts = SmartColumn(PickleType, allowed=True)
+            extra_opts = SmartColumn(JSONType, allowed=True)
             src_credentials = SmartColumn(TEXT, allowed=True)
             dst_credentials = SmartColumn(TEXT, allowed=True)
             timestamp = Column(TIMESTAMP, nullable=False,
@@ -178,7 +242,14 @@ class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
             status = Column(SmallInteger,
                             CheckConstraint('status in {0}'.format(JobStatus.values())),
                             nullable=False, default=JobStatus.NEW)
+            # Number of elements in each status, kept in step by update_counters().
+            num_new = Column(Integer, nullable=False, default=0)
+            num_done = Column(Integer, nullable=False, default=0)
+            num_failed = Column(Integer, nullable=False, default=0)
+            num_submitted = Column(Integer, nullable=False, default=0)
+            num_running = Column(Integer, nullable=False, default=0)
             elements = relationship("JobElement", back_populates="job",
+                                    order_by="JobElement.id",
                                     cascade="all, delete-orphan")
 
             def asdict(self):
@@ -233,6 +304,44 @@ class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
                                                           ('src_filepath', 'max_tries'),
                                                           id=0,
                                                           type=JobType.LIST))]
+                self.num_new = len(self.elements)
+
+            @staticmethod
+            def counter(status):
+                """Get the element counter column for the given status."""
+                return getattr(Job, 'num_%s' % JobStatus(status).name.lower())
+
+            def update_counters(self, deltas):
+                """
+                Apply changes to the element status counters and derive the job status from them.
+
+                The counters and status are updated in place by a single UPDATE statement, so
+                concurrent transitions of elements of the same job are not lost and the status
+                is derived without loading the job elements. The change is added to the current
+                transaction, it is left to the caller to commit it along with the elements.
+
+                Args:
+                    deltas (dict): Mapping of JobStatus to the change in the number of elements
+                                   with that status, e.g. {JobStatus.NEW: -1,
+                                   JobStatus.SUBMITTED: 1} when an element is claimed.
+                """
+                deltas = {JobStatus(status): delta for status, delta in deltas.iteritems()
+                          if delta}
+                if not deltas:
+                    return
+                counters = {status: Job.counter(status) + deltas.get(status, 0)
+                            for status in JobStatus}
+                # The job status is the highest status of any of its elements.
+                derived_status = case([(counters[status] > 0, status.value)
+                                       for status in sorted(JobStatus, reverse=True)
+                                       if status != JobStatus.NEW],
+                                      else_=JobStatus.NEW.value)
+                values = {Job.counter(status).key: counters[status] for status in deltas}
+                values['status'] = derived_status
+                session = object_session(self)
+                session.query(Job).filter_by(id=self.id)\
+                                  .update(values, synchronize_session=False)
+                session.expire(self, values.keys() + ['timestamp'])
 
             def add(self):
                 """Add job to session."""
@@ -285,15 +394,26 @@ class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
             __tablename__ = 'jobelements'
             __table_args__ = (
                 CheckConstraint('attempts <= max_tries'),
+                # Elements of a job (the primary key leads with the element id) and their
+                # per status counts.
+                Index('ix_jobelements_job_status', 'job_id', 'status'),
+                # Claimable elements in claim order, restricted to just those elements where
+                # partial indexes are supported.
+                Index('ix_jobelements_claimable', 'status', 'job_id', 'id',
+                      postgresql_where=text('status IN (%d, %d) AND attempts < max_tries'
+                                            % (JobStatus.NEW, JobStatus.FAILED))),
             )
             # pylint: disable=invalid-name
             id = SmartColumn(Integer, primary_key=True, required=True, allowed=True)
             job_id = Column(Integer, ForeignKey('jobs.id'), primary_key=True)
             job = relationship("Job", back_populates="elements")
+            # Deletes the stored listing with the element, SQLite ignores ON DELETE CASCADE
+            # unless foreign keys are enabled. Only delete is cascaded so that merging an
+            # element in update() doesn't load its listing.
+            listing_entries = relationship("ListingEntry", cascade="delete, delete-orphan")
             src_filepath = SmartColumn(TEXT, nullable=False, required=True, allowed=True)
             dst_filepath = SmartColumn(TEXT, allowed=True)
-            listing = Column(PickleType, nullable=True)
-            monitoring_info = Column(PickleType, nullable=True)
+            monitoring_info = Column(JSONType, nullable=True)
             size = SmartColumn(Integer, nullable=False, default=0, allowed=True)
             max_tries = SmartColumn(SmallInteger, nullable=False, default=2, allowed=True)
             attempts = Column(SmallInteger, nullable=False, default=0)
@@ -341,6 +461,76 @@ class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
                     kwargs['dst_filepath'] = shellpath_sanitise(kwargs['dst_filepath'])
                 super(JobElement, self).__init__(**subdict(kwargs, self.allowed_args()))
 
+            @staticmethod
+            def add_elements(session, job_id, job_type, files,  # pylint: disable=too-many-arguments
+                             first_id=1, max_tries=2, chunk_size=5000):
+                """
+                Bulk insert new elements using the given session.
+
+                The elements are written with Core INSERTs of up to chunk_size rows rather than
+                built as ORM objects, so they are not added to job.elements and updating the job
+                counters is left to the caller. The paths of each chunk are sanitised together.
+
+                Args:
+                    session (Session): The session to add the elements with.
+                    job_id (int): The job id.
+                    job_type (JobType): The type of the new elements.
+                    files (iterable): (src_filepath, dst_filepath, size) tuples, one per element.
+                                      dst_filepath may be None unless job_type is COPY or
+                                      RENAME.
+                    first_id (int): Id of the first new element, the rest follow on from it.
+                    max_tries (int): Maximum attempts for each element.
+                    chunk_size (int): Maximum number of rows per INSERT.
+
+                Returns:
+                    int: The number of elements added.
+                """
+                insert = JobElement.__table__.insert()
+                # Set the defaults once rather than have them generated for each row.
+                base_row = {'job_id': job_id, 'type': job_type, 'max_tries': max_tries,
+                            'attempts': 0, 'status': JobStatus.NEW,
+                            'timestamp': datetime.utcnow()}
+                need_dst = job_type in (JobType.COPY, JobType.RENAME)
+                files = iter(files)
+                element_id = first_id
+                while True:
+                    chunk = list(islice(files, chunk_size))
+                    if not chunk:
+                        break
+                    src_filepaths, dst_filepaths, _ = zip(*chunk)
+                    shellpaths_sanitise(src_filepaths)
+                    dst_filepaths = [path for path in dst_filepaths if path is not None]
+                    if need_dst and len(dst_filepaths) != len(chunk):
+                        raise ValueError("Missing ['dst_filepath']")
+                    shellpaths_sanitise(dst_filepaths)
+                    rows = []
+                    for element_id, (src_filepath, dst_filepath, size) in enumerate(chunk,
+                                                                                     element_id):
+                        row = base_row.copy()
+                        row.update(id=element_id, src_filepath=src_filepath,
+                                   dst_filepath=dst_filepath, size=size)
+                        rows.append(row)
+                    session.execute(insert, rows)
+                    element_id += 1
+                return element_id - first_id
+
+            def get_listing(self, limit=None, offset=0):
+                """
+                Retrieve the stored listing.
+
+                Args:
+                    limit (int): Maximum number of entries to return. If None (default) then
+                                 return all entries.
+                    offset (int): Number of entries to skip, entries are ordered by path.
+
+                Returns:
+                    OrderedDict: Mapping of each listed directory to a list of its entries, or
+                                 None if no listing has been stored. Directories with no entries
+                                 in the requested page are left out unless the page is the first.
+                """
+                return ListingEntry.get_listing(object_session(self), self.job_id, self.id,
+                                                limit, offset)
+
             def update(self):
                 """Update session with current element."""
                 message = "Error updating job element"
@@ -353,3 +543,217 @@ class WorkqueueModels(object):  # pylint: disable=too-few-public-methods
                     abort(500, description=message)
                 except Exception:
                     abort(500, description=message)
+
+        class ListingEntry(db_base):
+            """
+            Listing entries table.
+
+            One row per entry in the listing returned by a LIST element, plus a row with no name
+            marking each listed directory, so that listings are only loaded when asked for and
+            can be paged.
+            """
+
+            __tablename__ = 'listingentries'
+            __table_args__ = (
+                ForeignKeyConstraint(('job_id', 'element_id'),
+                                     ('jobelements.job_id', 'jobelements.id'),
+                                     ondelete='CASCADE'),
+                # MySQL can only index a prefix of TEXT columns, 191 characters keeps each
+                # within the 767 byte limit of older InnoDB row formats with utf8mb4.
+                Index('ix_listingentries_path', 'job_id', 'element_id', 'root', 'name',
+                      mysql_length={'root': 191, 'name': 191}),
+            )
+            id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
+            job_id = Column(Integer, nullable=False)
+            element_id = Column(Integer, nullable=False)
+            root = Column(TEXT, nullable=False)
+            name = Column(TEXT, nullable=True)
+            st_mode = Column(Integer, nullable=True)
+            st_size = Column(BigInteger, nullable=True)
+            stat = Column(JSONType, nullable=True)  # Any other stat fields
+
+            @staticmethod
+            def rows(job_id, element_id, listing):
+                """
+                Convert a listing to table rows for a bulk insert.
+
+                Args:
+                    job_id (int): The job id.
+                    element_id (int): The LIST element id.
+                    listing (dict): Mapping of directory to a list of its entries.
+
+                Returns:
+                    list: The rows as dictionaries.
+                """
+                rows = []
+                for root, entries in listing.iteritems():
+                    rows.append({'job_id': job_id, 'element_id': element_id, 'root': root,
+                                 'name': None, 'st_mode': None, 'st_size': None, 'stat': None})
+                    for entry in entries:
+                        stat = dict(entry)
+                        rows.append({'job_id': job_id,
+                                     'element_id': element_id,
+                                     'root': root,
+                                     'name': stat.pop('name'),
+                                     'st_mode': stat.pop('st_mode', None),
+                                     'st_size': stat.pop('st_size', None),
+                                     'stat': stat or None})
+                return rows
+
+            @staticmethod
+            def add_listing(session, job_id, element_id, listing):
+                """Bulk insert a listing using the given session."""
+                rows = ListingEntry.rows(job_id, element_id, listing)
+                if rows:
+                    session.execute(ListingEntry.__table__.insert(), rows)
+
+            @staticmethod
+            def remove_listing(session, job_id, element_id):
+                """Remove a stored listing using the given session."""
+                session.query(ListingEntry)\
+                       .filter_by(job_id=job_id, element_id=element_id)\
+                       .delete(synchronize_session=False)
+
+            @staticmethod
+            def get_listing(session, job_id, element_id, limit=None, offset=0):
+                """Retrieve a stored listing using the given session, see JobElement.get_listing."""
+                query = session.query(ListingEntry)\
+                               .filter_by(job_id=job_id, element_id=element_id)
+                roots = [root for (root,) in query.filter(ListingEntry.name.is_(None))
+                                                  .order_by(ListingEntry.root)
+                                                  .with_entities(ListingEntry.root)]
+                if not roots:
+                    return None
+                entries = query.filter(ListingEntry.name.isnot(None))\
+                               .order_by(ListingEntry.root, ListingEntry.name)\
+                               .offset(offset)\
+                               .limit(limit)
+                listing = OrderedDict()
+                if not offset:
+                    listing.update((root, []) for root in roots)
+                for entry in entries:
+                    entry_dict = dict(entry.stat or {}, name=entry.name)
+                    if entry.st_mode is not None:
+                        entry_dict['st_mode'] = entry.st_mode
+                    if entry.st_size is not None:
+                        entry_dict['st_size'] = entry.st_size
+                    listing.setdefault(entry.root, []).append(entry_dict)
+                return listing
+
+
+def _add_column(conn, table, column, logger):
+    """Add a column missing from an existing table."""
+    ddl = '%s %s' % (column.name, column.type.compile(dialect=conn.dialect))
+    if column.default is not None and column.default.is_scalar:
+        ddl += ' DEFAULT %d' % column.default.arg
+    elif not column.nullable:
+        raise RuntimeError("Can't add NOT NULL column %s.%s without a default"
+                           % (table.name, column.name))
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    logger.info("Adding column %s.%s", table.name, column.name)
+    conn.execute(text('ALTER TABLE %s ADD COLUMN %s' % (table.name, ddl)))
+
+
+def _rename_column(conn, table, existing_column, new_name):
+    """
+    Rename a column of an existing table.
+
+    MySQL < 8 and MariaDB < 10.5 have no RENAME COLUMN, CHANGE COLUMN (which needs the full
+    column definition) is used there instead.
+    """
+    if conn.dialect.name == 'mysql':
+        conn.execute(text('ALTER TABLE %s CHANGE COLUMN %s %s %s %s'
+                          % (table.name, existing_column['name'], new_name,
+                             existing_column['type'].compile(dialect=conn.dialect),
+                             'NULL' if existing_column['nullable'] else 'NOT NULL')))
+    else:
+        conn.execute(text('ALTER TABLE %s RENAME COLUMN %s TO %s'
+                          % (table.name, existing_column['name'], new_name)))
+
+
+def _convert_pickle_column(conn, table, column, existing_column, logger):
+    """Convert a column of pickles written by PickleType to JSONType text."""
+    logger.info("Converting column %s.%s from pickle to JSON", table.name, column.name)
+    old_name = column.name + '_pickle'
+    _rename_column(conn, table, existing_column, old_name)
+    _add_column(conn, table, column, logger)
+    primary_key = list(table.primary_key.columns)
+    old_column = literal_column(old_name)
+    for row in conn.execute(select(primary_key + [old_column])
+                            .select_from(table)
+                            .where(text('%s IS NOT NULL' % old_name))).fetchall():
+        conn.execute(table.update()
+                     .where(and_(*(pk_column == row[pk_column.name]
+                                   for pk_column in primary_key)))
+                     .values({column.name: pickle.loads(str(row[old_name]))}))
+    conn.execute(text('ALTER TABLE %s DROP COLUMN %s' % (table.name, old_name)))
+
+
+def upgrade_schema(database, logger=logging.getLogger(__name__)):
+    """
+    Upgrade an existing workqueue database to the current models.
+
+    create_all() only creates missing tables, so the columns and indexes added to the models
+    since the existing tables were created are added here, backfilling the job element status
+    counters. Columns still holding pickles from before JSONType are converted (SQLite is
+    typeless so reads these through the JSONType fallback) and listings stored in the old
+    jobelements.listing column are moved to the listingentries table, dropping the column
+    (or just clearing it on SQLite). Safe to run repeatedly,
+    an up to date database is left untouched.
+
+    Args:
+        database (flask_sqlalchemy.SQLAlchemy): Database with the workqueue models loaded.
+        logger (logging.Logger): Logger to report the changes made to.
+    """
+    Job = database.tables.Job  # pylint: disable=invalid-name
+    JobElement = database.tables.JobElement  # pylint: disable=invalid-name
+    ListingEntry = database.tables.ListingEntry  # pylint: disable=invalid-name
+    with database.engine.begin() as conn:
+        inspector = inspect(conn)
+        added_columns = set()
+        for table in (Job.__table__, JobElement.__table__, ListingEntry.__table__):
+            existing_columns = {column['name']: column
+                                for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    _add_column(conn, table, column, logger)
+                    added_columns.add(column)
+                elif isinstance(column.type, JSONType) and conn.dialect.name != 'sqlite'\
+                        and isinstance(existing_columns[column.name]['type'], LargeBinary):
+                    _convert_pickle_column(conn, table, column,
+                                           existing_columns[column.name], logger)
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    logger.info("Creating index %s", index.name)
+                    index.create(conn)
+
+        elements = JobElement.__table__
+        for status in JobStatus:
+            counter = Job.counter(status)
+            if counter.property.columns[0] in added_columns:
+                logger.info("Backfilling job counter %s", counter.key)
+                conn.execute(Job.__table__.update().values({
+                    counter.key: select([func.count()])
+                                 .where(and_(elements.c.job_id == Job.__table__.c.id,
+                                             elements.c.status == status.value))
+                                 .as_scalar()}))
+
+        if 'listing' in {column['name'] for column in inspector.get_columns(elements.name)}:
+            legacy_listing = literal_column('listing')
+            for job_id, element_id, listing in conn.execute(
+                    select([elements.c.job_id, elements.c.id, legacy_listing])
+                    .where(text('listing IS NOT NULL'))).fetchall():
+                logger.info("Moving listing of job.element %d.%d to %s",
+                            job_id, element_id, ListingEntry.__tablename__)
+                rows = ListingEntry.rows(job_id, element_id, pickle.loads(str(listing)))
+                if rows:
+                    conn.execute(ListingEntry.__table__.insert(), rows)
+                conn.execute(text('UPDATE %s SET listing = NULL WHERE job_id = :job_id AND '
+                                  'id = :element_id' % elements.name),
+                             job_id=job_id, element_id=element_id)
+            # SQLite (before 3.35) can't drop columns, the cleared column is left there.
+            if conn.dialect.name != 'sqlite':
+                logger.info("Dropping column %s.listing", elements.name)
+                conn.execute(text('ALTER TABLE %s DROP COLUMN listing' % elements.name))
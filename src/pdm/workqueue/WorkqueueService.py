@@ -1,23 +1,31 @@
 """Workqueue Service."""
 import os
 import stat
+import time
+import threading
 from functools import partial
-from itertools import groupby
+from itertools import groupby, islice, izip
 from operator import attrgetter
-from collections import Counter
+from collections import Counter, defaultdict
+from datetime import datetime
 from pprint import pformat
 
 from enum import Enum
 from flask import request, abort, current_app
 from sqlalchemy import and_, or_, func
 from sqlalchemy.orm import aliased
+from werkzeug.exceptions import HTTPException
 # from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 from pdm.framework.FlaskWrapper import jsonify
 from pdm.framework.Decorators import export_ext, db_model, startup, decode_json_data
 from pdm.userservicedesk.HRService import HRService
 from pdm.site.SiteClient import SiteClient
-from .WorkqueueDB import WorkqueueModels, JobStatus, JobType
+from pdm.utils.db import managed_session
+from .WorkqueueDB import WorkqueueModels, JobStatus, JobType, upgrade_schema
+
+# Maximum number of values in an IN clause, keeping queries within bound parameter limits.
+_IN_CHUNK = 500
 
 
 def require_attrs(*attrs):
@@ -28,6 +36,80 @@ def require_attrs(*attrs):
     return attrs
 
 
+def paging_arg(name, default=None):
+    """Get a non-negative integer query arg, such as a page limit or offset."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        abort(400, description="%s must be a non-negative integer." % name)
+    return value
+
+
+def listing_page():
+    """Get the listing (limit, offset) requested with the listing_limit/listing_offset args."""
+    return (request.args.get('listing_limit', None, type=int),
+            request.args.get('listing_offset', 0, type=int))
+
+
+def request_listing():
+    """
+    Get the listing sent in the request data.
+
+    A compact listing, one list of values per entry with the names of the values sent once
+    as the columns attribute, is expanded to the usual dict per entry.
+    """
+    listing = request.data.get('listing')
+    columns = request.data.get('columns')
+    if listing is None or columns is None:
+        return listing
+    try:
+        return {root: [dict(izip(columns, entry)) for entry in entries]
+                for root, entries in listing.iteritems()}
+    except (AttributeError, TypeError):
+        abort(400, description="Malformed compact listing.")
+
+
+def claim_token(job_id, element_ids):
+    """
+    Issue a token for the elements of a job claimed by a worker.
+
+    The token covers exactly the claimed elements, held as [first, last] id ranges so that
+    a large claim still gives a small token signed once rather than once per element.
+    """
+    ranges = []
+    for element_id in sorted(element_ids):
+        if ranges and ranges[-1][1] == element_id - 1:
+            ranges[-1][1] = element_id
+        else:
+            ranges.append([element_id, element_id])
+    return request.token_svc.issue({'job': job_id, 'elements': ranges})
+
+
+def require_element_token(job_id, element_id):
+    """
+    Require the request token to be valid for the given job element.
+
+    Both claim tokens (see claim_token) and the older per element "job_id.element_id" tokens
+    are accepted.
+    """
+    if not request.token_ok:
+        abort(403, description="Invalid token")
+    token = request.token
+    if isinstance(token, dict):
+        valid = token.get('job') == job_id and\
+            any(first <= element_id <= last for first, last in token.get('elements', ()))
+    else:
+        valid = token == '%d.%d' % (job_id, element_id)
+    if not valid:
+        abort(403,
+              description="Token not valid for element %d of job %d" % (element_id, job_id))
+
+
 def by_number(limit=20):
     """Extract next n job elements."""
     Job = request.db.tables.Job  # pylint: disable=invalid-name
@@ -44,52 +126,96 @@ def by_number(limit=20):
                            .all()
 
 
+def window_functions_supported(dialect):
+    """
+    Check if the database dialect supports SQL window functions.
+
+    Args:
+        dialect (sqlalchemy.engine.interfaces.Dialect): The dialect of the bound engine.
+
+    Returns:
+        bool: True for SQLite >= 3.25, PostgreSQL and MySQL >= 8.0, False otherwise.
+    """
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 25, 0)
+    if dialect.name == 'postgresql':
+        return True
+    if dialect.name == 'mysql':
+        version = dialect.server_version_info or ()
+        # MariaDB reports a mangled version number so treat it conservatively.
+        return 'MariaDB' not in version and version >= (8, 0)
+    return False
+
+
 def by_size(size=150000000):
     """Extract job elements up to size."""
+    if window_functions_supported(request.db.engine.dialect):
+        return by_size_windowed(size)
+    return by_size_self_join(size)
+
+
+def by_size_windowed(size=150000000):
+    """
+    Extract job elements up to size using a running sum window function.
+
+    The running total of claimable element sizes is computed in a single pass in a subquery
+    which is then joined back to the elements to be locked. FOR UPDATE is restricted to the
+    jobelements table as PostgreSQL does not allow row locking alongside window functions.
+    """
     Job = request.db.tables.Job  # pylint: disable=invalid-name
     JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
-    # Can use windowed CTE approach below if we have updated version of SQLite.
-    # Follows the example of accumulation from:
-    # http://www.sqlfiddle.com/#!15/1953ec/2
-    # namely:
-    # -- simple CTE
-    # WITH cte AS (
-    # SELECT *, sum(verbosity) OVER (ORDER BY id) AS total
-    # FROM  messages
-    # )
-    # SELECT *
-    # FROM   cte
-    # WHERE  total <= 70
-    # ORDER  BY id;
-
-    # cte = JobElement.query.with_entities(JobElement,
-    #                                      func.sum(JobElement.size)
-    #                                          # .over(order_by=(JobElement.job_id, JobElement.id))
-    #                                          .over(order_by=(Job.priority, JobElement.job_id,
-    #                                                          JobElement.id, Job.status))
-    #                                          .label("total")) \
-    #                       .filter(JobElement.status.in_((JobStatus.NEW, JobStatus.FAILED)),
-    #                               JobElement.attempts < JobElement.max_tries) \
-    #                       .join(JobElement.job) \
-    #                       .filter(Job.type.in_(request.data['types'])) \
-    #                       .order_by(Job.priority) \
-    #                       .order_by(JobElement.job_id, JobElement.id) \
-    #                       .order_by(Job.status) \
-    #                       .with_for_update() \
-    #                       .cte(name="cte")
-    # return JobElement.query.with_entities(cte).filter(cte.c.total < size).all()
+    running_total = JobElement.query\
+                              .with_entities(JobElement.job_id,
+                                             JobElement.id,
+                                             func.sum(JobElement.size)
+                                             .over(order_by=(Job.priority,
+                                                             JobElement.job_id,
+                                                             JobElement.id))
+                                             .label("total"))\
+                              .join(JobElement.job)\
+                              .filter(JobElement.status.in_((JobStatus.NEW, JobStatus.FAILED)),
+                                      JobElement.attempts < JobElement.max_tries,
+                                      Job.type.in_(request.data['types']))\
+                              .subquery()
+    return JobElement.query.join(running_total,
+                                 and_(running_total.c.job_id == JobElement.job_id,
+                                      running_total.c.id == JobElement.id))\
+                           .filter(running_total.c.total <= size)\
+                           .join(JobElement.job)\
+                           .order_by(Job.priority)\
+                           .order_by(JobElement.job_id, JobElement.id)\
+                           .order_by(Job.status)\
+                           .with_for_update(of=JobElement)\
+                           .all()
+
 
+def by_size_self_join(size=150000000):
+    """
+    Extract job elements up to size using a self-join.
+
+    Fallback for databases without window function support. This is O(n^2) in the number of
+    claimable elements.
+    """
+    Job = request.db.tables.Job  # pylint: disable=invalid-name
+    JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
+    JobAlias = aliased(Job)  # pylint: disable=invalid-name
     JobElementAlias = aliased(JobElement)  # pylint: disable=invalid-name
-    return JobElement.query.join(JobElementAlias,
-                                 or_(JobElementAlias.job_id < JobElement.job_id,
-                                     and_(JobElementAlias.job_id == JobElement.job_id,
-                                          JobElementAlias.id <= JobElement.id)))\
-                           .group_by(JobElement.job_id, JobElement.id)\
+    return JobElement.query.join(JobElement.job)\
+                           .join(JobAlias, JobAlias.type.in_(request.data['types']))\
+                           .join(JobElementAlias, JobElementAlias.job_id == JobAlias.id)\
+                           .filter(JobElementAlias.status.in_((JobStatus.NEW, JobStatus.FAILED)),
+                                   JobElementAlias.attempts < JobElementAlias.max_tries,
+                                   or_(JobAlias.priority < Job.priority,
+                                       and_(JobAlias.priority == Job.priority,
+                                            JobElementAlias.job_id < JobElement.job_id),
+                                       and_(JobAlias.priority == Job.priority,
+                                            JobElementAlias.job_id == JobElement.job_id,
+                                            JobElementAlias.id <= JobElement.id)))\
+                           .group_by(JobElement.job_id, JobElement.id, Job.id)\
                            .having(func.sum(JobElementAlias.size) <= size)\
                            .filter(JobElement.status.in_((JobStatus.NEW, JobStatus.FAILED)),
-                                   JobElement.attempts < JobElement.max_tries)\
-                           .join(JobElement.job)\
-                           .filter(Job.type.in_(request.data['types']))\
+                                   JobElement.attempts < JobElement.max_tries,
+                                   Job.type.in_(request.data['types']))\
                            .order_by(Job.priority)\
                            .order_by(JobElement.job_id, JobElement.id)\
                            .order_by(Job.status)\
@@ -110,6 +236,154 @@ class Algorithm(Enum):  # pylint: disable=too-few-public-methods
         return self.value(*args, **kwargs)
 
 
+class WorkNotifier(object):
+    """
+    Wake long-polling workers when new work is queued.
+
+    Each notification bumps a generation counter so that a waiter which captured the
+    generation before querying for work can not miss a notification that arrives between
+    the query and the wait.
+    """
+
+    def __init__(self, max_waiters=4):
+        """
+        Initialisation.
+
+        Args:
+            max_waiters (int): Maximum number of concurrently blocked requests. Each one ties up
+                               a WSGI thread so this should be well below the thread pool size.
+        """
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._waiters = 0
+        self._max_waiters = max_waiters
+
+    @property
+    def generation(self):
+        """The current notification generation."""
+        return self._generation
+
+    def notify(self):
+        """Wake all waiting requests."""
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """
+        Wait for a notification newer than generation.
+
+        Args:
+            generation (int): The generation captured before looking for work.
+            timeout (float): Maximum time to wait in seconds.
+
+        Returns:
+            bool: True if notified, False on timeout or if too many requests are already waiting.
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            if self._waiters >= self._max_waiters:
+                return False
+            self._waiters += 1
+            try:
+                while self._generation == generation:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                return True
+            finally:
+                self._waiters -= 1
+
+
+def expand_listing(job, element, listing, complete=True, retry=False):
+    """
+    Expand (part of) the listing of a LIST element into new elements of its COPY/REMOVE job.
+
+    The new elements are written with bulk INSERTs (see JobElement.add_elements) rather than
+    being built up as ORM objects on job.elements. Each part of the listing is stored in full
+    as it arrives. Partial listings of REMOVE jobs only add files, the directories are held
+    back (in the stored listing) until the listing is complete so that they are removed after
+    their contents.
+
+    Args:
+        job (Job): The COPY or REMOVE job.
+        element (JobElement): The LIST element of the job.
+        listing (dict): Mapping of directory to a list of its entries (name and stat fields).
+        complete (bool): Whether this is the final part of the listing.
+        retry (bool): Whether an earlier attempt may already have expanded some of the listing,
+                      in which case elements for files already in the job are not added again.
+
+    Returns:
+        int: The number of elements added.
+    """
+    JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
+    ListingEntry = request.db.tables.ListingEntry  # pylint: disable=invalid-name
+    files = []  # (src_filepath, dst_filepath, size) of the new elements
+    if job.type == JobType.COPY:
+        src_root = job.src_filepath.rstrip('/')
+        for root, entries in sorted(listing.iteritems(), key=lambda item: len(item[0])):
+            dir_copy = root.rstrip('/') == src_root or root.startswith(src_root + '/')
+            for entry in entries:
+                # is int cast necessary?
+                if not stat.S_ISREG(int(entry['st_mode'])):
+                    continue
+                src_filepath = os.path.join(root, entry['name'])
+                dst_filepath = job.dst_filepath
+                if dir_copy:
+                    rel_filepath = os.path.relpath(src_filepath, element.src_filepath)
+                    dst_filepath = os.path.join(job.dst_filepath, rel_filepath)
+                files.append((src_filepath, os.path.normpath(dst_filepath),
+                              int(entry['st_size'])))
+    elif not complete:  # partial REMOVE listing
+        for root, entries in listing.iteritems():
+            for entry in entries:
+                if not stat.S_ISDIR(int(entry['st_mode'])):
+                    files.append((os.path.join(root, entry['name']), None,
+                                  int(entry['st_size'])))
+    else:  # complete REMOVE listing
+        # The files of the earlier parts already have elements, only their directories don't.
+        remove_listing = defaultdict(list)
+        for root, entries in (element.get_listing() or {}).iteritems():
+            remove_listing[root].extend(entry for entry in entries
+                                        if stat.S_ISDIR(int(entry['st_mode'])))
+        for root, entries in listing.iteritems():
+            remove_listing[root].extend(entries)
+        root = None
+        for root, entries in sorted(remove_listing.iteritems(),
+                                    key=lambda item: len(item[0]), reverse=True):
+            for entry in sorted(entries, key=lambda x: stat.S_ISDIR(int(x['st_mode']))):
+                name = entry['name']
+                if stat.S_ISDIR(int(entry['st_mode'])):
+                    name += '/'
+                files.append((os.path.join(root, name), None, int(entry['st_size'])))
+        # Need to remove top level directory
+        if root is not None and root.rstrip('/') == element.src_filepath.rstrip('/'):
+            files.append((root.rstrip('/') + '/', None, 0))  # work out size better
+
+    with managed_session(current_app,
+                         message="Error expanding listing into job elements",
+                         http_error_code=500) as session:
+        ListingEntry.add_listing(session, job.id, element.id, listing)
+        if retry and files:
+            existing = set()
+            filepaths = [src_filepath for src_filepath, _, _ in files]
+            for i in xrange(0, len(filepaths), _IN_CHUNK):
+                existing.update(filepath for (filepath,) in
+                                session.query(JobElement.src_filepath)
+                                .filter(JobElement.job_id == job.id,
+                                        JobElement.src_filepath.in_(filepaths[i:i + _IN_CHUNK])))
+            files = [file_ for file_ in files if file_[0] not in existing]
+        if files:
+            next_id = session.query(func.max(JobElement.id))\
+                             .filter(JobElement.job_id == job.id)\
+                             .scalar() + 1
+            JobElement.add_elements(session, job.id, job.type, files,
+                                    first_id=next_id, max_tries=element.max_tries)
+            job.update_counters({JobStatus.NEW: len(files)})
+    return len(files)
+
+
 @export_ext("/workqueue/api/v1.0")
 @db_model(WorkqueueModels)
 class WorkqueueService(object):
@@ -119,8 +393,11 @@ class WorkqueueService(object):
     @startup
     def configure_workqueueservice(config):
         """Setup the WorkqueueService."""
+        upgrade_schema(current_app.db, current_app.log)
         current_app.workqueueservice_workerlogs = config.pop('workerlogs', '/tmp/workers')
         current_app.site_client = SiteClient()
+        current_app.workqueueservice_poll_max_wait = config.pop('poll_max_wait', 30)
+        current_app.work_notifier = WorkNotifier(config.pop('poll_max_waiters', 4))
 
     @staticmethod
     @export_ext('worker/jobs', ["POST"])
@@ -129,36 +406,78 @@ class WorkqueueService(object):
         """Get the next job."""
         current_app.log.debug("Worker requesting job batch, request: %s", pformat(request.data))
         require_attrs('types')
-#        Job = request.db.tables.Job  # pylint: disable=invalid-name
-#        JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
+        max_jobs = request.data.get('max_jobs')
+        if max_jobs is not None and\
+                (not isinstance(max_jobs, (int, long)) or isinstance(max_jobs, bool) or
+                 max_jobs < 1):
+            abort(400, description="max_jobs must be a positive integer.")
         alg_name = request.data.get('algorithm', 'BY_NUMBER').upper()
-        elements = Algorithm[alg_name](**request.data.get('algorithm.args', {}))
-#       elements = JobElement.query.filter(JobElement.status.in_((JobStatus.NEW, JobStatus.FAILED)),
-#                                           JobElement.attempts < JobElement.max_tries)\
-#                                   .join(JobElement.job)\
-#                                   .filter(Job.type.in_(request.data['types']))\
-#                                   .order_by(Job.priority)\
-#                                   .order_by(Job.id)\
-#                                   .limit(10)\
-#                                   .all()
-        if not elements:
-            abort(404, description="No work to be done.")
+        # Long-poll: optionally block until work is queued or the wait time elapses.
+        wait = request.data.get('wait', 0)
+        if not isinstance(wait, (int, long, float)) or isinstance(wait, bool) or\
+                wait != wait or wait < 0:
+            abort(400, description="wait must be a non-negative number of seconds.")
+        wait = min(wait, current_app.workqueueservice_poll_max_wait)
+        deadline = time.time() + wait
+        while True:
+            generation = current_app.work_notifier.generation
+            elements = Algorithm[alg_name](**request.data.get('algorithm.args', {}))
+            if elements:
+                break
+            # Don't hold the transaction open while waiting.
+            request.db.session.rollback()
+            if not current_app.work_notifier.wait(generation, deadline - time.time()):
+                abort(404, description="No work to be done.")
 
+        Job = request.db.tables.Job  # pylint: disable=invalid-name
+        JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
         work = []
-        for job, elements_group in groupby(elements, key=attrgetter('job')):
+        claimed = {}
+        deltas = {}
+        # Workers only ask for as many jobs as they have free slots to run them in.
+        for job, elements_group in islice(groupby(elements, key=attrgetter('job')), max_jobs):
+            elements_group = list(elements_group)
+            # A retried LIST element must run on its own. Elements already expanded from its
+            # streamed listing are left for a later request.
+            if len(elements_group) > 1 and\
+                    any(element.type == JobType.LIST and element.attempts
+                        for element in elements_group):
+                elements_group = [element for element in elements_group
+                                  if element.type == JobType.LIST]
             elements = []
-#            for element in list(elements_group):
-            for element in iter(elements_group):
-                element.status = JobStatus.SUBMITTED
-                element.update()  # should be a bulk update
+            for element in elements_group:
                 element_dict = element.asdict()
-                element_dict['token'] = request.token_svc.issue("%d.%d" % (job.id, element.id))
+                element_dict['status'] = JobStatus.SUBMITTED
                 elements.append(element_dict)
-            job.status = max(ele.status for ele in job.elements)
+            claimed[job.id] = [element['id'] for element in elements]
+            deltas[job] = Counter({JobStatus.SUBMITTED: len(elements_group)})
+            deltas[job].subtract(element.status for element in elements_group)
             job_dict = job.asdict()
             job_dict['elements'] = elements
+            job_dict['token'] = claim_token(job.id, claimed[job.id])
             work.append(job_dict)
-            job.update()
+        if not claimed:
+            request.db.session.rollback()
+            abort(404, description="No work to be done.")
+
+        # Claim the whole batch with a single bulk UPDATE and move the claimed elements
+        # between the job status counters, all within the transaction holding the row locks.
+        with managed_session(current_app,
+                             message="Error claiming job elements",
+                             http_error_code=500) as session:
+            # Never run the UPDATE without a WHERE clause, an empty or_() would give one.
+            if claimed:
+                JobElement.query.filter(or_(*(and_(JobElement.job_id == job_id,
+                                                   JobElement.id.in_(element_ids))
+                                              for job_id, element_ids in claimed.iteritems())))\
+                                .update({'status': JobStatus.SUBMITTED},
+                                        synchronize_session=False)
+            for job, job_deltas in deltas.iteritems():
+                job.update_counters(job_deltas)
+            job_statuses = dict(session.query(Job.id, Job.status)
+                                .filter(Job.id.in_(list(claimed))))
+        for job_dict in work:
+            job_dict['status'] = job_statuses[job_dict['id']]
         current_app.log.debug("Sending worker job batch: %s", pformat(work))
         return jsonify(work)
 
@@ -167,39 +486,130 @@ class WorkqueueService(object):
     @decode_json_data
     def return_monitoring_info(job_id, element_id):
         """Return monitoring information about a job."""
-        if not request.token_ok:
-            abort(403, description="Invalid token")
-        if request.token != '%d.%d' % (job_id, element_id):
-            abort(403,
-                  description="Token not valid for element %d of job %d" % (element_id, job_id))
+        require_element_token(job_id, element_id)
         current_app.log.debug("Received data from worker for job.element %s.%s: %s",
                               job_id, element_id, pformat(request.data))
         require_attrs('transferred', 'elapsed', 'instant', 'average')
         JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
         element = JobElement.query.get_or_404((element_id, job_id))
-        element.status = JobStatus.RUNNING
+        # Only the first monitoring update moves the element (and so maybe the job) to RUNNING.
+        if element.status != JobStatus.RUNNING:
+            element.job.update_counters({element.status: -1, JobStatus.RUNNING: 1})
+            element.status = JobStatus.RUNNING
         if request.data['transferred'] == -1:
             request.data['transferred'] = element.size
             request.data['average'] = element.size / request.data['elapsed']
         element.monitoring_info = request.data
         element.update()
+        return '', 200
 
+    @staticmethod
+    @export_ext('worker/jobs/<int:job_id>/elements/<int:element_id>/listing', ['PUT'])
+    @decode_json_data
+    def return_listing(job_id, element_id):
+        """Return part of a listing, expanding it into job elements while listing continues."""
+        require_element_token(job_id, element_id)
+        current_app.log.debug("Received partial listing from worker for job.element %s.%s",
+                              job_id, element_id)
+        require_attrs('listing')
+        JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
+        element = JobElement.query.get_or_404((element_id, job_id))
         job = element.job
-        job.status = max(ele.status for ele in job.elements)
-        job.update()
+        if element.type != JobType.LIST or job.type not in (JobType.COPY, JobType.REMOVE):
+            abort(400, description="Partial listings are only accepted for the LIST element "
+                                   "of COPY or REMOVE jobs.")
+        if element.status not in (JobStatus.SUBMITTED, JobStatus.RUNNING):
+            abort(400, description="Listing element is not in progress.")
+        if expand_listing(job, element, request_listing(),
+                          complete=False, retry=element.attempts > 0):
+            current_app.work_notifier.notify()
         return '', 200
 
+    @staticmethod
+    @export_ext('worker/jobs/elements', ['PUT'])
+    @decode_json_data
+    def return_results():
+        """
+        Return a batch of job element outputs and monitoring information.
+
+        The body is a list of {job_id, element_id, token, payload, monitoring} results,
+        each handled as if sent to the corresponding single element endpoint. As the
+        element tokens are not in the request header they are checked individually here.
+        The response contains one {job_id, element_id, code[, description]} entry per result.
+        A result that fails has its changes rolled back without affecting the others.
+        """
+        if not isinstance(request.data, list):
+            abort(400, description="Expected a list of results.")
+        results = request.data
+        responses = []
+        # Results for the elements of a claim share its token, so check each only once.
+        tokens = {}
+        saved = (request.data, request.token, request.token_ok)
+        try:
+            for result in results:
+                responses.append(WorkqueueService._return_result(result, tokens))
+        finally:
+            request.data, request.token, request.token_ok = saved
+        return jsonify(responses)
+
+    @staticmethod
+    def _return_result(result, tokens):
+        """
+        Handle a single result of a return_results batch.
+
+        Args:
+            result (dict): The {job_id, element_id, token, payload, monitoring} result.
+            tokens (dict): Token values already checked in this batch, keyed on raw token.
+
+        Returns:
+            dict: The {job_id, element_id, code[, description]} response for the result.
+        """
+        response = {'job_id': None, 'element_id': None, 'code': 200}
+        try:
+            if not isinstance(result, dict) or\
+                    not {'job_id', 'element_id', 'token', 'payload'}.issubset(result):
+                abort(400, description="Missing one of required keys "
+                                       "'job_id', 'element_id', 'token' or 'payload'.")
+            response.update(job_id=result['job_id'], element_id=result['element_id'])
+            if not isinstance(result['payload'], dict):
+                abort(400, description="Expected payload to be a dictionary.")
+            try:
+                job_id = int(result['job_id'])
+                element_id = int(result['element_id'])
+            except (TypeError, ValueError):
+                abort(400, description="Expected integer 'job_id' and 'element_id'.")
+            token = result['token']
+            if not isinstance(token, basestring):
+                token = None
+            if token not in tokens:
+                try:
+                    tokens[token] = request.token_svc.check(token)
+                except (ValueError, TypeError):
+                    tokens[token] = None
+            request.token = tokens[token]
+            request.token_ok = request.token is not None
+            request.data = result['payload']
+            if result.get('monitoring', False):
+                WorkqueueService.return_monitoring_info(job_id, element_id)
+            else:
+                WorkqueueService.return_output(job_id, element_id)
+        except HTTPException as err:
+            request.db.session.rollback()
+            response.update(code=err.code, description=err.description)
+        except Exception as err:  # pylint: disable=broad-except
+            request.db.session.rollback()
+            current_app.log.exception("Error handling result for job.element %s.%s",
+                                      response['job_id'], response['element_id'])
+            response.update(code=500, description="Error handling result: %s" % err)
+        return response
+
     # pylint: disable=too-many-branches, too-many-locals, too-many-statements
     @staticmethod
     @export_ext('worker/jobs/<int:job_id>/elements/<int:element_id>', ['PUT'])
     @decode_json_data
     def return_output(job_id, element_id):
         """Return a job."""
-        if not request.token_ok:
-            abort(403, description="Invalid token")
-        if request.token != '%d.%d' % (job_id, element_id):
-            abort(403,
-                  description="Token not valid for element %d of job %d" % (element_id, job_id))
+        require_element_token(job_id, element_id)
         current_app.log.debug("Received data from worker for job.element %s.%s: %s",
                               job_id, element_id, pformat(request.data))
         require_attrs('returncode', 'host', 'log', 'timestamp')
@@ -207,12 +617,29 @@ class WorkqueueService(object):
         # Update job status.
         JobElement = request.db.tables.JobElement  # pylint: disable=invalid-name
         element = JobElement.query.get_or_404((element_id, job_id))
+        expand = element.type == JobType.LIST and element.job.type in (JobType.COPY,
+                                                                        JobType.REMOVE)
         if element.type == JobType.LIST and request.data['returncode'] == 0:
             require_attrs('listing')
-            element.listing = request.data['listing']
+        listing = request_listing()
         element.attempts += 1
-        element.status = JobStatus.DONE if request.data['returncode'] == 0 else JobStatus.FAILED
+        status = JobStatus.DONE if request.data['returncode'] == 0 else JobStatus.FAILED
+        if element.status != status:
+            element.job.update_counters({element.status: -1, status: 1})
+            element.status = status
         element.update()
+        if element.type == JobType.LIST:
+            ListingEntry = request.db.tables.ListingEntry  # pylint: disable=invalid-name
+            with managed_session(current_app,
+                                 message="Error storing listing",
+                                 http_error_code=500) as session:
+                if element.status == JobStatus.DONE and not expand:
+                    # expand_listing stores the listing once it has been expanded.
+                    ListingEntry.add_listing(session, job_id, element_id, listing)
+                elif element.status == JobStatus.FAILED and expand:
+                    # Drop the parts stored from a failed (streamed) listing, a retry sends
+                    # the whole listing again.
+                    ListingEntry.remove_listing(session, job_id, element_id)
 
 #    Job = request.db.tables.Job
 #    try:
@@ -222,7 +649,6 @@ class WorkqueueService(object):
 #    except MultipleResultsFound:
 #        abort(500, description="Multiple jobs with id %d found!" % job_id)
         job = element.job
-        job.status = max(ele.status for ele in job.elements)
 
         # Write log file.
         dir_ = os.path.join(current_app.workqueueservice_workerlogs,
@@ -239,57 +665,8 @@ class WorkqueueService(object):
             logfile.write(request.data['log'])
 
         # Expand listing for COPY or REMOVE jobs.
-        if job.type == JobType.COPY\
-            and element.type == JobType.LIST\
-                and element.status == JobStatus.DONE:
-            element_counter = 0
-            element_listing = sorted(element.listing.iteritems(), key=lambda item: len(item[0]))
-            dir_copy = False
-            if element_listing and \
-                    element_listing[0][0].rstrip('/') == job.src_filepath.rstrip('/'):
-                dir_copy = True
-            for root, listing in element_listing:
-                for file_ in listing:
-                    # is int cast necessary?
-                    if not stat.S_ISREG(int(file_['st_mode'])):
-                        continue
-                    element_counter += 1
-                    src_filepath = os.path.join(root, file_['name'])
-                    dst_filepath = job.dst_filepath
-                    if dir_copy:
-                        rel_filepath = os.path.relpath(src_filepath, element.src_filepath)
-                        dst_filepath = os.path.join(job.dst_filepath, rel_filepath)
-                    job.elements.append(JobElement(id=element_counter,
-                                                   src_filepath=src_filepath,
-                                                   dst_filepath=os.path.normpath(dst_filepath),
-                                                   max_tries=element.max_tries,
-                                                   type=job.type,
-                                                   size=int(file_["st_size"])))  # int cast needed?
-            job.status = JobStatus.SUBMITTED
-        elif job.type == JobType.REMOVE\
-            and element.type == JobType.LIST\
-                and element.status == JobStatus.DONE:
-            element_counter = 0
-            for root, listing in sorted(element.listing.iteritems(),
-                                        key=lambda item: len(item[0]), reverse=True):
-                for entry in sorted(listing, key=lambda x: stat.S_ISDIR(int(x['st_mode']))):
-                    element_counter += 1
-                    name = entry['name']
-                    if stat.S_ISDIR(int(entry['st_mode'])):
-                        name += '/'
-                    job.elements.append(JobElement(id=element_counter,
-                                                   src_filepath=os.path.join(root, name),
-                                                   max_tries=element.max_tries,
-                                                   type=job.type,
-                                                   size=int(entry["st_size"])))
-            # Need to remove top level directory
-            if root.rstrip('/') == element.src_filepath.rstrip('/'):
-                element_counter += 1
-                job.elements.append(JobElement(id=element_counter,
-                                               src_filepath=root.rstrip('/') + '/',
-                                               max_tries=element.max_tries,
-                                               type=job.type,
-                                               size=0))  # work out size better
+        if expand and element.status == JobStatus.DONE:
+            expand_listing(job, element, listing, retry=element.attempts > 1)
             job.status = JobStatus.SUBMITTED
         elif job.type == JobType.RENAME\
             and element.type == JobType.LIST\
@@ -300,8 +677,14 @@ class WorkqueueService(object):
                                            max_tries=element.max_tries,
                                            type=job.type,
                                            size=0))
+            job.update_counters({JobStatus.NEW: 1})
             job.status = JobStatus.SUBMITTED
         job.update()
+        # Wake any long-polling workers if there is new work, either expanded or to retry.
+        if (element.type == JobType.LIST and element.status == JobStatus.DONE and
+                job.type in (JobType.COPY, JobType.REMOVE, JobType.RENAME)) or\
+                (element.status == JobStatus.FAILED and element.attempts < element.max_tries):
+            current_app.work_notifier.notify()
         return '', 200
 
     @staticmethod
@@ -335,6 +718,7 @@ class WorkqueueService(object):
             job.add()
         except Exception as err:  # pylint: disable=broad-except
             abort(500, description=err.message)
+        current_app.work_notifier.notify()
         return jsonify(job)
 
     @staticmethod
@@ -380,21 +764,34 @@ class WorkqueueService(object):
     @staticmethod
     @export_ext("jobs", ['GET'])
     def get_jobs():
-        """Get all jobs for a user."""
+        """
+        Get all jobs for a user.
+
+        The optional query args limit and offset page through the jobs (ordered by id) and
+        since (an ISO format UTC timestamp) restricts them to those updated at or after then.
+        """
         Job = request.db.tables.Job  # pylint: disable=invalid-name
-        jobs = []
-        for job in Job.query.filter_by(user_id=HRService.check_token()).all():
-            elements = job.elements
-            status_counter = Counter(element.status for element in elements)
+        query = Job.query.filter_by(user_id=HRService.check_token())
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                since = datetime.strptime(since, '%Y-%m-%dT%H:%M:%S.%f' if '.' in since
+                                          else '%Y-%m-%dT%H:%M:%S')
+            except ValueError:
+                abort(400, description="bad since, expected an ISO format timestamp.")
+            query = query.filter(Job.timestamp >= since)
+        jobs = query.order_by(Job.id)\
+                    .offset(paging_arg('offset', 0))\
+                    .limit(paging_arg('limit'))\
+                    .all()
+
+        # The element counts are kept on the job rows by Job.update_counters.
+        jobs_list = []
+        for job in jobs:
             new_job = job.encode_for_json()
-            new_job.update(num_elements=len(elements),
-                           num_new=status_counter[JobStatus.NEW],
-                           num_done=status_counter[JobStatus.DONE],
-                           num_failed=status_counter[JobStatus.FAILED],
-                           num_submitted=status_counter[JobStatus.SUBMITTED],
-                           num_running=status_counter[JobStatus.RUNNING])
-            jobs.append(new_job)
-        return jsonify(jobs)
+            new_job['num_elements'] = sum(new_job[Job.counter(status).key] for status in JobStatus)
+            jobs_list.append(new_job)
+        return jsonify(jobs_list)
 
     @staticmethod
     @export_ext("jobs/<int:job_id>", ['GET'])
@@ -413,6 +810,7 @@ class WorkqueueService(object):
         elements = JobElement.query.filter_by(job_id=job_id)\
                                    .join(JobElement.job)\
                                    .filter_by(user_id=HRService.check_token())\
+                                   .order_by(JobElement.id)\
                                    .all()
         return jsonify(elements)
 
@@ -472,7 +870,7 @@ class WorkqueueService(object):
                         log = logfile.read()
                 last_output.update(log=log)
                 if status == JobStatus.DONE and element.type == JobType.LIST:
-                    last_output.update(listing=element.listing)
+                    last_output.update(listing=element.get_listing(*listing_page()))
                 attempt_list.append(last_output)
             elements_list.append(attempt_list)
         return jsonify(elements_list)
@@ -525,7 +923,7 @@ class WorkqueueService(object):
             with open(log_filename, 'rb') as logfile:
                 attempt_output.update(log=logfile.read())
             if status == JobStatus.DONE and element.type == JobType.LIST:
-                attempt_output.update(listing=element.listing)
+                attempt_output.update(listing=element.get_listing(*listing_page()))
             return jsonify(attempt_output)
 
         attempt_list = []
@@ -554,7 +952,7 @@ class WorkqueueService(object):
                     log = logfile.read()
             last_output.update(log=log)
             if status == JobStatus.DONE and element.type == JobType.LIST:
-                last_output.update(listing=element.listing)
+                last_output.update(listing=element.get_listing(*listing_page()))
             attempt_list.append(last_output)
         return jsonify(attempt_list)
 
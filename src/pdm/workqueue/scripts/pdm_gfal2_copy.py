@@ -3,6 +3,8 @@
 import os
 import sys
 import time
+import threading
+from Queue import Queue, Empty
 from functools import partial
 import json
 import logging
@@ -58,12 +60,14 @@ def monitor_callback(job, src, dst, average, instant, transferred, elapsed):  #
 def pdm_gfal_copy(copy_dict, s_cred_file=None, t_cred_file=None, overwrite=False,
                   # pylint: disable=too-many-arguments, too-many-locals
                   parent=True, nbstreams=1, timeout=None,
-                  verbosity=logging.INFO):
+                  verbosity=logging.INFO, ctx=None, parallel=1):
     """
     Copy a single source file to a target file.
     Use separate source and target credentials. Do not overwrite destination by
     default.
     Copy json string is of a form: '{"files":[(source1, dest1), (source2, dest2),...]}'
+    A new gfal2 context is created unless one is passed in as ctx.
+    Up to parallel files are copied at once, each thread with its own context.
     """
 
     # _logger.addHandler(logging.StreamHandler())
@@ -90,16 +94,6 @@ def pdm_gfal_copy(copy_dict, s_cred_file=None, t_cred_file=None, overwrite=False
         dump_and_flush({"Reason": "No credentials passed in", "Code": 1, 'id': ''})
         return
 
-    ctx = gfal2.creat_context()
-
-    params = ctx.transfer_parameters()
-    params.overwrite = overwrite
-    params.create_parent = parent
-    params.nbstreams = nbstreams
-
-    if timeout is not None:
-        params.timeout = timeout
-  
     # unzip:
     _, src_l, dst_l = zip(*copy_list)  # don't care about jobid
     s_root = str(os.path.dirname(os.path.commonprefix(src_l)))
@@ -108,27 +102,90 @@ def pdm_gfal_copy(copy_dict, s_cred_file=None, t_cred_file=None, overwrite=False
     _logger.info("common source prefix: %s ", s_root)
     _logger.info("common dest   prefix: %s ", d_root)
 
-    gfal2.cred_set(ctx, s_root, s_cred)
-    gfal2.cred_set(ctx, d_root, t_cred)
+    def copier(ctx):
+        """Set up a context with the credentials and its transfer parameters."""
+        if ctx is None:
+            ctx = gfal2.creat_context()
+        gfal2.cred_set(ctx, s_root, s_cred)
+        gfal2.cred_set(ctx, d_root, t_cred)
+
+        params = ctx.transfer_parameters()
+        params.overwrite = overwrite
+        params.create_parent = parent
+        params.nbstreams = nbstreams
+
+        if timeout is not None:
+            params.timeout = timeout
+        return partial(_copy_file, ctx, params)
+
+    parallel = max(1, min(parallel, len(copy_list)))
+    if parallel == 1:
+        copy_file = copier(ctx)
+        for jobid, source_file, dest_file in copy_list:
+            copy_file(jobid, source_file, dest_file)
+        return
 
-    for jobid, source_file, dest_file in copy_list:
+    # Bounded pool of threads each with its own context, gfal2 releases the GIL while copying.
+    _logger.info("copying with %d parallel transfers", parallel)
+    queue = Queue()
+    for item in copy_list:
+        queue.put(item)
+    threads = [threading.Thread(target=_copy_worker, args=(copier(ctx if i == 0 else None), queue))
+               for i in xrange(parallel)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return
+
+
+def _copy_worker(copy_file, queue):
+    """
+    Copy files from the queue until it is empty.
+    :param copy_file: function copying a single (jobid, source, dest) with its own context
+    :param queue: Queue of (jobid, source, dest) to copy
+    :return:
+    """
+    while True:
         try:
-            job = {'jobid': jobid, 'monitor': False}
-            params.event_callback = partial(event_callback, job)
-            params.monitor_callback = partial(monitor_callback, job)
-            start_time = time.time()
-            res = ctx.filecopy(params, str(source_file), str(dest_file))
+            jobid, source_file, dest_file = queue.get_nowait()
+        except Empty:
+            return
+        copy_file(jobid, source_file, dest_file)
 
-            if not job['monitor']:  # pseudo-monitoring
-                elapsed = time.time() - start_time
-                dump_and_flush({'id': jobid, 'transferred': -1, 'elapsed': elapsed,
-                                'average': -1, 'instant': -1})
 
-            dump_and_flush({'Code': res, 'Reason': 'OK', 'id': jobid})
+def _copy_file(ctx, params, jobid, source_file, dest_file):
+    """
+    Copy a single file, reporting monitoring info and the result on stdout.
+    Any error is reported as the result for the file.
+    :param ctx: gfal2 context
+    :param params: transfer parameters belonging to this context
+    :param jobid: job element id
+    :param source_file: source file
+    :param dest_file: dest file
+    :return:
+    """
+    try:
+        job = {'jobid': jobid, 'monitor': False}
+        params.event_callback = partial(event_callback, job)
+        params.monitor_callback = partial(monitor_callback, job)
+        start_time = time.time()
+        res = ctx.filecopy(params, str(source_file), str(dest_file))
 
-        except gfal2.GError as gerror:
-            dump_and_flush({'Code': 1, 'Reason': str(gerror), 'id': jobid}, _logger, str(gerror))
-    return
+        if not job['monitor']:  # pseudo-monitoring
+            elapsed = time.time() - start_time
+            dump_and_flush({'id': jobid, 'transferred': -1, 'elapsed': elapsed,
+                            'average': -1, 'instant': -1})
+
+        dump_and_flush({'Code': res, 'Reason': 'OK', 'id': jobid})
+
+    except gfal2.GError as gerror:
+        dump_and_flush({'Code': 1, 'Reason': str(gerror), 'id': jobid}, _logger, str(gerror))
+    except Exception as err:  # pylint: disable=broad-except
+        # Anything else only fails this file rather than ending the (worker) thread.
+        dump_and_flush({'Code': 1, 'Reason': str(err), 'id': jobid}, _logger,
+                       "Error copying %s: %s", logging.ERROR, jobid, err)
 
 
 def _get_cred(cred_file):
@@ -139,19 +196,28 @@ def _get_cred(cred_file):
     return cred
 
 
-def json_input():
+def run(data, ctx=None):
     """
-    gfal2 wrapper which takes a json doc from stdin.
+    gfal2 copy based on a json doc.
+    :param data: json-loaded job document
+    :param ctx: gfal2 context to use, a new one is created if None
     :return:
     """
-
-    data = json.load(sys.stdin)
     if 'options' not in data:
         data['options'] = {}
 
     data['options'].setdefault('s_cred_file', os.environ.get('X509_USER_PROXY_SRC', None))
     data['options'].setdefault('t_cred_file', os.environ.get('X509_USER_PROXY_DST', None))
-    pdm_gfal_copy(data, **data.get('options', {}))
+    pdm_gfal_copy(data, ctx=ctx, **data.get('options', {}))
+
+
+def json_input():
+    """
+    gfal2 wrapper which takes a json doc from stdin.
+    :return:
+    """
+
+    run(json.load(sys.stdin))
 
 
 if __name__ == "__main__":
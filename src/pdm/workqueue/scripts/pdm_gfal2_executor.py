@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Long lived executor for the pdm gfal2 scripts.
+
+Reads job requests from stdin, one json document per line, and runs each of them with the
+named pdm_gfal2_* script within this process so that the interpreter start up, gfal2 import
+and context creation (plugin loading) are paid once rather than for every job. A request is
+of the form:
+
+    {"script": "pdm_gfal2_ls.py", "env": {"X509_USER_PROXY": path, ...}, "data": {...}}
+
+where data is the document the script would otherwise read from its stdin and env holds the
+environment variables (credentials, CA dir) for the job. The script output is written to
+stdout as usual followed by {"Done": returncode} once the request has been handled.
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+import gfal2
+import imp
+
+dump_and_flush = imp.load_module('stdout_dump_helper',
+                                 *imp.find_module('stdout_dump_helper',
+                                                  [os.path.dirname(__file__)])).dump_and_flush
+
+logging.basicConfig()
+_logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+SCRIPTS = ('pdm_gfal2_chmod', 'pdm_gfal2_copy', 'pdm_gfal2_ls',
+           'pdm_gfal2_mkdir', 'pdm_gfal2_rename', 'pdm_gfal2_rm')
+CREDENTIAL_VARS = ('X509_USER_PROXY', 'X509_USER_PROXY_SRC', 'X509_USER_PROXY_DST')
+
+
+def load_scripts():
+    """
+    Import the gfal2 scripts alongside this one.
+    :return: dict of script file name to module
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return {name + '.py': imp.load_module(name, *imp.find_module(name, [script_dir]))
+            for name in SCRIPTS}
+
+
+class ContextCache(object):
+    """
+    LRU cache of gfal2 contexts keyed on the content of the credentials they are used with
+    and the rest of the request environment (e.g. the CA dir), so that sessions cached by a
+    context are never reused with another user's credentials or another set of CAs.
+    """
+
+    def __init__(self, max_size=8):
+        self._contexts = OrderedDict()
+        self._max_size = max_size
+
+    @staticmethod
+    def _key(env):
+        """
+        Hash the credentials pointed to by the environment variables along with the other
+        variables. The credential file paths are new for each job so only their content counts.
+        """
+        key = hashlib.sha1()
+        for var in CREDENTIAL_VARS:
+            key.update(var + '\0')
+            path = env.get(var)
+            if path:
+                with open(path, 'rb') as cred_file:
+                    key.update(cred_file.read())
+        for var, value in sorted(env.iteritems()):
+            if var not in CREDENTIAL_VARS:
+                key.update('%s=%s\0' % (var, value))
+        return key.hexdigest()
+
+    def get(self, env):
+        """
+        Get the context for the credentials in env, creating it if need be.
+        :param env: environment variables for the job
+        :return: gfal2 context with its global options reset to their defaults
+        """
+        key = self._key(env)
+        ctx, namespace_timeout = self._contexts.pop(key, (None, None))
+        if ctx is None:
+            ctx = gfal2.creat_context()
+            namespace_timeout = ctx.get_opt_integer("CORE", "NAMESPACE_TIMEOUT")
+        self._contexts[key] = (ctx, namespace_timeout)
+        while len(self._contexts) > self._max_size:
+            self._contexts.popitem(last=False)
+
+        # Scripts only set the timeout if one was requested so undo any from an earlier job.
+        ctx.set_opt_integer("CORE", "NAMESPACE_TIMEOUT", namespace_timeout)
+        # The proxy file is new for each job even when the credentials are the same.
+        proxy = env.get('X509_USER_PROXY')
+        if proxy:
+            ctx.set_opt_string("X509", "CERT", str(proxy))
+            ctx.set_opt_string("X509", "KEY", str(proxy))
+        return ctx
+
+
+def handle_request(request, scripts, contexts, base_env):
+    """
+    Run a single job request.
+    :param request: json-loaded request
+    :param scripts: dict of script file name to module, see load_scripts
+    :param contexts: ContextCache to take the gfal2 context from
+    :param base_env: environment of the executor, the request env is set on top of this
+    :return: the return code the script would have exited with
+    """
+    env = request.get('env', {})
+    os.environ.clear()
+    os.environ.update(base_env)
+    os.environ.update(env)
+    try:
+        scripts[request['script']].run(request['data'], ctx=contexts.get(env))
+    except SystemExit as exit_:
+        if exit_.code is None:
+            return 0
+        return exit_.code if isinstance(exit_.code, int) else 1
+    except Exception:  # pylint: disable=broad-except
+        _logger.exception("Error running request for script %s", request.get('script'))
+        return 1
+    return 0
+
+
+def main():
+    """
+    Handle job requests read from stdin until it is closed.
+    :return: None
+    """
+    scripts = load_scripts()
+    contexts = ContextCache()
+    base_env = dict(os.environ)
+    # readline rather than iterating over stdin which reads ahead and would block.
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError:
+            _logger.exception("Problem json loading request.")
+            returncode = 1
+        else:
+            returncode = handle_request(request, scripts, contexts, base_env)
+        sys.stderr.flush()
+        dump_and_flush({'Done': returncode})
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import os
 import sys
 import inspect
 import stat
+import threading
+from Queue import Queue
 from collections import OrderedDict
 import json
 import logging
@@ -19,12 +21,22 @@ logging.basicConfig()
 _logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 ID = None
+# If set, partial listings are sent as soon as they hold at least this many entries.
+CHUNK_SIZE = None
+# If set, listing entries are lists of values in the order of columns() rather than dicts,
+# the column names being sent once with each listing.
+COMPACT = False
+# Names of the stat properties, resolved from the stat class once per process.
+STAT_FIELDS = None
 
 
-def pdm_gfal_ls(root, depth=-1, verbosity=logging.INFO, timeout=None):
+def pdm_gfal_ls(root, depth=-1, verbosity=logging.INFO, timeout=None, ctx=None,
+                concurrency=1):
     """
     Get a directory listing of a given depth. Depth = -1 list the filesystem for all levels.
     timeout is a global timeout for all gfal operations.
+    ctx is the gfal2 context to use, a new one is created if None.
+    concurrency > 1 lists the tree breadth first with up to that many directory reads in flight.
     """
 
     # _logger.addHandler(logging.StreamHandler())
@@ -34,9 +46,15 @@ def pdm_gfal_ls(root, depth=-1, verbosity=logging.INFO, timeout=None):
 
     max_depth = max(-1, depth)
 
-    ctx = gfal2.creat_context()
-    if timeout is not None:
-        ctx.set_opt_integer("CORE","NAMESPACE_TIMEOUT", timeout)
+    def new_context(ctx=None):
+        """Create a context (unless given one) with the timeout set."""
+        if ctx is None:
+            ctx = gfal2.creat_context()
+        if timeout is not None:
+            ctx.set_opt_integer("CORE","NAMESPACE_TIMEOUT", timeout)
+        return ctx
+
+    ctx = new_context(ctx)
     result = OrderedDict()
     # determine if the path point to a file, no recursion if True
     try:
@@ -46,28 +64,107 @@ def pdm_gfal_ls(root, depth=-1, verbosity=logging.INFO, timeout=None):
         dump_and_flush({'Reason': str(gfal_exc), 'Code': 1, 'id': ID})
         sys.exit(1)
 
-    stat_dict = {k: getattr(stat_tup, k)
-                 for k, _ in inspect.getmembers(stat_tup.__class__,
-                                                lambda x: isinstance(x, property))}
+    stat_fields(stat_tup)
 
-    if stat.S_ISDIR(stat_dict['st_mode']):
+    if stat.S_ISDIR(stat_tup.st_mode) and concurrency > 1:
+        ctxs = [ctx] + [new_context() for _ in xrange(concurrency - 1)]
+        pdm_gfal_bfs_list_dir(ctxs, root, result, max_depth)
+    elif stat.S_ISDIR(stat_tup.st_mode):
         pdm_gfal_long_list_dir(ctx, root, result, max_depth)
     else:
         _logger.debug("Top path points to a file ...")
-        pdm_gfal_list_file(stat_dict, root, result)
+        pdm_gfal_list_file(stat_tup, root, result)
 
     if verbosity == logging.DEBUG:
         pp.pprint(result, stream=sys.stderr)
     return result
 
 
-def pdm_gfal_list_file(props, root, result):
+def stat_fields(stats):
+    """
+    Get the names of the properties of a gfal2 stat object.
+    :param stats: gfal2 stat object
+    :return: tuple of property names
+    """
+    global STAT_FIELDS  # pylint: disable=global-statement
+    if STAT_FIELDS is None:
+        STAT_FIELDS = tuple(k for k, _ in inspect.getmembers(stats.__class__,
+                                                             lambda x: isinstance(x, property)))
+    return STAT_FIELDS
+
+
+def columns():
+    """
+    Names of the values in a compact listing entry.
+    :return: list of field names
+    """
+    return ['name'] + list(STAT_FIELDS)
+
+
+def make_entry(name, stats):
+    """
+    Make a listing entry, a dict of the stat fields and name or a list if COMPACT.
+    :param name: file name
+    :param stats: gfal2 stat object for the file
+    :return: listing entry
+    """
+    fields = stat_fields(stats)
+    if COMPACT:
+        return [name] + [getattr(stats, k) for k in fields]
+    entry = {k: getattr(stats, k) for k in fields}
+    entry['name'] = name
+    return entry
+
+
+def entry_name(entry):
+    """
+    Name of a listing entry (made with make_entry).
+    :param entry: listing entry
+    :return: file name
+    """
+    return entry[0] if COMPACT else entry['name']
+
+
+def is_dir(entry):
+    """
+    Whether a listing entry (made with make_entry) is a directory.
+    :param entry: listing entry
+    :return: bool
+    """
+    if COMPACT:
+        return stat.S_ISDIR(entry[STAT_FIELDS.index('st_mode') + 1])
+    return stat.S_ISDIR(entry['st_mode'])
+
+
+def listing_message(result, **kwargs):
+    """
+    Output document for a (partial) listing.
+    :param result: result dictionary
+    :param kwargs: other items of the document
+    :return: dict to be dumped to stdout
+    """
+    message = dict(kwargs, id=ID, Listing=result)
+    if COMPACT:
+        message['Columns'] = columns()
+    return message
+
+
+def stream_chunk(result):
+    """
+    Send the listing gathered so far as a partial listing if it has reached CHUNK_SIZE entries.
+    :param result: result dictionary, cleared if it is sent.
+    :return: None
+    """
+    if CHUNK_SIZE and sum(len(entries) for entries in result.itervalues()) >= CHUNK_SIZE:
+        dump_and_flush(listing_message(result))
+        result.clear()
+
+
+def pdm_gfal_list_file(stats, root, result):
     """
     List a file with its properties in the case the root is a file
     """
-    listing = props.copy()
-    listing['name'] = os.path.split(root)[1]
-    result[os.path.split(root)[0]] = [listing]
+    result[os.path.split(root)[0]] = [make_entry(os.path.split(root)[1], stats)]
 
 
 def pdm_gfal_list_dir(ctx, root, result, max_depth=-1, depth=1):
@@ -92,19 +189,16 @@ def pdm_gfal_list_dir(ctx, root, result, max_depth=-1, depth=1):
         dump_and_flush({'Reason': str(gfal_exc), 'Code': 1, 'id': ID})
         sys.exit(1)
 
-    stat_d_list = [dict(((k, getattr(j, k))
-                         for k, l in inspect.getmembers(j.__class__,
-                                                        lambda x: isinstance(x, property))),
-                        name=i)
-                   for i, j in stat_tup]
+    stat_d_list = [make_entry(i, j) for i, j in stat_tup]
 
     result[root] = stat_d_list
+    stream_chunk(result)
 
     if depth >= max_depth and max_depth != -1:
         return
 
     # sub directories of root
-    subdirs = [elem['name'] for elem in stat_d_list if stat.S_ISDIR(elem['st_mode'])]
+    subdirs = [entry_name(elem) for elem in stat_d_list if is_dir(elem)]
     if not subdirs:
         # we reached the bottom
         return
@@ -128,54 +222,138 @@ def pdm_gfal_long_list_dir(ctx, root, result, max_depth=-1, depth=1):
 
     """
 
-    dir_entries = []
     try:
-        dirp = ctx.opendir(root)
-
-        while True:
-            (dirent, stats) = dirp.readpp()
-            if dirent is None:
-                break
-            if dirent.d_name =='.' or dirent.d_name =='..':
-                continue
-            dir_entry = {k: getattr(stats, k) for k, _ in
-                         inspect.getmembers(stats.__class__, lambda x: isinstance(x, property))}
-            dir_entry['name'] = dirent.d_name
-            dir_entries.append(dir_entry)
-
+        dir_entries = read_dir(ctx, root)
         result[root] = dir_entries
     except Exception as gfal_exc:
         _logger.error("Error when analysing %s \n %s", root, gfal_exc)
         dump_and_flush({'Reason': str(gfal_exc), 'Code': 1, 'id': ID})
         sys.exit(1)
+    stream_chunk(result)
 
     if depth >= max_depth and max_depth != -1:
         return
 
     # sub directories of root
-    subdirs = [elem['name'] for elem in dir_entries if stat.S_ISDIR(elem['st_mode'])]
+    subdirs = [entry_name(elem) for elem in dir_entries if is_dir(elem)]
 
     for subdir in subdirs:
         pdm_gfal_long_list_dir(ctx, os.path.join(root, subdir), result, max_depth, depth=depth + 1)
 
 
-def json_input():
+def read_dir(ctx, root):
     """
-    gfal-ls directory/file based on a json document read from stdin.
-    :return:
+    Read the entries of a directory with their stat information using opendir/readpp.
+    Skip '.' and '..' directories.
+    :param ctx: gfal2 context
+    :param root: directory to read
+    :return: list of {'name':filename,... stat dict entries ...}
+    """
+    dir_entries = []
+    dirp = ctx.opendir(root)
+
+    while True:
+        (dirent, stats) = dirp.readpp()
+        if dirent is None:
+            break
+        if dirent.d_name =='.' or dirent.d_name =='..':
+            continue
+        dir_entries.append(make_entry(dirent.d_name, stats))
+    return dir_entries
+
+
+def _read_dir_worker(ctx, todo, done):
+    """
+    Read directories from the todo queue until a None is taken from it.
+    :param ctx: gfal2 context for this thread
+    :param todo: Queue of (directory, depth) to read
+    :param done: Queue the (directory, depth, entries, exception) results are put on
+    :return: None
     """
+    for root, depth in iter(todo.get, None):
+        try:
+            done.put((root, depth, read_dir(ctx, root), None))
+        except Exception as gfal_exc:  # pylint: disable=broad-except
+            done.put((root, depth, None, gfal_exc))
+
 
-    data = json.load(sys.stdin)
-    global ID  # pylint: disable=global-statement
+def pdm_gfal_bfs_list_dir(ctxs, root, result, max_depth=-1):
+    """
+    List files and directories of root breadth first, reading up to len(ctxs) directories
+    at once so that the round trip latency of each read is overlapped with the others.
+    Depth semantics are as pdm_gfal_long_list_dir, only the order of the result differs.
+    :param ctxs: gfal2 contexts, one per directory read in flight
+    :param root: root directory to start from
+    :param result: result dictionary for root:
+    {root:[{'name':filename,... stat dict entries ...},{..}]}
+    :param max_depth: maximum recursion depth:
+    positive integer or -1 for a max depth (0 is equivalent to -1)
+    :return: None
+    """
+    todo = Queue()
+    done = Queue()
+    threads = [threading.Thread(target=_read_dir_worker, args=(ctx, todo, done))
+               for ctx in ctxs]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    todo.put((root, 1))
+    pending = 1
+    try:
+        # the results are gathered (and streamed) in this thread only
+        while pending:
+            root, depth, dir_entries, gfal_exc = done.get()
+            pending -= 1
+            if gfal_exc is not None:
+                _logger.error("Error when analysing %s \n %s", root, gfal_exc)
+                dump_and_flush({'Reason': str(gfal_exc), 'Code': 1, 'id': ID})
+                sys.exit(1)
+            result[root] = dir_entries
+            stream_chunk(result)
+
+            if depth >= max_depth and max_depth != -1:
+                continue
+
+            for elem in dir_entries:
+                if is_dir(elem):
+                    todo.put((os.path.join(root, entry_name(elem)), depth + 1))
+                    pending += 1
+    finally:
+        for _ in threads:
+            todo.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def run(data, ctx=None):
+    """
+    gfal-ls directory/file based on a json document.
+    :param data: json-loaded job document
+    :param ctx: gfal2 context to use, a new one is created if None
+    :return: None
+    """
+    global ID, CHUNK_SIZE, COMPACT  # pylint: disable=global-statement
     ID = data.get('files')[0][0]  # (id, file)
+    options = data.get('options', {})
+    CHUNK_SIZE = options.pop('chunk_size', None)
+    COMPACT = options.pop('compact', False)
     # json.dump({'Reason': 'OK', 'Code': 0, 'id': ID,
     #           'Listing': pdm_gfal_ls(str(data.get('files')[0][1]), **data.get('options', {}))},
     #          sys.stdout)
     # sys.stdout.write('\n')
     # sys.stdout.flush()
-    obj = {'Reason': 'OK', 'Code': 0, 'id': ID,
-           'Listing': pdm_gfal_ls(str(data.get('files')[0][1]), **data.get('options', {}))}
-    dump_and_flush(obj)
+    listing = pdm_gfal_ls(str(data.get('files')[0][1]), ctx=ctx, **options)
+    dump_and_flush(listing_message(listing, Reason='OK', Code=0))
+
+
+def json_input():
+    """
+    gfal-ls directory/file based on a json document read from stdin.
+    :return:
+    """
+
+    run(json.load(sys.stdin))
 
 
 if __name__ == "__main__":
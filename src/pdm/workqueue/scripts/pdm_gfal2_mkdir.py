@@ -14,13 +14,14 @@ logging.basicConfig()
 _logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
-def pdm_gfal_mkdir(data, permissions=0o755, verbosity=logging.INFO, timeout=None):
+def pdm_gfal_mkdir(data, permissions=0o755, verbosity=logging.INFO, timeout=None, ctx=None):
     """
     Create a new directory.
     :param data: json-loaded dict with data {"dirs": [jobid, url]}
     :param permissions: directory permissions mapped from {"options":{"permissions":int}}
     :param verbosity: mapped from {"options":{"verbosity":logging level}}
     :param timeout: global gfal2 timeout for all operations
+    :param ctx: gfal2 context to use, a new one is created if None
     :return: dict of a form {'Code': return code, 'Reason': reason, 'id': jobid})
     """
 
@@ -32,7 +33,8 @@ def pdm_gfal_mkdir(data, permissions=0o755, verbosity=logging.INFO, timeout=None
         dump_and_flush({"Reason": "No directory to create passed in", "Code": 1, 'id': ''})
         return
 
-    ctx = gfal2.creat_context()
+    if ctx is None:
+        ctx = gfal2.creat_context()
     if timeout is not None:
         ctx.set_opt_integer("CORE","NAMESPACE_TIMEOUT", timeout)
 
@@ -45,14 +47,23 @@ def pdm_gfal_mkdir(data, permissions=0o755, verbosity=logging.INFO, timeout=None
                            logging.ERROR)
     return
 
+def run(data, ctx=None):
+    """
+    gfal-mkdir directory based on a json document.
+    :param data: json-loaded job document
+    :param ctx: gfal2 context to use, a new one is created if None
+    :return: None
+    """
+    pdm_gfal_mkdir(data, ctx=ctx, **data.get('options', {}))
+
+
 def json_input():
     """
     gfal-mkdir directory based on a json document read from stdin.
     :return: None
     """
 
-    data = json.load(sys.stdin)
-    pdm_gfal_mkdir(data, **data.get('options', {}))
+    run(json.load(sys.stdin))
 
 
 if __name__ == "__main__":
@@ -14,12 +14,13 @@ logging.basicConfig()
 _logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
-def pdm_gfal_rename(data, verbosity=logging.INFO, timeout=None):
+def pdm_gfal_rename(data, verbosity=logging.INFO, timeout=None, ctx=None):
     """
     Rename file or directory.
     :param data: json-loaded dict with data {"source": url}
     :param verbosity: mapped from "options":{"verbosity":logging level}
     :param timeout: global gfal2 timeout for all operations
+    :param ctx: gfal2 context to use, a new one is created if None
     :return: dict of a form {'Code': return code, 'Reason': reason, 'id': jobid})
     """
     _logger.setLevel(verbosity)
@@ -30,7 +31,8 @@ def pdm_gfal_rename(data, verbosity=logging.INFO, timeout=None):
         dump_and_flush({"Reason": "No files to rename passed in", "Code": 1, 'id': ''})
         return
 
-    ctx = gfal2.creat_context()
+    if ctx is None:
+        ctx = gfal2.creat_context()
     if timeout is not None:
         ctx.set_opt_integer("CORE","NAMESPACE_TIMEOUT", timeout)
 
@@ -43,14 +45,23 @@ def pdm_gfal_rename(data, verbosity=logging.INFO, timeout=None):
                            logging.ERROR)
     return
 
+def run(data, ctx=None):
+    """
+    gfal-rename file or directory based on a json document.
+    :param data: json-loaded job document
+    :param ctx: gfal2 context to use, a new one is created if None
+    :return: None
+    """
+    pdm_gfal_rename(data, ctx=ctx, **data.get('options', {}))
+
+
 def json_input():
     """
     gfal-rename  file or directory based on a json document read from stdin.
     :return: None
     """
 
-    data = json.load(sys.stdin)
-    pdm_gfal_rename(data, **data.get('options', {}))
+    run(json.load(sys.stdin))
 
 
 if __name__ == "__main__":
@@ -6,6 +6,10 @@ import sys
 import os
 import json
 import logging
+import threading
+from Queue import Queue, Empty
+from itertools import groupby
+from urlparse import urlsplit
 import gfal2
 import imp
 
@@ -16,50 +20,155 @@ dump_and_flush = imp.load_module('stdout_dump_helper',
 logging.basicConfig()
 _logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# Maximum number of files per bulk unlink request.
+BULK_SIZE = 1000
 
-def pdm_gfal_rm(rmdict, verbosity=logging.INFO, timeout=None):
+
+def pdm_gfal_rm(rmdict, verbosity=logging.INFO, timeout=None, ctx=None, parallel=1):
     """
     Remove files and directories. Print json string immediately after a file is removed.
+    Files are removed up to parallel at a time or, if parallel is 1, with bulk unlink requests
+    (gfal2 makes one request where the plugin supports it, e.g. srm, and otherwise, as for
+    gsiftp, unlinks the files one by one), or one at a time if the gfal2 bindings can't unlink
+    a list. Directories are removed a level at a time, deepest first, up to parallel at a time
+    within a level.
     :param rmdict: json-loaded dict with data {"source": url}
     :param verbosity: mapped from "options":{"verbosity":logging level}
     :param timeout: global gfal2 timeout for all operations
+    :param ctx: gfal2 context to use, a new one is created if None
+    :param parallel: maximum number of unlink/rmdir operations in flight
     """
     # _logger.addHandler(logging.StreamHandler())
     _logger.setLevel(verbosity)
 
-    ctx = gfal2.creat_context()
-    if timeout is not None:
-        ctx.set_opt_integer("CORE","NAMESPACE_TIMEOUT", timeout)
+    def new_context(ctx=None):
+        """Create a context (unless given one) with the timeout set."""
+        if ctx is None:
+            ctx = gfal2.creat_context()
+        if timeout is not None:
+            ctx.set_opt_integer("CORE","NAMESPACE_TIMEOUT", timeout)
+        return ctx
 
-    # files
     file_list = rmdict.get('files', [])  # list of dublets: (jobid, filename)
-    for jobid, elem in file_list:
-        try:
-            res = ctx.unlink(str(elem))
-            dump_and_flush({'Code': res, 'Reason': 'OK', 'id': jobid})
-        except gfal2.GError as gerror:
-            dump_and_flush({'Code': 1, 'Reason': str(gerror), 'id': jobid}, _logger, str(gerror))
-
-    # directories
     dir_list = rmdict.get('dirs', [])
-    for jobid, elem in dir_list:
-        try:
-            res = ctx.rmdir(str(elem))
-            dump_and_flush({'Code': res, 'Reason': 'OK', 'id': jobid})
-        except gfal2.GError as gerror:
-            dump_and_flush({'Code': 1, 'Reason': str(gerror), 'id': jobid}, _logger, str(gerror))
+    parallel = max(1, min(parallel, max(len(file_list), len(dir_list))))
+    ctxs = [new_context(ctx)] + [new_context() for _ in xrange(parallel - 1)]
+
+    # files
+    if parallel == 1 and len(file_list) > 1:
+        for i in xrange(0, len(file_list), BULK_SIZE):
+            if not _bulk_unlink(ctxs[0], file_list[i:i + BULK_SIZE]):
+                _run_parallel(ctxs, 'unlink', file_list[i:])
+                break
+    else:
+        _run_parallel(ctxs, 'unlink', file_list)
+
+    # directories, deepest first as a directory must be empty to be removed.
+    dir_list = sorted(dir_list, key=_depth, reverse=True)
+    for _, level in groupby(dir_list, key=_depth):
+        _run_parallel(ctxs, 'rmdir', list(level))
 
     return
 
 
+def _depth(item):
+    """
+    Depth of the directory in a (jobid, url) pair.
+    :param item: (jobid, url) pair
+    :return: number of path components
+    """
+    return len(urlsplit(item[1]).path.rstrip('/').split('/'))
+
+
+def _remove(ctx, method, jobid, elem):
+    """
+    Remove a single file or directory and report the result.
+    :param ctx: gfal2 context
+    :param method: 'unlink' or 'rmdir'
+    :param jobid: job element id
+    :param elem: url to remove
+    :return: None
+    """
+    try:
+        res = getattr(ctx, method)(str(elem))
+        dump_and_flush({'Code': res, 'Reason': 'OK', 'id': jobid})
+    except gfal2.GError as gerror:
+        dump_and_flush({'Code': 1, 'Reason': str(gerror), 'id': jobid}, _logger, str(gerror))
+
+
+def _bulk_unlink(ctx, file_list):
+    """
+    Remove a list of files with one bulk request and report the result for each file.
+    :param ctx: gfal2 context
+    :param file_list: list of (jobid, url) pairs
+    :return: False if the gfal2 bindings can't unlink a list (nothing is reported), else True
+    """
+    try:
+        errors = ctx.unlink([str(elem) for _, elem in file_list])
+    except gfal2.GError as gerror:
+        errors = [gerror] * len(file_list)
+    except TypeError:  # includes the Boost.Python ArgumentError of older bindings
+        _logger.info("gfal2 bindings don't support bulk unlink, removing files one at a time")
+        return False
+    for (jobid, _), error in zip(file_list, errors):
+        if error is None:
+            dump_and_flush({'Code': 0, 'Reason': 'OK', 'id': jobid})
+        else:
+            dump_and_flush({'Code': 1, 'Reason': str(error), 'id': jobid}, _logger, str(error))
+    return True
+
+
+def _run_parallel(ctxs, method, items):
+    """
+    Remove the (jobid, url) items, one thread per context working through them.
+    :param ctxs: list of gfal2 contexts
+    :param method: 'unlink' or 'rmdir'
+    :param items: list of (jobid, url) pairs
+    :return: None
+    """
+    if len(ctxs) == 1 or len(items) < 2:
+        for jobid, elem in items:
+            _remove(ctxs[0], method, jobid, elem)
+        return
+
+    queue = Queue()
+    for item in items:
+        queue.put(item)
+
+    def worker(ctx):
+        """Remove items until the queue is empty."""
+        while True:
+            try:
+                jobid, elem = queue.get_nowait()
+            except Empty:
+                return
+            _remove(ctx, method, jobid, elem)
+
+    threads = [threading.Thread(target=worker, args=(ctx,)) for ctx in ctxs[:len(items)]]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run(data, ctx=None):
+    """
+    gfal-rm directory/file based on a json document.
+    :param data: json-loaded job document
+    :param ctx: gfal2 context to use, a new one is created if None
+    :return: None
+    """
+    pdm_gfal_rm(data, ctx=ctx, **data.get('options', {}))
+
+
 def json_input():
     """
     gfal-rm directory/file based on a json document read from stdin.
     :return: None
     """
 
-    data = json.load(sys.stdin)
-    pdm_gfal_rm(data, **data.get('options', {}))
+    run(json.load(sys.stdin))
 
 
 if __name__ == "__main__":
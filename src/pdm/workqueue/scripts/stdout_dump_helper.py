@@ -1,6 +1,10 @@
 import logging
 import sys
 import json
+import threading
+
+# scripts may report from several threads, keep each output line whole.
+_lock = threading.Lock()
 
 
 def dump_and_flush(obj, logger=None, log_message='',
@@ -13,8 +17,9 @@ def dump_and_flush(obj, logger=None, log_message='',
     :param level: logging level
     :return:
     """
-    json.dump(obj, sys.stdout)
-    sys.stdout.write('\n')
-    if logger:
-        logger.log(verbosity, log_message, *args, **kwargs)
-    sys.stdout.flush()
+    with _lock:
+        json.dump(obj, sys.stdout)
+        sys.stdout.write('\n')
+        if logger:
+            logger.log(verbosity, log_message, *args, **kwargs)
+        sys.stdout.flush()
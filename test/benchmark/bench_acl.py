@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Benchmark ACLManager wildcard rule matching, the old linear scan against the compiled trie.
+
+Every rule of every auth section in --auth is loaded into its own ACLManager and matched
+against a set of request paths made from the rules themselves (with '?' and '*' filled in)
+and the test_ACLManager wildcard vectors. Each request is checked against the linear scan
+first so any difference in the matched rules is reported before timing.
+
+Example:
+    python test/benchmark/bench_acl.py --auth etc/system.auth --repeat 2000
+"""
+import os
+import logging
+from argparse import ArgumentParser
+
+from common import TOP_PATH, timer
+from pdm.utils.config import ConfigSystem
+from pdm.framework.ACLManager import ACLManager
+
+# Rules and requests from test_ACLManager.test_wildcards
+TEST_RULES = ["/ep1/?", "/ep1/test/?", "/ep1/test/?/test2", "/ep1/test/?/test2/?",
+              "/ep2/test/?/?", "/ep3/test/*", "/ep4/*/test", "/ep5/?/test%POST", "*"]
+TEST_REQUESTS = ["/ep1", "/ep1/blah", "/ep1/test", "/ep1/blah/bad", "/ep1/test/blah",
+                 "/ep1/test/blah/test2", "/ep1/test/blah/test2/blah2", "/ep1/test/blah/test3",
+                 "/ep2", "/ep2/test/blah2", "/ep2/test/blah2/extra", "/ep3", "/ep3/test",
+                 "/ep3/test/extra1", "/ep3/test/extra1/extra2", "/ep4/blah/test",
+                 "/ep4/blah/blah/test", "/ep5/blah/test", "/", "/special", "/special/special"]
+
+
+def linear_match(req_detail, rule_detail):
+    """The rule matching as done before the trie, one rule at a time."""
+    req_path, req_method = req_detail.split('%')
+    rule_path, rule_method = rule_detail.split('%')
+    if req_method != rule_method:
+        return False
+    req_parts = req_path.split('/')
+    rule_parts = rule_path.split('/')
+    if len(req_parts) < len(rule_parts):
+        return False
+    if rule_parts[-1] == '*':
+        rule_parts = rule_parts[0:-1]
+        req_parts = req_parts[0:len(rule_parts)]
+    if len(req_parts) > len(rule_parts):
+        return False
+    for part_num in xrange(0, len(rule_parts)):
+        if rule_parts[part_num] != '?' and req_parts[part_num] != rule_parts[part_num]:
+            return False
+    return True
+
+
+def make_manager(rules):
+    """Build an ACLManager allowing ALL for each of the rule paths."""
+    acl = ACLManager(logging.getLogger("benchmark"))
+    for rule in rules:
+        acl.add_rule(rule, "ALL")
+    return acl
+
+
+def make_requests(rules):
+    """Request paths (with method) for each rule and a few that match none."""
+    requests = set()
+    for rule in rules:
+        path, method = (rule if '%' in rule else rule + '%GET').split('%', 1)
+        requests.add((path.replace('?', '123').replace('*', 'a/b'), method))
+        requests.add((path.replace('?', '123').rstrip('*') + 'x', 'DELETE'))
+        requests.add((path + '/extra/bits', method))
+    return sorted(requests)
+
+
+def main():
+    """Benchmark entry point."""
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--auth", default=os.path.join(TOP_PATH, "etc", "system.auth"),
+                        help="Auth config file to take the rules from")
+    parser.add_argument("--repeat", type=int, default=1000,
+                        help="Times each request is matched")
+    args = parser.parse_args()
+
+    config = ConfigSystem.get_instance()
+    config.setup(args.auth)
+    rule_sets = [('test_wildcards', TEST_RULES, [(path, 'GET') for path in TEST_REQUESTS])]
+    for section in config.sections:
+        if section.startswith('auth/'):
+            rules = config.get_section(section).keys()
+            rule_sets.append((section, rules, make_requests(rules)))
+
+    print "%-16s %6s %8s %12s %12s %8s" % ("rules", "n", "requests", "linear (us)",
+                                          "trie (us)", "speedup")
+    for name, rules, requests in rule_sets:
+        acl = make_manager(rules)
+        # Rules as stored by add_rule, with the default method
+        full_rules = [rule if '%' in rule else rule + '%GET' for rule in rules]
+        trie_match = acl._ACLManager__match_path  # pylint: disable=protected-access
+        for path, method in requests:
+            expected = sum(1 for rule in full_rules
+                           if linear_match('%s%%%s' % (path, method), rule))
+            found = len(trie_match(path, method))
+            if expected != found:
+                print "MISMATCH %s %s%%%s: linear %d, trie %d" % (name, path, method,
+                                                                expected, found)
+
+        with timer() as linear:
+            for _ in xrange(args.repeat):
+                for path, method in requests:
+                    req_detail = '%s%%%s' % (path, method)
+                    for rule in full_rules:
+                        linear_match(req_detail, rule)
+        with timer() as trie:
+            for _ in xrange(args.repeat):
+                for path, method in requests:
+                    trie_match(path, method)
+        n_checks = float(args.repeat * len(requests))
+        print "%-16s %6d %8d %12.2f %12.2f %7.1fx" % (
+            name, len(rules), len(requests), linear['elapsed'] / n_checks * 1e6,
+            trie['elapsed'] / n_checks * 1e6, linear['elapsed'] / trie['elapsed'])
+
+
+if __name__ == "__main__":
+    main()
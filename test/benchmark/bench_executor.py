@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Benchmark small gfal2 jobs run one script process per job against a persistent executor.
+
+Each job makes a directory and then lists it, on file:// URLs under a temporary directory,
+so the time is dominated by process start up, the gfal2 import and context creation rather
+than by the operations themselves. Requires gfal2.
+
+Example:
+    python test/benchmark/bench_executor.py --jobs 200
+"""
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+from common import timer
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', '..', 'src', 'pdm', 'workqueue', 'scripts')
+
+
+def job_requests(base_dir, n_jobs):
+    """The (script, data) pairs for n_jobs mkdir + ls jobs."""
+    for i in xrange(n_jobs):
+        url = 'file://' + os.path.join(base_dir, 'dir%d' % i)
+        yield 'pdm_gfal2_mkdir.py', {'dirs': [['%d.0' % i, url]]}
+        yield 'pdm_gfal2_ls.py', {'files': [['%d.1' % i, url]]}
+
+
+def spawn_per_job(requests):
+    """Run each job in a new script process, as the worker does by default."""
+    for script, data in requests:
+        process = subprocess.Popen([os.path.join(SCRIPT_DIR, script)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        process.communicate(json.dumps(data) + '\n')
+
+
+def executor(requests):
+    """Run all the jobs through one persistent executor."""
+    process = subprocess.Popen([os.path.join(SCRIPT_DIR, 'pdm_gfal2_executor.py')],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    for script, data in requests:
+        process.stdin.write(json.dumps({'script': script, 'env': {}, 'data': data}) + '\n')
+        process.stdin.flush()
+        for line in iter(process.stdout.readline, ''):
+            if 'Done' in json.loads(line):
+                break
+    process.stdin.close()
+    process.wait()
+
+
+def main():
+    """Benchmark entry point."""
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=100,
+                        help="Number of mkdir + ls job pairs to run.")
+    args = parser.parse_args()
+
+    print "%16s %10s %10s" % ("mode", "time (s)", "jobs/s")
+    for name, method in (('spawn per job', spawn_per_job), ('executor', executor)):
+        base_dir = tempfile.mkdtemp()
+        try:
+            with timer() as elapsed:
+                method(job_requests(base_dir, args.jobs))
+        finally:
+            shutil.rmtree(base_dir)
+        print "%16s %10.2f %10.1f" % (name, elapsed['elapsed'],
+                                      2 * args.jobs / elapsed['elapsed'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmark recursive listing in pdm_gfal2_ls, depth first against concurrent breadth first.
+
+A tree of --fanout sub directories per directory, --depth levels deep with --files files in
+each directory, is made under a temporary directory and listed through file:// URLs with
+1 (depth first, as before) and then each of the --concurrency directory reads in flight.
+A local filesystem has next to no latency so --rtt adds a sleep to every directory read to
+stand in for the round trip to a remote site. Requires gfal2.
+
+Example:
+    python test/benchmark/bench_list.py --fanout 8 --depth 3 --rtt 0.05
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+
+import gfal2
+
+from common import timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'src', 'pdm', 'workqueue', 'scripts'))
+import pdm_gfal2_ls  # pylint: disable=wrong-import-position
+
+
+class LatencyContext(object):
+    """gfal2 context wrapper adding a fixed delay to every opendir."""
+
+    def __init__(self, ctx, rtt):
+        self._ctx = ctx
+        self._rtt = rtt
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+    def opendir(self, path):
+        """Delayed opendir."""
+        time.sleep(self._rtt)
+        return self._ctx.opendir(path)
+
+
+def make_tree(root, fanout, depth, n_files):
+    """Make the directory tree, returning the number of directories in it."""
+    n_dirs = 1
+    for i in xrange(n_files):
+        open(os.path.join(root, 'file%d' % i), 'w').close()
+    if depth > 1:
+        for i in xrange(fanout):
+            sub_dir = os.path.join(root, 'dir%d' % i)
+            os.mkdir(sub_dir)
+            n_dirs += make_tree(sub_dir, fanout, depth - 1, n_files)
+    return n_dirs
+
+
+def main():
+    """Benchmark entry point."""
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fanout", type=int, default=6, help="Sub directories per directory.")
+    parser.add_argument("--depth", type=int, default=4, help="Levels in the tree.")
+    parser.add_argument("--files", type=int, default=10, help="Files per directory.")
+    parser.add_argument("--rtt", type=float, default=0.01,
+                        help="Simulated round trip time (s) for each directory read.")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[4, 16, 64])
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        n_dirs = make_tree(base_dir, args.fanout, args.depth, args.files)
+        root = 'file://' + base_dir
+        print "Listing %d directories with %.3fs simulated rtt" % (n_dirs, args.rtt)
+        print "%12s %10s %10s %10s" % ("concurrency", "dirs", "time (s)", "dirs/s")
+        for concurrency in [1] + args.concurrency:
+            ctxs = [LatencyContext(gfal2.creat_context(), args.rtt)
+                    for _ in xrange(concurrency)]
+            result = {}
+            with timer() as elapsed:
+                if concurrency == 1:
+                    pdm_gfal2_ls.pdm_gfal_long_list_dir(ctxs[0], root, result)
+                else:
+                    pdm_gfal2_ls.pdm_gfal_bfs_list_dir(ctxs, root, result)
+            print "%12d %10d %10.2f %10.1f" % (concurrency, len(result), elapsed['elapsed'],
+                                               len(result) / elapsed['elapsed'])
+    finally:
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Benchmark RESTClient request throughput.
+
+Serves a trivial JSON endpoint from a local threaded Flask stand-in and times GET requests
+made with a fresh connection per request (the old requests.request behaviour) and with
+RESTClient's pooled keep-alive sessions, for a range of client thread counts.
+The stand-in is plain HTTP, so the saving from not repeating TLS handshakes is not included.
+
+Example:
+    python test/benchmark/bench_restclient.py --requests 2000 --threads 1,4,16
+"""
+import socket
+import logging
+import tempfile
+import threading
+from argparse import ArgumentParser
+
+import requests
+from flask import Flask
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from common import timer
+from pdm.framework.RESTClient import RESTClient
+from pdm.utils.config import ConfigSystem
+
+
+def make_standin():
+    """Start a threaded Flask stand-in service, returning (server, base URL)."""
+    app = Flask("standin")
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    @app.route('/bench/api/v1.0/ping')
+    def ping():  # pylint: disable=unused-variable
+        """Trivial JSON endpoint."""
+        return '{"pong": true}', 200, {'Content-Type': 'application/json'}
+
+    class KeepAliveHandler(WSGIRequestHandler):  # pylint: disable=too-few-public-methods
+        """Request handler allowing persistent connections."""
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            """Disable Nagle so small responses aren't delayed on kept-alive connections."""
+            WSGIRequestHandler.setup(self)
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:%d/bench/api/v1.0" % server.server_port
+
+
+def unpooled(url, n_requests):
+    """Issue requests the way RESTClient used to, a new connection each time."""
+    for _ in xrange(n_requests):
+        requests.request('GET', url + '/ping', timeout=30).json()
+
+
+def pooled(_, n_requests):
+    """Issue requests through a (shared, pooled) RESTClient."""
+    client = RESTClient('bench')
+    for _ in xrange(n_requests):
+        client.get('ping')
+
+
+def run(func, url, n_threads, n_requests):
+    """Run func in n_threads threads splitting n_requests between them, returning req/sec."""
+    threads = [threading.Thread(target=func, args=(url, n_requests // n_threads))
+               for _ in xrange(n_threads)]
+    with timer() as result:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return (n_requests // n_threads) * n_threads / result['elapsed']
+
+
+def main():
+    """Benchmark entry point."""
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per measurement.")
+    parser.add_argument("--threads", default="1,4,16",
+                        help="Comma separated list of client thread counts.")
+    args = parser.parse_args()
+
+    server, url = make_standin()
+    with tempfile.NamedTemporaryFile() as conf:
+        conf.write('[endpoints]\nbench = "%s"\n[client]\npool_size = 16\n' % url)
+        conf.flush()
+        ConfigSystem.get_instance().setup(conf.name)  # pylint: disable=no-member
+
+    print "%8s %16s %16s %8s" % ("threads", "unpooled req/s", "pooled req/s", "speedup")
+    for n_threads in (int(n) for n in args.threads.split(',')):
+        before = run(unpooled, url, n_threads, args.requests)
+        after = run(pooled, url, n_threads, args.requests)
+        print "%8d %16.1f %16.1f %7.2fx" % (n_threads, before, after, after / before)
+    RESTClient.close_sessions()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
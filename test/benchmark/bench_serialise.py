@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Benchmark serialising JobElement rows to JSON, as get_elements does.
+
+The queue is populated with one job of --elements elements which are loaded once and then
+converted with dict(), encode_for_json() and jsonify(), each --repeat times. The query
+itself is timed separately as it is not part of the serialisation.
+
+Example:
+    python test/benchmark/bench_serialise.py --elements 100000
+"""
+from argparse import ArgumentParser
+
+from common import make_service, populate, timer
+from pdm.framework.FlaskWrapper import jsonify
+
+
+def main():
+    """Benchmark entry point."""
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", default="sqlite:///",
+                        help="SQLAlchemy database URI (default: in memory sqlite)")
+    parser.add_argument("--elements", type=int, default=100000,
+                        help="Number of elements to serialise")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Times each conversion is run, the best time is reported")
+    args = parser.parse_args()
+
+    service = make_service(args.db)
+    populate(service, 1, args.elements)
+    with service.test_request_context():
+        JobElement = service.test_db().tables.JobElement  # pylint: disable=invalid-name
+        with timer() as query:
+            elements = JobElement.query.filter_by(job_id=1).order_by(JobElement.id).all()
+        print "%-16s %8.3f s" % ("query", query['elapsed'])
+        conversions = (("dict", lambda: [dict(element) for element in elements]),
+                       ("encode_for_json", lambda: [element.encode_for_json()
+                                                    for element in elements]),
+                       ("jsonify", lambda: jsonify(elements)))
+        for name, conversion in conversions:
+            best = None
+            for _ in xrange(args.repeat):
+                with timer() as elapsed:
+                    conversion()
+                if best is None or elapsed['elapsed'] < best:
+                    best = elapsed['elapsed']
+            print "%-16s %8.3f s %10.0f rows/s" % (name, best, len(elements) / best)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@
 import json
 import logging
 import unittest
+from datetime import datetime
+
+import mock
 
 from flask import Flask, current_app, request
 from werkzeug.exceptions import HTTPException, Forbidden, NotFound
@@ -15,8 +18,10 @@ class FakeTokenSVC(object):
 
     def __init__(self, token_ok=True):
         self.__token_ok = token_ok
+        self.checks = 0
 
     def check(self, raw_token):
+        self.checks += 1
         if not self.__token_ok:
             raise ValueError("Invalid Token")
         return json.loads(raw_token)
@@ -32,7 +37,7 @@ class TestACLManager(unittest.TestCase):
 
     def __gen_req(self, path, method="GET",
                   auth_mode=ACLManager.AUTH_MODE_NONE, auth_data=None,
-                  cert_ok=True, token_ok=True):
+                  cert_ok=True, token_ok=True, token_svc=None):
         """ Call self.__inst.check_request while generating a fake request
             with the given parameters (without using test_mode on the 
             ACLManager).
@@ -41,7 +46,8 @@ class TestACLManager(unittest.TestCase):
         """
         app = Flask("ACLManagertest")
         app.secret_key = "TestKey" # Required for session support
-        token_svc = FakeTokenSVC(token_ok)
+        if not token_svc:
+            token_svc = FakeTokenSVC(token_ok)
         try:
             headers = {}
             enable_session = False
@@ -231,6 +237,58 @@ class TestACLManager(unittest.TestCase):
         self.assertTrue(self.__gen_req("/special"))
         self.assertTrue(self.__gen_req("/special/special"))
 
+    def test_wildcard_precedence(self):
+        """ Check that an exact rule overrides any wildcard rule
+            and that any one matching wildcard rule allows access.
+        """
+        self.__inst.add_rule("/ep1/?", "ALL")
+        self.__inst.add_rule("/ep1/special", "CERT")
+        self.__inst.add_rule("/ep2/?", "CERT")
+        self.__inst.add_rule("/ep2/*", "ALL")
+        self.__inst.add_rule("/ep2/?/test", "CERT")
+        # The exact rule denies even though the wildcard would allow
+        self.assertFalse(self.__gen_req("/ep1/special"))
+        self.assertTrue(self.__gen_req("/ep1/special", "GET",
+                                       ACLManager.AUTH_MODE_X509, "C=X"))
+        self.assertTrue(self.__gen_req("/ep1/other"))
+        # including with a trailing slash
+        self.assertFalse(self.__gen_req("/ep1/special/"))
+        self.assertFalse(self.__gen_req("/ep1/special", "POST"))
+        # Overlapping wildcards, ? and * at the same level
+        self.assertTrue(self.__gen_req("/ep2/blah"))
+        self.assertTrue(self.__gen_req("/ep2/blah/test"))
+        self.assertTrue(self.__gen_req("/ep2/blah/test/extra"))
+        self.assertFalse(self.__gen_req("/ep2"))
+
+    def test_wildcard_literal_segments(self):
+        """ Check that flask style <int:...> segments are only
+            matched literally, ? must be used as the wildcard.
+        """
+        self.__inst.add_rule("/jobs/<int:job_id>", "ALL")
+        self.__inst.add_rule("/jobs/?/elements/<int:element_id>", "ALL")
+        self.assertFalse(self.__gen_req("/jobs/5"))
+        self.assertTrue(self.__gen_req("/jobs/<int:job_id>"))
+        self.assertFalse(self.__gen_req("/jobs/5/elements/6"))
+        self.assertTrue(self.__gen_req("/jobs/5/elements/<int:element_id>"))
+        self.assertFalse(self.__gen_req("/jobs/5/elements/<int:element_id>/extra"))
+
+    def test_wildcard_methods(self):
+        """ Check that wildcard rules are kept apart per method. """
+        self.__inst.add_rule("/ep1/?%POST", "ALL")
+        self.__inst.add_rule("/ep1/?%DELETE", "CERT")
+        self.__inst.add_rule("/ep1/*%PUT", "ALL")
+        self.__inst.add_rule("/ep1/blah/test", "ALL")
+        self.assertFalse(self.__gen_req("/ep1/blah"))
+        self.assertTrue(self.__gen_req("/ep1/blah", "POST"))
+        self.assertFalse(self.__gen_req("/ep1/blah", "DELETE"))
+        self.assertTrue(self.__gen_req("/ep1/blah", "DELETE",
+                                       ACLManager.AUTH_MODE_X509, "C=X"))
+        self.assertTrue(self.__gen_req("/ep1/blah", "PUT"))
+        self.assertTrue(self.__gen_req("/ep1/blah/test", "PUT"))
+        self.assertTrue(self.__gen_req("/ep1/blah/test", "GET"))
+        self.assertFalse(self.__gen_req("/ep1/blah/test", "POST"))
+        self.assertFalse(self.__gen_req("/ep1/blah/other", "GET"))
+
     def test_wildcard_but_wrong_auth(self):
         """ Simply test wildcard rule which matches one auth type,
             but the user has a different auth type.
@@ -318,3 +376,69 @@ class TestACLManager(unittest.TestCase):
                                         ACLManager.AUTH_MODE_TOKEN, BAD_TOKEN))
         self.assertFalse(self.__gen_req('/ep_tkn', 'GET',
                                         ACLManager.AUTH_MODE_TOKEN, UGLY_TOKEN))
+
+    def test_token_cache(self):
+        """ Check that verified tokens are cached until they expire. """
+        TOKEN = {'id': 123, 'expiry': '2099-12-31T23:59:59.00' }
+        token_svc = FakeTokenSVC()
+        self.__inst.add_rule("/ep_tkn", "TOKEN")
+        for _ in xrange(3):
+            self.assertTrue(self.__gen_req('/ep_tkn', 'GET',
+                                           ACLManager.AUTH_MODE_TOKEN, TOKEN,
+                                           token_svc=token_svc))
+        self.assertEqual(token_svc.checks, 1)
+        self.assertEqual(self.__inst.token_cache_stats(),
+                         {'hits': 2, 'misses': 1, 'size': 1})
+        # A different token service must verify the token itself
+        self.assertFalse(self.__gen_req('/ep_tkn', 'GET',
+                                        ACLManager.AUTH_MODE_TOKEN, TOKEN,
+                                        token_ok=False))
+        # Cached tokens are still rejected once they expire
+        with mock.patch('pdm.framework.ACLManager.datetime') as dt_mock:
+            dt_mock.utcnow.return_value = datetime(2100, 1, 1)
+            self.assertFalse(self.__gen_req('/ep_tkn', 'GET',
+                                            ACLManager.AUTH_MODE_TOKEN, TOKEN,
+                                            token_svc=token_svc))
+        # and are dropped from the cache
+        self.assertEqual(token_svc.checks, 1)
+        self.assertEqual(self.__inst.token_cache_stats()['size'], 0)
+
+    def test_token_cache_copy(self):
+        """ Check that a cache hit returns a copy of the cached token. """
+        TOKEN = {'id': 123, 'groups': ['a'], 'expiry': '2099-12-31T23:59:59.00'}
+        token_svc = FakeTokenSVC()
+        self.__inst.add_rule("/ep_tkn", "TOKEN")
+        app = Flask("ACLManagertest")
+        for _ in xrange(2):
+            headers = {'X-Token': json.dumps(TOKEN)}
+            with app.test_request_context(path='/ep_tkn', headers=headers):
+                current_app.log = self.__log
+                current_app.token_svc = token_svc
+                request.uuid = "Test-Test-Test"
+                self.__inst.check_request()
+                self.assertEqual(request.token, TOKEN)
+                # Changes made by one request must not be seen by the next
+                request.token['id'] = 456
+                request.token['groups'].append('b')
+        self.assertEqual(token_svc.checks, 1)
+        self.assertEqual(self.__inst.token_cache_stats(),
+                         {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_token_cache_size(self):
+        """ Check that the token cache is bounded. """
+        inst = ACLManager(self.__log, token_cache_size=2)
+        inst.add_rule("/ep_tkn", "TOKEN")
+        token_svc = FakeTokenSVC()
+        app = Flask("ACLManagertest")
+        for token_id in (1, 2, 3, 1):
+            headers = {'X-Token': json.dumps({'id': token_id})}
+            with app.test_request_context(path='/ep_tkn', headers=headers):
+                current_app.log = self.__log
+                current_app.token_svc = token_svc
+                request.uuid = "Test-Test-Test"
+                inst.check_request()
+                self.assertTrue(request.token_ok)
+        # Token 1 was evicted by token 3, so it had to be checked again
+        self.assertEqual(token_svc.checks, 4)
+        self.assertEqual(inst.token_cache_stats(),
+                         {'hits': 0, 'misses': 4, 'size': 2})
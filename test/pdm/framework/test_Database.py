@@ -6,6 +6,8 @@ import json
 import datetime
 import unittest
 
+from sqlalchemy import Column, DateTime, Integer
+
 from pdm.framework.Database import MemSafeSQLAlchemy
 from pdm.framework.Database import JSONMixin, JSONTableEncoder
 
@@ -124,3 +126,57 @@ class TestDBJson(unittest.TestCase):
         ret_obj = TestCls.from_json(json_str)
         self.assertEqual("Test123", ret_obj.A)
         self.assertEqual(321, ret_obj.B)
+
+    def test_columnCache(self):
+        """ Check that the column names are worked out separately
+            for each model class.
+        """
+        class BaseCls(JSONMixin):
+            __table__ = mock.Mock()
+            __table__.columns = (mock.Mock(), mock.Mock())
+            __table__.columns[0].name = 'A'
+            __table__.columns[1].name = 'B'
+            A = 1
+            B = 2
+
+        class SubCls(BaseCls):
+            __table__ = mock.Mock()
+            __table__.columns = (mock.Mock(), mock.Mock())
+            __table__.columns[0].name = 'A'
+            __table__.columns[1].name = 'C'
+            __excluded_fields__ = ['A']
+            C = 3
+
+        base = BaseCls()
+        sub = SubCls()
+        self.assertEqual(base.columns, ['A', 'B'])
+        self.assertEqual(sub.columns, ['C'])
+        self.assertEqual(base['A'], 1)
+        self.assertEqual(sub['C'], 3)
+        self.assertRaises(KeyError, sub.__getitem__, 'A')
+        self.assertRaises(KeyError, base.__getitem__, 'C')
+        self.assertEqual(len(base), 2)
+        self.assertEqual(len(sub), 1)
+        self.assertDictEqual(dict(sub), {'C': 3})
+
+    def test_datetimeColumns(self):
+        """ Check that only datetime (or unknown) columns are converted. """
+        my_time = datetime.datetime.now()
+
+        class TestCls(JSONMixin):
+            __table__ = mock.Mock()
+            __table__.columns = (Column('T', DateTime), Column('N', Integer),
+                                 mock.Mock())
+            __table__.columns[2].name = 'U'
+
+            def __init__(self):
+                self.T = my_time
+                self.N = 5
+                self.U = my_time
+
+        obj = TestCls()
+        self.assertEqual(TestCls._datetime_columns(), ('T', 'U'))
+        self.assertDictEqual(obj.encode_for_json(),
+                             {'T': my_time.isoformat(),
+                              'N': 5,
+                              'U': my_time.isoformat()})
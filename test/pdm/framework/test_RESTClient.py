@@ -12,6 +12,14 @@ from pdm.framework.RESTClient import RESTClient, RESTClientTest, RESTException
 class TestRESTClient(unittest.TestCase):
     """ Test the RESTClient class. """
 
+    def setUp(self):
+        """ Ensure each test starts without any shared sessions. """
+        RESTClient.close_sessions()
+
+    def tearDown(self):
+        """ Remove any (possibly mocked) sessions created by the test. """
+        RESTClient.close_sessions()
+
     def __get_inst(self, base_url="", client_conf={}, broken=False, **kwargs):
         """ Gets an instance of RESTClient preconfigured with the provided
             base_url.
@@ -55,6 +63,8 @@ class TestRESTClient(unittest.TestCase):
             mock_resp.json.side_effect = functools.partial(ret_json,
                                                            ret_value)
         mock_req.request.return_value = mock_resp
+        # Route requests made on the pooled session to the mocked module
+        mock_req.Session.return_value.request = mock_req.request
         mock_req.codes = mock.Mock()
         mock_req.codes.ok = 200
         pass
@@ -122,6 +132,7 @@ class TestRESTClient(unittest.TestCase):
         """
         client = self.__get_inst()
         err_str = "Connection refused"
+        mock_req.Session.return_value.request = mock_req.request
         mock_req.request.side_effect = requests.exceptions.ConnectionError(err_str)
         with self.assertRaises(RESTException) as err:
             client.get('/file')
@@ -238,6 +249,44 @@ class TestRESTClient(unittest.TestCase):
         res = client.get('test_url')
         self.assertIsNone(res)
 
+    @mock.patch("pdm.framework.RESTClient.requests")
+    def test_shared_session(self, mock_req):
+        """ Check that clients with the same service & SSL options share
+            a session and that others get their own.
+        """
+        self.__mock_req(mock_req, 200, "")
+        self.__get_inst("https://localhost/a").get('test_url')
+        self.__get_inst("https://localhost/a").get('test_url')
+        self.assertEqual(mock_req.Session.call_count, 1)
+        self.__get_inst("https://localhost/b").get('test_url')
+        self.assertEqual(mock_req.Session.call_count, 2)
+        self.__get_inst("https://localhost/a",
+                        ssl_opts=('/TESTCA', None, None)).get('test_url')
+        self.assertEqual(mock_req.Session.call_count, 3)
+        RESTClient.close_sessions()
+        self.assertTrue(mock_req.Session.return_value.close.called)
+        self.__get_inst("https://localhost/a").get('test_url')
+        self.assertEqual(mock_req.Session.call_count, 4)
+
+    def test_pool_config(self):
+        """ Check the pool options are applied to the session. """
+        conf = {'pool_size': 7, 'keep_alive': False,
+                'retries': 5, 'retry_backoff': 1.5}
+        client = self.__get_inst("https://localhost/pool", client_conf=conf)
+        with mock.patch.object(requests.Session, "request",
+                               autospec=True) as mock_request:
+            mock_request.return_value.status_code = 200
+            mock_request.return_value.text = ""
+            client.get('test_url')
+        session = mock_request.call_args[0][0]
+        self.assertEqual(session.headers['Connection'], 'close')
+        self.assertEqual(session.cookies._policy.allowed_domains(), ())
+        adapter = session.get_adapter("https://localhost/pool")
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertEqual(adapter.max_retries.backoff_factor, 1.5)
+        self.assertNotIn('POST', adapter.max_retries.method_whitelist)
+
 class TestRESTClientTest(unittest.TestCase):
     """ A test case for RESTClientTest class. """
 
@@ -2,7 +2,9 @@
 """ Test SiteService client class. """
 
 import mock
+import time
 import logging
+import threading
 import datetime
 import unittest
 
@@ -80,6 +82,69 @@ class test_SiteClient(unittest.TestCase):
         self._inst.del_user(1000)
         self.assertRaises(Exception, self._inst.get_site, site_id)
 
+    def test_cache(self):
+        """ Check site details are cached and invalidated. """
+        self._inst._cache_ttl = 60
+        site_id = self._inst.add_site(self.SITE_INFO)
+        with mock.patch.object(self._inst, 'get', wraps=self._inst.get) as mock_get:
+            eps = self._inst.get_endpoints(site_id)
+            eps['endpoints'].append("modified:5")
+            self.assertEqual(len(self._inst.get_endpoints(site_id)['endpoints']), 2)
+            self._inst.get_site(site_id)
+            self._inst.get_site(site_id)
+            self.assertEqual(mock_get.call_count, 2)
+            # Expired entries are fetched again
+            with mock.patch('pdm.site.SiteClient.time.time', return_value=time.time() + 61):
+                self._inst.get_endpoints(site_id)
+            self.assertEqual(mock_get.call_count, 3)
+            self._inst.invalidate(site_id)
+            self._inst.get_site(site_id)
+            self.assertEqual(mock_get.call_count, 4)
+        # Adding through the client drops the cached site list
+        self.assertEqual(len(self._inst.get_sites()), 1)
+        other_id = self._inst.add_site(dict(self.SITE_INFO, site_name="Other Site"))
+        self.assertEqual(len(self._inst.get_sites()), 2)
+        self._inst.del_site(other_id)
+        # Deleting through the client drops its cached entries
+        self.assertEqual(len(self._inst.get_sites()), 1)
+        self._inst.del_site(site_id)
+        self.assertRaises(Exception, self._inst.get_site, site_id)
+        self.assertEqual(self._inst.get_sites(), [])
+        # and the cache is bounded
+        self._inst._cache_size = 1
+        site_id = self._inst.add_site(self.SITE_INFO)
+        self._inst.get_site(site_id)
+        self._inst.get_endpoints(site_id)
+        self.assertEqual(list(self._inst._cache), ['endpoint/%u' % site_id])
+
+    def test_cache_threads(self):
+        """ Check the cache stays consistent when shared by threads. """
+        self._inst._cache_ttl = 60
+        self._inst._cache_size = 5
+        errors = []
+
+        def use_cache():
+            try:
+                for i in xrange(200):
+                    self._inst.get_site(i % 10)
+                    if not i % 50:
+                        self._inst.invalidate(i % 10)
+            except Exception as err:  # pylint: disable=broad-except
+                errors.append(err)
+
+        with mock.patch.object(self._inst, 'get', side_effect=lambda uri: {'uri': uri}):
+            threads = [threading.Thread(target=use_cache) for _ in xrange(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(self._inst._cache), 5)
+        # The linked list of the OrderedDict is intact
+        self.assertEqual(len(list(self._inst._cache)), len(self._inst._cache))
+        for uri, (_, response) in self._inst._cache.items():
+            self.assertEqual(response, {'uri': uri})
+
     @mock.patch("pdm.site.SiteService.X509Utils")
     @mock.patch("pdm.site.SiteService.MyProxyUtils")
     def test_session(self, mp_mock, x509_mock):
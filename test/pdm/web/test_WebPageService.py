@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
+import json
+import threading
 import unittest
 import mock
 
-from pdm.web.WebPageService import WebPageService
+import flask
+from pdm.web.WebPageService import WebPageService, transfer_client
 from pdm.framework.FlaskWrapper import FlaskServer
 
 class TestWebPageService(unittest.TestCase):
@@ -39,3 +42,54 @@ class TestWebPageService(unittest.TestCase):
 
 
 
+
+    @mock.patch("pdm.web.WebPageService.TransferClient")
+    def test_js_list_status(self, tc_mock):
+        """ Check listings are returned by the status endpoint once done. """
+        with self.__test.session_transaction() as session:
+            session['token'] = 'usertoken'
+        tc_mock.return_value.status.return_value = {'status': 'SUBMITTED'}
+        res = self.__test.get('/web/js/list/3')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), {'job_id': 3, 'status': 'SUBMITTED'})
+        tc_mock.assert_called_with('usertoken', site_cache_ttl=60)
+        tc_mock.return_value.status.assert_called_once_with(3)
+        self.assertFalse(tc_mock.return_value.output.called)
+
+        tc_mock.return_value.status.return_value = {'status': 'DONE'}
+        tc_mock.return_value.output.return_value = \
+            [[{'listing': {'/data': [{'name': 'dir', 'st_mode': 0o040755},
+                                     {'name': 'file', 'st_mode': 0o0100644}]}}]]
+        res = self.__test.get('/web/js/list/3')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['listing'],
+                         [{'name': 'dir', 'st_mode': 0o040755, 'is_dir': True},
+                          {'name': 'file', 'st_mode': 0o0100644, 'is_dir': False}])
+        # The client is shared by the session's requests
+        self.assertEqual(tc_mock.call_count, 1)
+        with self.__test.session_transaction() as session:
+            session['token'] = 'othertoken'
+        self.__test.get('/web/js/list/3')
+        self.assertEqual(tc_mock.call_count, 2)
+
+    @mock.patch("pdm.web.WebPageService.TransferClient")
+    def test_transfer_client_threads(self, tc_mock):
+        """ Check concurrent requests share one client per token. """
+        tc_mock.side_effect = lambda token, **kwargs: mock.Mock(token=token)
+        clients = []
+
+        def get_client(token):
+            with self.__service.test_request_context():
+                flask.session['token'] = token
+                for _ in xrange(50):
+                    clients.append(transfer_client())
+
+        threads = [threading.Thread(target=get_client, args=('token%d' % (i % 2),))
+                   for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(clients), 400)
+        self.assertEqual(tc_mock.call_count, 2)
+        self.assertEqual(len(set(id(client) for client in clients)), 2)
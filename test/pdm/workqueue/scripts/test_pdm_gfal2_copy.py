@@ -0,0 +1,63 @@
+import sys
+import imp
+import unittest
+
+import mock
+
+from pdm.workqueue import scripts
+
+
+class GError(Exception):
+    pass
+
+
+def load_script(name, gfal2):
+    """Load a gfal2 script with the given (stub) gfal2 module."""
+    # Only the gfal2 entry is swapped, patch.dict would also drop the modules imported.
+    sys.modules['gfal2'] = gfal2
+    try:
+        return imp.load_module(name, *imp.find_module(name, scripts.__path__))
+    finally:
+        del sys.modules['gfal2']
+
+
+class TestPdmGfal2Copy(unittest.TestCase):
+    def setUp(self):
+        self._gfal2 = mock.MagicMock(GError=GError)
+        self._gfal2.creat_context.side_effect = self._context
+        self._copy = load_script('pdm_gfal2_copy', self._gfal2)
+        self._reports = {}
+        patcher = mock.patch.object(self._copy, 'dump_and_flush', side_effect=self._report)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _filecopy(params, src, dst):
+        if src.endswith('file1'):
+            raise GError("No such file")
+        if src.endswith('file2'):
+            raise ValueError("Unexpected")
+        return 0
+
+    def _context(self):
+        ctx = mock.MagicMock()
+        ctx.filecopy.side_effect = self._filecopy
+        return ctx
+
+    def _report(self, message, *_):
+        if 'Code' in message:
+            self._reports[message['id']] = message
+
+    def test_errors(self):
+        files = [('1.%d' % i, 'gsiftp://src/file%d' % i, 'gsiftp://dst/file%d' % i)
+                 for i in range(4)]
+        for parallel in (1, 3):
+            self._reports.clear()
+            self._copy.run({'files': files, 'options': {'s_cred_file': '/tmp/src_proxy',
+                                                        't_cred_file': '/tmp/dst_proxy',
+                                                        'parallel': parallel}})
+            # Every file is reported, errors other than GErrors only fail their own file.
+            self.assertEqual({jobid: report['Code'] for jobid, report in self._reports.items()},
+                             {'1.0': 0, '1.1': 1, '1.2': 1, '1.3': 0})
+            self.assertEqual(self._reports['1.1']['Reason'], 'No such file')
+            self.assertEqual(self._reports['1.2']['Reason'], 'Unexpected')
@@ -0,0 +1,62 @@
+import os
+import sys
+import imp
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pdm.workqueue import scripts
+
+
+def load_executor(gfal2):
+    """Load the executor script with the given (stub) gfal2 module."""
+    # Only the gfal2 entry is swapped, patch.dict would also drop the modules imported.
+    sys.modules['gfal2'] = gfal2
+    try:
+        return imp.load_module('pdm_gfal2_executor',
+                               *imp.find_module('pdm_gfal2_executor', scripts.__path__))
+    finally:
+        del sys.modules['gfal2']
+
+
+class TestContextCache(unittest.TestCase):
+    def setUp(self):
+        self._gfal2 = mock.MagicMock()
+        self._gfal2.creat_context.side_effect = lambda: mock.MagicMock()
+        self._executor = load_executor(self._gfal2)
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _proxy(self, name, content):
+        path = os.path.join(self._tmp_dir, name)
+        with open(path, 'w') as proxy_file:
+            proxy_file.write(content)
+        return path
+
+    def test_key(self):
+        contexts = self._executor.ContextCache()
+        env = {'X509_USER_PROXY': self._proxy('proxy1', 'creds'), 'X509_CERT_DIR': '/cas1'}
+        ctx = contexts.get(env)
+        # A new proxy file with the same credentials and CAs gets the same context.
+        self.assertIs(contexts.get(dict(env, X509_USER_PROXY=self._proxy('proxy2', 'creds'))),
+                      ctx)
+        ctx.set_opt_string.assert_called_with("X509", "KEY",
+                                              os.path.join(self._tmp_dir, 'proxy2'))
+        # Other credentials, CAs or environment do not.
+        self.assertIsNot(contexts.get(dict(env, X509_USER_PROXY=self._proxy('proxy3', 'other'))),
+                         ctx)
+        self.assertIsNot(contexts.get(dict(env, X509_CERT_DIR='/cas2')), ctx)
+        self.assertIsNot(contexts.get(dict(env, GLOBUS_TCP_PORT_RANGE='20000,25000')), ctx)
+        self.assertIs(contexts.get(env), ctx)
+        self.assertEqual(self._gfal2.creat_context.call_count, 4)
+
+    def test_evict(self):
+        contexts = self._executor.ContextCache(max_size=2)
+        envs = [{'X509_CERT_DIR': '/cas%d' % i} for i in range(3)]
+        ctxs = [contexts.get(env) for env in envs]
+        self.assertIs(contexts.get(envs[2]), ctxs[2])
+        self.assertIsNot(contexts.get(envs[0]), ctxs[0])
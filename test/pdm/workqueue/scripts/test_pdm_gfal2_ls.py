@@ -0,0 +1,150 @@
+import sys
+import imp
+import stat
+import threading
+import unittest
+
+import mock
+
+from pdm.workqueue import scripts
+
+# directory -> entries (name, is a directory)
+TREE = {'/root': [('file1', False), ('dir1', True), ('dir2', True)],
+        '/root/dir1': [('file2', False), ('dir3', True)],
+        '/root/dir2': [('file3', False)],
+        '/root/dir1/dir3': [('file4', False)]}
+
+
+def load_script(name, gfal2):
+    """Load a gfal2 script with the given (stub) gfal2 module."""
+    # Only the gfal2 entry is swapped, patch.dict would also drop the modules imported.
+    sys.modules['gfal2'] = gfal2
+    try:
+        return imp.load_module(name, *imp.find_module(name, scripts.__path__))
+    finally:
+        del sys.modules['gfal2']
+
+
+class FakeStat(object):
+    def __init__(self, is_dir):
+        self._mode = (stat.S_IFDIR | 0o755) if is_dir else (stat.S_IFREG | 0o644)
+
+    @property
+    def st_mode(self):
+        return self._mode
+
+    @property
+    def st_size(self):
+        return 0 if stat.S_ISDIR(self._mode) else 10
+
+
+class FakeDir(object):
+    def __init__(self, entries):
+        self._entries = iter([('.', True), ('..', True)] + entries)
+
+    def readpp(self):
+        for name, is_dir in self._entries:
+            return mock.MagicMock(d_name=name), FakeStat(is_dir)
+        return None, None
+
+
+class FakeContext(object):
+    """Stands in for a gfal2 context listing TREE, raising for the paths in errors."""
+
+    def __init__(self, errors=()):
+        self._errors = errors
+
+    def set_opt_integer(self, *args):
+        pass
+
+    def stat(self, path):
+        return FakeStat(path in TREE)
+
+    def listdir(self, path):
+        return [name for name, _ in TREE[path]]
+
+    def opendir(self, path):
+        if path in self._errors:
+            raise IOError("Permission denied: %s" % path)
+        return FakeDir(TREE[path])
+
+
+class TestPdmGfal2Ls(unittest.TestCase):
+    def setUp(self):
+        self._errors = ()
+        self._gfal2 = mock.MagicMock()
+        self._gfal2.creat_context.side_effect = lambda: FakeContext(self._errors)
+        self._ls = load_script('pdm_gfal2_ls', self._gfal2)
+        patcher = mock.patch.object(self._ls, 'dump_and_flush')
+        self._dump = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_depth(self):
+        for concurrency in (1, 3):
+            result = self._ls.pdm_gfal_ls('/root', depth=1, concurrency=concurrency)
+            self.assertEqual(result.keys(), ['/root'])
+            self.assertEqual(sorted(entry['name'] for entry in result['/root']),
+                             ['dir1', 'dir2', 'file1'])
+            result = self._ls.pdm_gfal_ls('/root', depth=2, concurrency=concurrency)
+            self.assertEqual(sorted(result), ['/root', '/root/dir1', '/root/dir2'])
+            result = self._ls.pdm_gfal_ls('/root', concurrency=concurrency)
+            self.assertEqual(sorted(result), sorted(TREE))
+        # A file is listed on its own whatever the depth.
+        result = self._ls.pdm_gfal_ls('/root/dir2/file3', concurrency=3)
+        self.assertEqual(result.keys(), ['/root/dir2'])
+        self.assertEqual(result['/root/dir2'][0]['name'], 'file3')
+
+    def test_chunk_size(self):
+        self._ls.CHUNK_SIZE = 3
+        partial = []
+        # The listing sent is cleared once dumped so take a copy of it.
+        self._dump.side_effect = lambda message: partial.append(sorted(message['Listing']))
+        result = self._ls.pdm_gfal_ls('/root')
+        # Partial listings are sent once they reach 3 entries, the remainder is returned.
+        self.assertEqual(partial, [['/root'], ['/root/dir1', '/root/dir1/dir3']])
+        self.assertEqual(result.keys(), ['/root/dir2'])
+        self.assertFalse(any('Code' in call[0][0] for call in self._dump.call_args_list))
+
+    def test_run_compact(self):
+        self._ls.run({'files': [('1.0', '/root/dir2')],
+                      'options': {'compact': True, 'depth': 1}}, ctx=FakeContext())
+        message = self._dump.call_args[0][0]
+        self.assertEqual(message['Code'], 0)
+        self.assertEqual(message['id'], '1.0')
+        self.assertEqual(message['Columns'], ['name', 'st_mode', 'st_size'])
+        self.assertEqual(message['Listing'], {'/root/dir2': [['file3', stat.S_IFREG | 0o644, 10]]})
+
+    def test_stat_error(self):
+        ctx = mock.MagicMock()
+        ctx.stat.side_effect = IOError("No such file")
+        with self.assertRaises(SystemExit) as exit_:
+            self._ls.pdm_gfal_ls('/missing', ctx=ctx)
+        self.assertEqual(exit_.exception.code, 1)
+        self._dump.assert_called_once_with({'Reason': 'No such file', 'Code': 1, 'id': None})
+
+    def test_dir_error(self):
+        self._errors = ('/root/dir1/dir3',)
+        with self.assertRaises(SystemExit):
+            self._ls.pdm_gfal_ls('/root', ctx=FakeContext(self._errors))
+        self._dump.assert_called_once_with({'Reason': 'Permission denied: /root/dir1/dir3',
+                                            'Code': 1, 'id': None})
+
+    def test_thread_error(self):
+        self._errors = ('/root/dir1',)
+        threads = []
+        thread_class = threading.Thread
+
+        def make_thread(*args, **kwargs):
+            threads.append(thread_class(*args, **kwargs))
+            return threads[-1]
+
+        with mock.patch.object(self._ls.threading, 'Thread', side_effect=make_thread):
+            with self.assertRaises(SystemExit) as exit_:
+                self._ls.pdm_gfal_ls('/root', concurrency=3)
+        self.assertEqual(exit_.exception.code, 1)
+        # The error read in a worker thread is reported from the main one...
+        self._dump.assert_called_once_with({'Reason': 'Permission denied: /root/dir1',
+                                            'Code': 1, 'id': None})
+        # ... and the worker threads are all stopped before exiting.
+        self.assertEqual(len(threads), 3)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
@@ -0,0 +1,141 @@
+import sys
+import imp
+import threading
+import unittest
+
+import mock
+
+from pdm.workqueue import scripts
+
+
+class GError(Exception):
+    pass
+
+
+def load_script(name, gfal2):
+    """Load a gfal2 script with the given (stub) gfal2 module."""
+    # Only the gfal2 entry is swapped, patch.dict would also drop the modules imported.
+    sys.modules['gfal2'] = gfal2
+    try:
+        return imp.load_module(name, *imp.find_module(name, scripts.__path__))
+    finally:
+        del sys.modules['gfal2']
+
+
+class FakeContext(object):
+    """Stands in for a gfal2 context, recording the calls made and failing for paths in errors."""
+
+    def __init__(self, calls, errors):
+        self._calls = calls
+        self._errors = errors
+        self._lock = threading.Lock()
+
+    def set_opt_integer(self, *args):
+        pass
+
+    def _call(self, method, path):
+        with self._lock:
+            self._calls.append((method, path))
+        if path in self._errors:
+            raise GError("Permission denied: %s" % path)
+        return 0
+
+    def unlink(self, paths):
+        if isinstance(paths, list):
+            with self._lock:
+                self._calls.append(('bulk_unlink', paths))
+            return [GError("Permission denied: %s" % path) if path in self._errors else None
+                    for path in paths]
+        return self._call('unlink', paths)
+
+    def rmdir(self, path):
+        return self._call('rmdir', path)
+
+
+class TestPdmGfal2Rm(unittest.TestCase):
+    def setUp(self):
+        self._calls = []
+        self._errors = set()
+        gfal2 = mock.MagicMock(GError=GError)
+        gfal2.creat_context.side_effect = lambda: FakeContext(self._calls, self._errors)
+        self._rm = load_script('pdm_gfal2_rm', gfal2)
+        self._reports = {}
+        patcher = mock.patch.object(self._rm, 'dump_and_flush', side_effect=self._report)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _report(self, message, *_):
+        self._reports[message['id']] = message
+
+    def _files(self, count):
+        return [('1.%d' % i, 'gsiftp://host/dir/file%d' % i) for i in range(count)]
+
+    def test_bulk_unlink(self):
+        self._errors.add('gsiftp://host/dir/file1')
+        self._rm.BULK_SIZE = 2
+        self._rm.run({'files': self._files(3)})
+        # Bulk requests of up to BULK_SIZE files, in order, whatever the protocol.
+        self.assertEqual(self._calls, [('bulk_unlink', ['gsiftp://host/dir/file0',
+                                                        'gsiftp://host/dir/file1']),
+                                       ('bulk_unlink', ['gsiftp://host/dir/file2'])])
+        self.assertEqual({jobid: report['Code'] for jobid, report in self._reports.items()},
+                         {'1.0': 0, '1.1': 1, '1.2': 0})
+        self.assertEqual(self._reports['1.1']['Reason'],
+                         'Permission denied: gsiftp://host/dir/file1')
+
+    def test_bulk_unlink_error(self):
+        ctx = mock.MagicMock()
+        ctx.unlink.side_effect = GError("Connection refused")
+        self._rm.pdm_gfal_rm({'files': self._files(2)}, ctx=ctx)
+        self.assertEqual(self._reports, {'1.0': {'Code': 1, 'Reason': 'Connection refused',
+                                                 'id': '1.0'},
+                                         '1.1': {'Code': 1, 'Reason': 'Connection refused',
+                                                 'id': '1.1'}})
+
+    def test_no_bulk_unlink(self):
+        class ArgumentError(TypeError):
+            pass
+
+        # Older bindings only unlink a single url.
+        single_unlink = FakeContext.unlink
+
+        def unlink(ctx, paths):
+            if isinstance(paths, list):
+                raise ArgumentError("Python argument types did not match C++ signature")
+            return single_unlink(ctx, paths)
+
+        self._errors.add('gsiftp://host/dir/file1')
+        with mock.patch.object(FakeContext, 'unlink', unlink):
+            self._rm.run({'files': self._files(3)})
+        self.assertEqual(self._calls, [('unlink', url) for _, url in self._files(3)])
+        self.assertEqual({jobid: report['Code'] for jobid, report in self._reports.items()},
+                         {'1.0': 0, '1.1': 1, '1.2': 0})
+
+    def test_parallel_unlink(self):
+        self._errors.add('gsiftp://host/dir/file3')
+        self._rm.run({'files': self._files(10), 'options': {'parallel': 4}})
+        self.assertEqual(sorted(self._calls), sorted(('unlink', url) for _, url in self._files(10)))
+        self.assertEqual(len(self._reports), 10)
+        self.assertEqual([jobid for jobid, report in self._reports.items() if report['Code']],
+                         ['1.3'])
+        self.assertEqual(self._reports['1.3']['Reason'],
+                         'Permission denied: gsiftp://host/dir/file3')
+
+    def test_dirs(self):
+        dirs = [('2.0', 'gsiftp://host/a/'), ('2.1', 'gsiftp://host/a/b/c/'),
+                ('2.2', 'gsiftp://host/a/b/'), ('2.3', 'gsiftp://host/a/d/'),
+                ('2.4', 'gsiftp://host/a/b/e/')]
+        self._errors.add('gsiftp://host/a/d/')
+        for parallel in (1, 3):
+            del self._calls[:]
+            self._reports.clear()
+            self._rm.run({'files': self._files(1), 'dirs': dirs,
+                          'options': {'parallel': parallel}})
+            self.assertEqual(self._calls[0], ('unlink', 'gsiftp://host/dir/file0'))
+            # Deepest first, any order within a level.
+            removed = [path for _, path in self._calls[1:]]
+            self.assertEqual(sorted(removed[:2]), ['gsiftp://host/a/b/c/', 'gsiftp://host/a/b/e/'])
+            self.assertEqual(sorted(removed[2:4]), ['gsiftp://host/a/b/', 'gsiftp://host/a/d/'])
+            self.assertEqual(removed[4], 'gsiftp://host/a/')
+            self.assertEqual({jobid: report['Code'] for jobid, report in self._reports.items()},
+                             {'1.0': 0, '2.0': 0, '2.1': 0, '2.2': 0, '2.3': 1, '2.4': 0})
@@ -1,6 +1,9 @@
 import sys
+import json
 import unittest
 import logging
+import threading
+from StringIO import StringIO
 
 import mock
 
@@ -26,3 +29,18 @@ class TestGFAL2Helper(unittest.TestCase):
         stdout_dump_helper.dump_and_flush({'Reason': 'Serious problem', 'Code': 1, 'id': 1}, mock_logger,
                                           'Serious problem: type:%d', logging.INFO, *args)
         mock_logger.log.assert_called_with(logging.INFO, 'Serious problem: type:%d', *args)
+
+    def test_threads(self):
+        def dump(thread_id):
+            for i in range(100):
+                stdout_dump_helper.dump_and_flush({'id': '%d.%d' % (thread_id, i), 'Code': 0})
+
+        with mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            threads = [threading.Thread(target=dump, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            lines = mock_stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 400)
+        self.assertEqual(len(set(json.loads(line)['id'] for line in lines)), 400)
@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 """ Test Worker module. """
+import os
+import sys
+import json
+import shutil
+import tempfile
 import logging
 import unittest
+from subprocess import Popen
 import mock
+from flask import request
 
 from pdm.framework.FlaskWrapper import FlaskServer, jsonify
-from pdm.framework.RESTClient import RESTClientTest
+from pdm.framework.RESTClient import RESTClientTest, RESTException
 from pdm.workqueue.WorkqueueService import WorkqueueService
-from pdm.workqueue.Worker import Worker
+from pdm.workqueue.Worker import Worker, StdOutDispatcher, CADirCache
 from pdm.workqueue.WorkqueueDB import JobType, JobStatus, JobProtocol
 
 
@@ -60,9 +67,9 @@ class test_Worker(unittest.TestCase):
         getjobmock = mock.MagicMock()
         outputmock = mock.MagicMock()
         getjobmock.return_value = jsonify(workload)
-        outputmock.return_value = '', 200
+        outputmock.return_value = jsonify([{'job_id': 1, 'element_id': 0, 'code': 200}])
         with mock.patch.dict(self._service.view_functions, {'WorkqueueService.get_next_job': getjobmock,
-                                                            'WorkqueueService.return_output': outputmock}),\
+                                                            'WorkqueueService.return_results': outputmock}),\
              mock.patch.object(self._inst._site_client, 'get_endpoints') as mock_get_endpoints,\
                 mock.patch('pdm.workqueue.Worker.X509Utils.add_ca_to_dir') as mock_ca2dir:
             mock_get_endpoints.return_value = {'endpoints': ['blah1', 'blah2', 'blah3'],
@@ -75,3 +82,451 @@ class test_Worker(unittest.TestCase):
         self.assertTrue(mock_get_endpoints.called)
         self.assertEqual(mock_get_endpoints.call_count, 1)
         self.assertTrue(mock_ca2dir.called)
+
+    def test_run_slots(self):
+        workload = [{'id': job_id,
+                     'user_id': 9,
+                     'type': JobType.LIST,
+                     'status': JobStatus.SUBMITTED,
+                     'priority': 5,
+                     'protocol': JobProtocol.DUMMY,
+                     'src_siteid': 12,
+                     'src_filepath': '/data/somefile',
+                     'src_credentials': 'somesecret',
+                     'dst_credentials': 'someothersecret',
+                     'extra_opts': {},
+                     'token': 'secret_token',
+                     'elements': [{"id": 0,
+                                   "job_id": job_id,
+                                   "type": JobType.LIST,
+                                   "src_filepath": "/some/file"}]} for job_id in (1, 2)]
+        requests = []
+        uploaded = []
+
+        def getjobmock():
+            requests.append(json.loads(request.data))
+            return jsonify(workload)
+
+        def outputmock():
+            results = json.loads(request.data)
+            uploaded.extend((result['job_id'], result['element_id']) for result in results
+                            if not result['monitoring'])
+            return jsonify([{'job_id': result['job_id'], 'element_id': result['element_id'],
+                             'code': 200} for result in results])
+
+        processes = []
+        running_at_start = []
+
+        def popen(*args, **kwargs):
+            running_at_start.append(processes[-1].poll() if processes else None)
+            processes.append(Popen(*args, **kwargs))
+            return processes[-1]
+
+        self._inst._slots = 2
+        with mock.patch.dict(self._service.view_functions, {'WorkqueueService.get_next_job': getjobmock,
+                                                            'WorkqueueService.return_results': outputmock}),\
+             mock.patch.object(self._inst._site_client, 'get_endpoints') as mock_get_endpoints,\
+                mock.patch('pdm.workqueue.Worker.X509Utils.add_ca_to_dir') as mock_ca2dir,\
+                mock.patch('pdm.workqueue.Worker.subprocess.Popen', side_effect=popen):
+            mock_get_endpoints.return_value = {'endpoints': ['blah1', 'blah2', 'blah3']}
+            mock_ca2dir.return_value = '/tmp/somecadir'
+            self._inst.run()
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0]['max_jobs'], 2)
+        self.assertEqual(len(processes), 2)
+        self.assertIsNone(running_at_start[1], "Jobs were not run concurrently.")
+        # The dummy script always reports back for element 1.0, element 2.0 which it never
+        # returned is failed once it exits.
+        self.assertEqual(uploaded, [(1, 0), (2, 0)])
+        self.assertFalse(self._inst._processes)
+
+    def _run_persistent(self, fake_executor):
+        """Run two LIST jobs in persistent executors started from the fake_executor code."""
+        workloads = [[{'id': job_id,
+                       'user_id': 9,
+                       'type': JobType.LIST,
+                       'status': JobStatus.SUBMITTED,
+                       'priority': 5,
+                       'protocol': JobProtocol.GRIDFTP,
+                       'src_siteid': 12,
+                       'src_filepath': '/data/somefile',
+                       'src_credentials': 'somesecret',
+                       'dst_credentials': 'someothersecret',
+                       'extra_opts': {},
+                       'elements': [{"id": 0,
+                                     "job_id": job_id,
+                                     "type": JobType.LIST,
+                                     "src_filepath": "/some/file",
+                                     "token": 'secret_token'}]}] for job_id in (1, 2)]
+        uploaded = []
+
+        def outputmock():
+            results = json.loads(request.data)
+            uploaded.extend((result['job_id'], result['element_id'],
+                             result['payload']['returncode']) for result in results)
+            return jsonify([{'job_id': result['job_id'], 'element_id': result['element_id'],
+                             'code': 200} for result in results])
+
+        executors = []
+
+        def popen(args, **kwargs):
+            self.assertEqual(os.path.basename(args[0]), 'pdm_gfal2_executor.py')
+            executors.append(Popen([sys.executable, '-c', fake_executor], **kwargs))
+            return executors[-1]
+
+        self._inst._n_shot = 2
+        self._inst._persistent_executors = True
+        getjobmock = mock.MagicMock(side_effect=[jsonify(workload) for workload in workloads])
+        with mock.patch.dict(self._service.view_functions, {'WorkqueueService.get_next_job': getjobmock,
+                                                            'WorkqueueService.return_results': outputmock}),\
+             mock.patch.object(self._inst._site_client, 'get_endpoints') as mock_get_endpoints,\
+                mock.patch('pdm.workqueue.Worker.X509Utils.add_ca_to_dir') as mock_ca2dir,\
+                mock.patch('pdm.workqueue.Worker.subprocess.Popen', side_effect=popen):
+            mock_get_endpoints.return_value = {'endpoints': ['blah1', 'blah2', 'blah3']}
+            mock_ca2dir.return_value = '/tmp/somecadir'
+            self._inst.run()
+        return executors, uploaded
+
+    def test_run_persistent_executor(self):
+        # Stands in for pdm_gfal2_executor.py, answering every request it reads.
+        fake_executor = ("import sys, json\n"
+                         "for line in iter(sys.stdin.readline, ''):\n"
+                         "    request = json.loads(line)\n"
+                         "    for element_id, _ in request['data']['files']:\n"
+                         "        print(json.dumps({'Code': 0, 'id': element_id,"
+                         " 'Listing': {'root': []}}))\n"
+                         "    print(json.dumps({'Done': 0}))\n"
+                         "    sys.stdout.flush()\n")
+        executors, uploaded = self._run_persistent(fake_executor)
+        self.assertEqual(len(executors), 1)
+        self.assertEqual(uploaded, [(1, 0, 0), (2, 0, 0)])
+        # Idle executors are shut down when the worker stops.
+        self.assertEqual(executors[0].returncode, 0)
+        self.assertFalse(self._inst._executors)
+        self.assertFalse(self._inst._processes)
+
+    def test_run_persistent_executor_timeout(self):
+        # As above but the first job takes longer than the timeout.
+        fake_executor = ("import sys, json, time\n"
+                         "for line in iter(sys.stdin.readline, ''):\n"
+                         "    request = json.loads(line)\n"
+                         "    for element_id, _ in request['data']['files']:\n"
+                         "        if element_id == '1.0':\n"
+                         "            time.sleep(1.5)\n"
+                         "        print(json.dumps({'Code': 0, 'id': element_id,"
+                         " 'Listing': {'root': []}}))\n"
+                         "    print(json.dumps({'Done': 0}))\n"
+                         "    sys.stdout.flush()\n")
+        self._inst._timeouts[JobType.LIST] = 0.5
+        executors, uploaded = self._run_persistent(fake_executor)
+        # The timed out job's element failed but the executor was reused for the next job.
+        self.assertEqual(len(executors), 1)
+        self.assertEqual(uploaded, [(1, 0, -9), (2, 0, 0)])
+        self.assertEqual(executors[0].returncode, 0)
+
+    def test_run_persistent_executor_stopped(self):
+        # As above but the executor stops part way through the first job, either closing its
+        # output (while carrying on running) or exiting cleanly, without reporting Done.
+        for stop, returncode in (("os.close(1)", -9), ("sys.exit(0)", 0)):
+            fake_executor = ("import os, sys, json\n"
+                             "for line in iter(sys.stdin.readline, ''):\n"
+                             "    request = json.loads(line)\n"
+                             "    for element_id, _ in request['data']['files']:\n"
+                             "        if element_id == '1.0':\n"
+                             "            %s\n"
+                             "            break\n"
+                             "        print(json.dumps({'Code': 0, 'id': element_id,"
+                             " 'Listing': {'root': []}}))\n"
+                             "    else:\n"
+                             "        print(json.dumps({'Done': 0}))\n"
+                             "        sys.stdout.flush()\n" % stop)
+            executors, uploaded = self._run_persistent(fake_executor)
+            # The job's element is failed and the executor is not reused for the next job.
+            self.assertEqual(uploaded, [(1, 0, 1), (2, 0, 0)])
+            self.assertEqual(len(executors), 2)
+            self.assertEqual(executors[0].returncode, returncode)
+            self.assertFalse(self._inst._executors)
+            self.assertFalse(self._inst._processes)
+
+    def test_executor_timeout(self):
+        job = {'id': 1}
+        executor = mock.MagicMock()
+        executor.poll.return_value = None
+        dispatcher = mock.MagicMock()
+        self.assertFalse(self._inst._executor_timeout(job, executor, dispatcher, 5, 10, False))
+        self.assertFalse(dispatcher.force_complete.called)
+        # Only the job's elements are timed out, the executor carries on with the job.
+        self.assertTrue(self._inst._executor_timeout(job, executor, dispatcher, 11, 10, False))
+        dispatcher.force_complete.assert_called_once_with(returncode=-9,
+                                                          extra_log='Operation timed out!')
+        self.assertTrue(self._inst._executor_timeout(job, executor, dispatcher, 15, 10, True))
+        self.assertEqual(dispatcher.force_complete.call_count, 1)
+        self.assertFalse(executor.kill.called)
+        # Unless it never finishes with the job.
+        self.assertTrue(self._inst._executor_timeout(job, executor, dispatcher, 21, 10, True))
+        executor.kill.assert_called_once_with()
+
+    @mock.patch('pdm.workqueue.Worker.time.sleep')
+    def test_run_long_poll(self, mock_sleep):
+        self._inst._interpoll_sleep_time = 2
+        self._inst._long_poll_time = 0
+        with mock.patch.object(self._inst, 'post', side_effect=RESTException(404)) as mock_post:
+            self._inst.run()
+        self.assertNotIn('wait', mock_post.call_args[1]['data'])
+        self.assertAlmostEqual(mock_sleep.call_args[0][0], 2, places=1)
+
+        self._inst._n_shot = 1
+        self._inst._long_poll_time = 30
+        with mock.patch.object(self._inst, 'post', side_effect=RESTException(404)) as mock_post,\
+                mock.patch('pdm.workqueue.Worker.time.time', side_effect=[100, 130]):
+            self._inst.run()
+        self.assertEqual(mock_post.call_args[1]['data']['wait'], 30)
+        self.assertEqual(mock_sleep.call_args[0][0], 0)
+
+    def test_upload(self):
+        self._inst._upload_flush_time = 0
+        with mock.patch.object(self._inst, 'put') as mock_put:
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}', '1', '2',
+                               token='token', data={'returncode': 0})
+        mock_put.assert_called_once_with('worker/jobs/1/elements/2', data={'returncode': 0})
+
+        self._inst._upload_flush_time = 10
+        self._inst._upload_batch_size = 3
+        with mock.patch.object(self._inst, 'put') as mock_put:
+            mock_put.return_value = [{'job_id': 1, 'element_id': 2, 'code': 200},
+                                     {'job_id': 1, 'element_id': 2, 'code': 403}]
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}/monitoring', '1', '2',
+                               token='token', data={'transferred': 10})
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}', '1', '2',
+                               token='token', data={'returncode': 0})
+            self._inst._flush_uploads()
+            self.assertFalse(mock_put.called, "Results uploaded before the flush window.")
+            self._inst._flush_uploads(force=True)
+            mock_put.assert_called_once_with('worker/jobs/elements',
+                                             data=[{'job_id': 1, 'element_id': 2, 'token': 'token',
+                                                    'monitoring': True,
+                                                    'payload': {'transferred': 10}},
+                                                   {'job_id': 1, 'element_id': 2, 'token': 'token',
+                                                    'monitoring': False,
+                                                    'payload': {'returncode': 0}}])
+            mock_put.reset_mock()
+            for element_id in xrange(3):
+                self._inst._upload('worker/jobs/{job_id}/elements/{element_id}', '1', element_id,
+                                   token='token', data={'returncode': 0})
+            self.assertEqual(mock_put.call_count, 1, "Full batch not uploaded immediately.")
+            self.assertEqual(len(mock_put.call_args[1]['data']), 3)
+            self.assertEqual(self._inst._upload_queue, [])
+            mock_put.reset_mock()
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}/listing', '1', '0',
+                               token='token', data={'listing': {}})
+            mock_put.assert_called_once_with('worker/jobs/1/elements/0/listing',
+                                             data={'listing': {}})
+
+    def test_upload_retry(self):
+        self._inst._upload_flush_time = 10
+        self._inst._upload_batch_size = 10
+        self._inst._upload_retries = 1
+        ok = [{'job_id': 1, 'element_id': 2, 'code': 200}]
+        with mock.patch.object(self._inst, 'put') as mock_put:
+            # A failed batch is kept for the next flush...
+            mock_put.side_effect = [RESTException(500), ok]
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}', '1', '2',
+                               token='token', data={'returncode': 0})
+            self._inst._flush_uploads(force=True)
+            self.assertEqual(len(self._inst._upload_queue), 1)
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}/monitoring', '1', '3',
+                               token='token', data={'transferred': 10})
+            self._inst._flush_uploads(force=True)
+            self.assertEqual(self._inst._upload_queue, [])
+            self.assertEqual([result['element_id'] for result in mock_put.call_args[1]['data']],
+                             [2, 3])
+            # ... up to upload_retries times, then its results are uploaded one at a time.
+            mock_put.reset_mock()
+            mock_put.side_effect = [RESTException(500), RESTException(None), None, None]
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}', '1', '2',
+                               token='token', data={'returncode': 0})
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}/monitoring', '1', '3',
+                               token='token', data={'transferred': 10})
+            self._inst._flush_uploads(force=True)
+            self._inst._flush_uploads(force=True)
+            self.assertEqual(self._inst._upload_queue, [])
+            self.assertEqual(mock_put.call_args_list[2:],
+                             [mock.call('worker/jobs/1/elements/2', data={'returncode': 0}),
+                              mock.call('worker/jobs/1/elements/3/monitoring',
+                                        data={'transferred': 10})])
+            # Without the batch endpoint results are uploaded one at a time from then on.
+            mock_put.reset_mock()
+            mock_put.side_effect = [RESTException(404), None, None]
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}', '1', '2',
+                               token='token', data={'returncode': 0})
+            self._inst._flush_uploads(force=True)
+            self._inst._upload('worker/jobs/{job_id}/elements/{element_id}', '1', '4',
+                               token='token', data={'returncode': 1})
+            self.assertEqual(self._inst._upload_queue, [])
+            self.assertEqual(mock_put.call_args_list[1:],
+                             [mock.call('worker/jobs/1/elements/2', data={'returncode': 0}),
+                              mock.call('worker/jobs/1/elements/4', data={'returncode': 1})])
+
+
+class test_StdOutDispatcher(unittest.TestCase):
+
+    def test_partial_listing(self):
+        read_fd, write_fd = os.pipe()
+        callback = mock.MagicMock()
+        dispatcher = StdOutDispatcher(read_fd, {'1.0': 'token'}, mock.MagicMock(), callback)
+        try:
+            entry = {'name': 'file', 'st_size': 1, 'st_mode': 0o0100644}
+            os.write(write_fd, json.dumps({'id': '1.0',
+                                           'Listing': {'gsiftp://host/~/dir': [entry]}}) + '\n')
+            dispatcher.handle_read()
+        finally:
+            dispatcher.close()
+            os.close(write_fd)
+        callback.assert_called_once_with('worker/jobs/{job_id}/elements/{element_id}/listing',
+                                         '1', '0', token='token',
+                                         data={'listing': {'~/dir': [entry]}})
+
+    def test_compact_listing(self):
+        read_fd, write_fd = os.pipe()
+        callback = mock.MagicMock()
+        dispatcher = StdOutDispatcher(read_fd, {'1.0': 'token'}, mock.MagicMock(buffer=''),
+                                      callback)
+        try:
+            os.write(write_fd, json.dumps({'id': '1.0', 'Code': 0,
+                                           'Columns': ['name', 'st_size'],
+                                           'Listing': {'gsiftp://host/dir': [['file', 1]]}})
+                     + '\n')
+            dispatcher.handle_read()
+        finally:
+            dispatcher.close()
+            os.close(write_fd)
+        data = callback.call_args[1]['data']
+        self.assertEqual(data['listing'], {'/dir': [['file', 1]]})
+        self.assertEqual(data['columns'], ['name', 'st_size'])
+
+    def test_persistent_done(self):
+        read_fd, write_fd = os.pipe()
+        callback = mock.MagicMock()
+        stderr_dispatcher = mock.MagicMock(buffer='')
+        dispatcher = StdOutDispatcher(read_fd, {'1.0': 'token0', '1.1': 'token1'},
+                                      stderr_dispatcher, callback, persistent=True)
+        try:
+            os.write(write_fd, json.dumps({'id': '1.0', 'Code': 0}) + '\n')
+            dispatcher.handle_read()
+            # Returning all the elements doesn't end the job, the executor says when it's done.
+            os.write(write_fd, json.dumps({'id': '1.1', 'Code': 0}) + '\n')
+            dispatcher.handle_read()
+            self.assertTrue(dispatcher.readable())
+            self.assertTrue(dispatcher.connected)
+            os.write(write_fd, json.dumps({'Done': 0}) + '\n')
+            dispatcher.handle_read()
+            self.assertFalse(dispatcher.connected)
+        finally:
+            dispatcher.close()
+            os.close(write_fd)
+        self.assertEqual(callback.call_count, 2)
+
+    def test_persistent_done_failed(self):
+        read_fd, write_fd = os.pipe()
+        callback = mock.MagicMock()
+        stderr_dispatcher = mock.MagicMock(buffer='Traceback')
+        dispatcher = StdOutDispatcher(read_fd, {'1.0': 'token0', '1.1': 'token1'},
+                                      stderr_dispatcher, callback, persistent=True)
+        try:
+            os.write(write_fd, json.dumps({'id': '1.0', 'Code': 0}) + '\n' +
+                     json.dumps({'Done': 1}) + '\n')
+            dispatcher.handle_read()
+            self.assertFalse(dispatcher.connected)
+        finally:
+            dispatcher.close()
+            os.close(write_fd)
+        self.assertEqual(callback.call_count, 2)
+        self.assertEqual(callback.call_args[0][1:], ('1', '1'))
+        self.assertEqual(callback.call_args[1]['token'], 'token1')
+        self.assertEqual(callback.call_args[1]['data']['returncode'], 1)
+
+    def test_persistent_done_missing(self):
+        read_fd, write_fd = os.pipe()
+        callback = mock.MagicMock()
+        dispatcher = StdOutDispatcher(read_fd, {'1.0': 'token0', '1.1': 'token1'},
+                                      mock.MagicMock(buffer=''), callback, persistent=True)
+        try:
+            os.write(write_fd, json.dumps({'id': '1.0', 'Code': 0}) + '\n' +
+                     json.dumps({'Done': 0}) + '\n')
+            dispatcher.handle_read()
+            self.assertFalse(dispatcher.connected)
+        finally:
+            dispatcher.close()
+            os.close(write_fd)
+        self.assertEqual(callback.call_count, 2)
+        self.assertEqual(callback.call_args[0][1:], ('1', '1'))
+        self.assertEqual(callback.call_args[1]['data']['returncode'], 1)
+
+    def test_persistent_force_complete(self):
+        read_fd, write_fd = os.pipe()
+        callback = mock.MagicMock()
+        dispatcher = StdOutDispatcher(read_fd, {'1.0': 'token0', '1.1': 'token1'},
+                                      mock.MagicMock(buffer=''), callback, persistent=True)
+        try:
+            dispatcher.force_complete(returncode=-9, extra_log='Operation timed out!')
+            self.assertEqual(callback.call_count, 2)
+            self.assertIn('Operation timed out!', callback.call_args[1]['data']['log'])
+            # The rest of the executor output for the job is still read up to its Done.
+            self.assertTrue(dispatcher.connected)
+            os.write(write_fd, json.dumps({'id': '1.0', 'Code': 0}) + '\n')
+            dispatcher.handle_read()
+            self.assertTrue(dispatcher.connected)
+            os.write(write_fd, json.dumps({'Done': 0}) + '\n')
+            dispatcher.handle_read()
+            self.assertFalse(dispatcher.connected)
+        finally:
+            dispatcher.close()
+            os.close(write_fd)
+        self.assertEqual(callback.call_count, 2)
+
+
+class test_CADirCache(unittest.TestCase):
+
+    def setUp(self):
+        self._template_dir = tempfile.mkdtemp()
+        patcher = mock.patch('pdm.workqueue.Worker.X509Utils.add_ca_to_dir',
+                             side_effect=lambda cas, template_dir: tempfile.mkdtemp())
+        self._mock_ca2dir = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self._template_dir)
+
+    def test_reuse(self):
+        cache = CADirCache(max_size=1)
+        with cache.ca_dir(['ca1'], template_dir=self._template_dir) as ca_dir:
+            pass
+        with cache.ca_dir(['ca1'], template_dir=self._template_dir) as ca_dir2:
+            self.assertEqual(ca_dir2, ca_dir)
+        self.assertEqual(self._mock_ca2dir.call_count, 1)
+        # Different CAs or template dir get their own dir
+        with cache.ca_dir(['ca1', 'ca2'], template_dir=self._template_dir) as ca_dir3:
+            self.assertNotEqual(ca_dir3, ca_dir)
+        self.assertFalse(os.path.exists(ca_dir), "LRU dir should have been removed.")
+        with cache.ca_dir(['ca1', 'ca2']) as ca_dir4:
+            self.assertNotEqual(ca_dir4, ca_dir3)
+        self.assertEqual(self._mock_ca2dir.call_count, 3)
+        # Changes to the template dir invalidate the dirs made from it.
+        with cache.ca_dir(['ca1'], template_dir=self._template_dir) as ca_dir:
+            pass
+        os.utime(self._template_dir, (0, 0))
+        with cache.ca_dir(['ca1'], template_dir=self._template_dir) as ca_dir2:
+            self.assertNotEqual(ca_dir2, ca_dir)
+        cache.clear()
+        self.assertFalse(os.path.exists(ca_dir2))
+
+    def test_in_use(self):
+        cache = CADirCache(max_size=0)
+        with cache.ca_dir(['ca1']) as ca_dir:
+            with cache.ca_dir(['ca1']) as ca_dir2:
+                self.assertEqual(ca_dir2, ca_dir)
+            with cache.ca_dir(['ca2']):
+                pass
+            self.assertTrue(os.path.isdir(ca_dir), "In use dir should not be removed.")
+        self.assertFalse(os.path.exists(ca_dir))
+        self.assertEqual(self._mock_ca2dir.call_count, 2)
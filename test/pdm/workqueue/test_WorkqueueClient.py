@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 """ Test WorkqueueClient module. """
 import unittest
+from datetime import datetime
 import mock
+from flask import request
 
 from pdm.framework.FlaskWrapper import FlaskServer, jsonify
 from pdm.framework.RESTClient import RESTClientTest
@@ -99,3 +101,30 @@ class test_WorkqueueClient(unittest.TestCase):
             response = self._inst.output(1)
         self.assertTrue(methodmock.called)
         self.assertEqual(response, {})
+
+    def test_output_listing_page(self):
+        args = []
+
+        def methodmock(*_, **__):
+            args.append(request.args.to_dict())
+            return jsonify({})
+        with mock.patch.dict(self._service.view_functions,
+                             {'WorkqueueService.get_element_output': methodmock}):
+            self._inst.output(1, 0, listing_limit=10, listing_offset=20)
+            self._inst.output(1, 0)
+        self.assertEqual(args, [{'listing_limit': '10', 'listing_offset': '20'}, {}])
+
+    def test_jobs_page(self):
+        args = []
+
+        def methodmock(*_, **__):
+            args.append(request.args.to_dict())
+            return jsonify([])
+        with mock.patch.dict(self._service.view_functions,
+                             {'WorkqueueService.get_jobs': methodmock}):
+            self._inst.jobs(limit=10, offset=20, since=datetime(2018, 1, 2, 3, 4, 5))
+            self._inst.jobs(since='2018-01-02T03:04:05')
+            self._inst.jobs()
+        self.assertEqual(args, [{'limit': '10', 'offset': '20', 'since': '2018-01-02T03:04:05'},
+                                {'since': '2018-01-02T03:04:05'},
+                                {}])
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+""" Test WorkqueueDB module. """
+import pickle
+import logging
+import unittest
+
+from sqlalchemy import inspect
+
+from pdm.framework.FlaskWrapper import FlaskServer
+from pdm.workqueue.WorkqueueDB import (JSONType, JobStatus, JobType, shellpaths_sanitise,
+                                       upgrade_schema)
+from pdm.workqueue.WorkqueueService import WorkqueueService
+
+
+class TestJSONType(unittest.TestCase):
+
+    def test_json(self):
+        json_type = JSONType()
+        self.assertIsNone(json_type.process_bind_param(None, None))
+        self.assertIsNone(json_type.process_result_value(None, None))
+        value = {'transferred': 12, 'elapsed': 1.5}
+        encoded = json_type.process_bind_param(value, None)
+        self.assertNotIn(' ', encoded, "Expected compact JSON.")
+        self.assertEqual(json_type.process_result_value(encoded, None), value)
+
+    def test_legacy_pickle(self):
+        json_type = JSONType()
+        value = {'transferred': 12, 'elapsed': 1.5}
+        self.assertEqual(json_type.process_result_value(pickle.dumps(value), None), value)
+
+
+class TestShellpathsSanitise(unittest.TestCase):
+
+    def test_sanitise(self):
+        paths = ['/a/b', '~/c.txt', '/d/*']
+        self.assertEqual(shellpaths_sanitise(paths), paths)
+        self.assertEqual(shellpaths_sanitise([]), [])
+        for bad_paths in (['/a', 'b'], ['/a', '/b;rm'], ['/a\n;rm', '/b'], ['/a\n/b']):
+            self.assertRaises(ValueError, shellpaths_sanitise, bad_paths)
+
+
+class TestAddElements(unittest.TestCase):
+
+    def setUp(self):
+        self._service = FlaskServer("pdm.workqueue.WorkqueueService")
+        self._service.test_mode(WorkqueueService, None)  # to skip DB auto build
+        self._service.build_db()
+        self._db = self._service.test_db()
+        job = self._db.tables.Job(user_id=1, src_siteid=1, dst_siteid=2, src_filepath='/a',
+                                  dst_filepath='/b', type=JobType.COPY)
+        self._db.session.add(job)
+        self._db.session.commit()
+
+    def test_add_elements(self):
+        JobElement = self._db.tables.JobElement
+        files = (('/a/file%d' % i, '/b/file%d' % i, i) for i in xrange(5))
+        self.assertEqual(JobElement.add_elements(self._db.session, 1, JobType.COPY, files,
+                                                 first_id=1, max_tries=3, chunk_size=2), 5)
+        self._db.session.commit()
+        elements = JobElement.query.filter_by(job_id=1).order_by(JobElement.id).all()
+        self.assertEqual([(element.id, element.src_filepath, element.dst_filepath,
+                           element.size) for element in elements[1:]],
+                         [(i + 1, '/a/file%d' % i, '/b/file%d' % i, i) for i in xrange(5)])
+        for element in elements[1:]:
+            self.assertEqual((element.type, element.status, element.attempts,
+                              element.max_tries), (JobType.COPY, JobStatus.NEW, 0, 3))
+            self.assertIsNotNone(element.timestamp)
+
+    def test_add_elements_invalid(self):
+        JobElement = self._db.tables.JobElement
+        self.assertRaises(ValueError, JobElement.add_elements, self._db.session, 1,
+                          JobType.COPY, [('/a/file', None, 0)])
+        self.assertRaises(ValueError, JobElement.add_elements, self._db.session, 1,
+                          JobType.REMOVE, [('/a/file', None, 0), ('/a/$(rm)', None, 0)])
+        self.assertEqual(JobElement.add_elements(self._db.session, 1, JobType.REMOVE,
+                                                 [('/a/file', None, 0)]), 1)
+
+
+class TestListingEntry(unittest.TestCase):
+
+    def setUp(self):
+        self._service = FlaskServer("pdm.workqueue.WorkqueueService")
+        self._service.test_mode(WorkqueueService, None)  # to skip DB auto build
+        self._service.build_db()
+        self._db = self._service.test_db()
+
+    def test_removed_with_job(self):
+        Job = self._db.tables.Job
+        ListingEntry = self._db.tables.ListingEntry
+        for user_id in (1, 2):
+            self._db.session.add(Job(user_id=user_id, src_siteid=1, src_filepath='/a',
+                                     type=JobType.LIST))
+        self._db.session.commit()
+        for job_id in (1, 2):
+            ListingEntry.add_listing(self._db.session, job_id, 0,
+                                     {'/a': [{'name': 'b', 'st_mode': 0o100644, 'st_size': 1}]})
+        self._db.session.commit()
+        with self._service.test_request_context():
+            Job.query.get(1).remove()
+        self.assertEqual(ListingEntry.query.filter_by(job_id=1).count(), 0)
+        self.assertEqual(ListingEntry.query.filter_by(job_id=2).count(), 2)
+        # Updating an element leaves its listing alone
+        with self._service.test_request_context():
+            element = self._db.tables.JobElement.query.get((0, 2))
+            element.attempts = 1
+            element.update()
+        self.assertEqual(ListingEntry.query.filter_by(job_id=2).count(), 2)
+
+
+class TestUpgradeSchema(unittest.TestCase):
+
+    LEGACY_SCHEMA = (
+        "CREATE TABLE jobs (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+        "log_uid VARCHAR(36) NOT NULL, src_siteid INTEGER NOT NULL, dst_siteid INTEGER, "
+        "src_filepath TEXT NOT NULL, dst_filepath TEXT, extra_opts BLOB, "
+        "src_credentials TEXT, dst_credentials TEXT, timestamp TIMESTAMP NOT NULL, "
+        "priority SMALLINT NOT NULL, type SMALLINT NOT NULL, protocol SMALLINT NOT NULL, "
+        "status SMALLINT NOT NULL)",
+        "CREATE TABLE jobelements (id INTEGER NOT NULL, job_id INTEGER NOT NULL, "
+        "src_filepath TEXT NOT NULL, dst_filepath TEXT, listing BLOB, monitoring_info BLOB, "
+        "size INTEGER NOT NULL, max_tries SMALLINT NOT NULL, attempts SMALLINT NOT NULL, "
+        "timestamp TIMESTAMP NOT NULL, type SMALLINT NOT NULL, status SMALLINT NOT NULL, "
+        "PRIMARY KEY (id, job_id), FOREIGN KEY(job_id) REFERENCES jobs (id))",
+    )
+
+    def setUp(self):
+        self._service = FlaskServer("pdm.workqueue.WorkqueueService")
+        self._service.test_mode(WorkqueueService, None)  # to skip DB auto build
+        self._db = self._service.test_db()
+        for statement in self.LEGACY_SCHEMA:
+            self._db.engine.execute(statement)
+        self._db.engine.execute("INSERT INTO jobs VALUES (1, 1, 'uid', 1, NULL, '/a', NULL, "
+                                "NULL, NULL, NULL, '2018-01-01 00:00:00', 5, 2, 0, 3)")
+        listing = pickle.dumps({'/a': [{'name': 'b', 'st_mode': 0o100644, 'st_size': 1}]})
+        for element_id, status in ((0, JobStatus.DONE), (1, JobStatus.SUBMITTED),
+                                   (2, JobStatus.NEW), (3, JobStatus.NEW)):
+            self._db.engine.execute("INSERT INTO jobelements VALUES (?, 1, '/a', NULL, ?, "
+                                    "NULL, 0, 2, 0, '2018-01-01 00:00:00', 2, ?)",
+                                    element_id, listing if element_id == 0 else None, status)
+        self._service.build_db()  # only creates the new listingentries table
+
+    def test_upgrade_schema(self):
+        upgrade_schema(self._db, logging.getLogger("test"))
+        inspector = inspect(self._db.engine)
+        self.assertTrue({'num_new', 'num_done', 'num_failed', 'num_submitted', 'num_running'}
+                        .issubset(column['name'] for column in inspector.get_columns('jobs')))
+        self.assertEqual({index['name'] for index in inspector.get_indexes('jobs')},
+                         {'ix_jobs_type_priority', 'ix_jobs_user_id'})
+        self.assertEqual({index['name'] for index in inspector.get_indexes('jobelements')},
+                         {'ix_jobelements_job_status', 'ix_jobelements_claimable'})
+
+        Job = self._db.tables.Job
+        JobElement = self._db.tables.JobElement
+        job = Job.query.get(1)
+        self.assertEqual((job.num_new, job.num_done, job.num_failed, job.num_submitted,
+                          job.num_running), (2, 1, 0, 1, 0))
+        self.assertEqual(JobElement.query.get((0, 1)).get_listing(),
+                         {'/a': [{'name': 'b', 'st_mode': 0o100644, 'st_size': 1}]})
+        self.assertIsNone(self._db.engine.execute("SELECT listing FROM jobelements "
+                                                  "WHERE id = 0").scalar())
+
+        # Running again on an up to date database does nothing.
+        job.num_new = 5
+        self._db.session.commit()
+        upgrade_schema(self._db, logging.getLogger("test"))
+        self.assertEqual(Job.query.get(1).num_new, 5)
+        self.assertEqual(len(JobElement.query.get((0, 1)).get_listing()['/a']), 1)
@@ -1,13 +1,16 @@
 """ Test WorkqueueService module. """
 import os
 import json
+import time
 import unittest
+import threading
 from textwrap import dedent
 import mock
 
 from pdm.framework.FlaskWrapper import FlaskServer
 from pdm.workqueue.WorkqueueDB import JobType, JobStatus, JobProtocol
-from pdm.workqueue.WorkqueueService import WorkqueueService, Algorithm
+from pdm.workqueue.WorkqueueService import (WorkqueueService, Algorithm, WorkNotifier,
+                                             window_functions_supported)
 
 
 class TestAlgorithms(unittest.TestCase):
@@ -63,10 +66,11 @@ class TestAlgorithms(unittest.TestCase):
         self.assertEqual(len(Algorithm["BY_NUMBER"](5)), 5)
         self.assertEqual(len(Algorithm["BY_NUMBER"](8)), 8)
 
-    @mock.patch('pdm.workqueue.WorkqueueService.request')
-    def test_by_size(self, mock_request):
-        mock_request.db.tables.Job = self.__service.test_db().tables.Job
-        mock_request.db.tables.JobElement = self.__service.test_db().tables.JobElement
+    def _check_by_size(self, mock_request):
+        db = self.__service.test_db()
+        mock_request.db.tables.Job = db.tables.Job
+        mock_request.db.tables.JobElement = db.tables.JobElement
+        mock_request.db.engine = db.engine
         mock_request.data = {"types": (JobType.RENAME, JobType.MKDIR)}
         self.assertEqual(len(Algorithm["BY_SIZE"]()), 0)
 
@@ -80,6 +84,70 @@ class TestAlgorithms(unittest.TestCase):
         self.assertEqual(len(Algorithm["BY_SIZE"]()), 13)
         self.assertEqual(len(Algorithm["BY_SIZE"](100)), 3)
         self.assertEqual(len(Algorithm["BY_SIZE"](111)), 4)
+        self.assertEqual([(element.job_id, element.id) for element in Algorithm["BY_SIZE"](111)],
+                         [(1, 0), (2, 0), (2, 1), (2, 2)])
+
+        # Elements that are no longer claimable don't count towards the running total.
+        db.tables.JobElement.query.filter_by(job_id=2, id=2)\
+                                  .update({'status': JobStatus.DONE})
+        db.session.commit()
+        self.assertEqual([(element.job_id, element.id) for element in Algorithm["BY_SIZE"](1111)],
+                         [(1, 0), (2, 0), (2, 1), (2, 3)])
+
+    @mock.patch('pdm.workqueue.WorkqueueService.request')
+    def test_by_size(self, mock_request):
+        self.assertTrue(window_functions_supported(self.__service.test_db().engine.dialect))
+        with mock.patch('pdm.workqueue.WorkqueueService.by_size_self_join') as mock_self_join:
+            self._check_by_size(mock_request)
+        self.assertFalse(mock_self_join.called)
+
+    @mock.patch('pdm.workqueue.WorkqueueService.window_functions_supported')
+    @mock.patch('pdm.workqueue.WorkqueueService.request')
+    def test_by_size_self_join(self, mock_request, mock_window_functions_supported):
+        mock_window_functions_supported.return_value = False
+        with mock.patch('pdm.workqueue.WorkqueueService.by_size_windowed') as mock_windowed:
+            self._check_by_size(mock_request)
+        self.assertFalse(mock_windowed.called)
+
+    def test_window_functions_supported(self):
+        dialect = mock.MagicMock()
+        dialect.name = 'sqlite'
+        dialect.dbapi.sqlite_version_info = (3, 24, 0)
+        self.assertFalse(window_functions_supported(dialect))
+        dialect.dbapi.sqlite_version_info = (3, 25, 0)
+        self.assertTrue(window_functions_supported(dialect))
+        dialect.name = 'postgresql'
+        self.assertTrue(window_functions_supported(dialect))
+        dialect.name = 'mysql'
+        dialect.server_version_info = (5, 7, 21)
+        self.assertFalse(window_functions_supported(dialect))
+        dialect.server_version_info = (8, 0, 11)
+        self.assertTrue(window_functions_supported(dialect))
+        dialect.server_version_info = (10, 3, 7, 'MariaDB')
+        self.assertFalse(window_functions_supported(dialect))
+        dialect.name = 'oracle'
+        self.assertFalse(window_functions_supported(dialect))
+
+
+class TestWorkNotifier(unittest.TestCase):
+    def test_wait(self):
+        notifier = WorkNotifier()
+        generation = notifier.generation
+        start = time.time()
+        self.assertFalse(notifier.wait(generation, 0.1))
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+        threading.Timer(0.1, notifier.notify).start()
+        self.assertTrue(notifier.wait(generation, 5))
+        self.assertEqual(notifier.generation, generation + 1)
+        # Notification between capturing the generation and waiting is not lost.
+        self.assertTrue(notifier.wait(generation, 5))
+
+    def test_max_waiters(self):
+        notifier = WorkNotifier(max_waiters=0)
+        start = time.time()
+        self.assertFalse(notifier.wait(notifier.generation, 5))
+        self.assertLess(time.time() - start, 1)
 
 
 class TestWorkqueueService(unittest.TestCase):
@@ -101,6 +169,7 @@ class TestWorkqueueService(unittest.TestCase):
             job.elements.append(JobElement(id=i, job_id=2, src_siteid=12,
                                            src_filepath='/data/somefile2.%d' % i,
                                            type=JobType.REMOVE, size=10**i))
+        job.num_new = len(job.elements)
         db.session.add(job)
         j = Job(user_id=3, type=JobType.COPY,
                 src_siteid=15, src_filepath='/data/somefile3',
@@ -111,6 +180,7 @@ class TestWorkqueueService(unittest.TestCase):
                                          src_filepath='/data/somefile3.%d' % i,
                                          dst_filepath='/data/newfile.%d' % i,
                                          type=JobType.COPY, size=10**i))
+        j.num_new = len(j.elements)
         db.session.add(j)
         db.session.commit()
         with mock.patch('pdm.workqueue.WorkqueueService.SiteClient'):
@@ -141,13 +211,14 @@ class TestWorkqueueService(unittest.TestCase):
                                        'src_credentials': None,
                                        'dst_filepath': None}, job)#,  "Job not returned correctly.")
 
+        self.assertEqual(self.__service.token_svc.check(job['token']),
+                         {'job': 1, 'elements': [[0, 0]]})
         element = job['elements'][0]
-        self.assertIsInstance(element['token'], basestring)
+        self.assertNotIn('token', element)
         self.assertDictContainsSubset({'status': JobStatus.SUBMITTED,
                                        'job_id': 1,
                                        'attempts': 0,
                                        'src_filepath': '/data/somefile1',
-                                       'listing': None,
                                        'max_tries': 2,
                                        'type': JobType.LIST,
                                        'id': 0,
@@ -173,12 +244,77 @@ class TestWorkqueueService(unittest.TestCase):
             self.assertEqual(work[0]['elements'][i]['type'], JobType.REMOVE)
         self.assertEqual(work[1]['type'], JobType.COPY)
         self.assertEqual(len(work[1]['elements']), 6)
+        for job in work:
+            self.assertEqual(job['status'], JobStatus.SUBMITTED)
+            self.assertEqual(Job.query.filter_by(id=job['id']).one().status, JobStatus.SUBMITTED)
+            for element in job['elements']:
+                self.assertEqual(element['status'], JobStatus.SUBMITTED)
+        self.assertEqual(JobElement.query.filter(JobElement.job_id.in_((2, 3)),
+                                                 JobElement.status != JobStatus.SUBMITTED).count(), 0)
+        for job in Job.query.filter(Job.id.in_((2, 3))):
+            self.assertEqual((job.num_new, job.num_submitted), (0, 6))
         # up to 10 loaded now at once
         #request = self.__test.post('/workqueue/api/v1.0/worker/jobs', data={'types': [JobType.COPY, JobType.REMOVE]})
         #self.assertEqual(request.status_code, 200, "Failed to get copy or remove job.")
         request = self.__test.post('/workqueue/api/v1.0/worker/jobs', data={'types': [JobType.COPY, JobType.REMOVE]})
         self.assertEqual(request.status_code, 404, "Trying to get a job that doesn't exist should return 404.")
 
+    def test_get_next_job_max_jobs(self):
+        """test workers only claim as many jobs as they ask for."""
+        request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                   data={'types': [JobType.COPY, JobType.REMOVE], 'max_jobs': 1})
+        self.assertEqual(request.status_code, 200)
+        work = json.loads(request.data)
+        self.assertEqual([job['id'] for job in work], [2])
+        JobElement = self.__service.test_db().tables.JobElement
+        self.assertEqual(JobElement.query.filter_by(job_id=3, status=JobStatus.NEW).count(), 6)
+
+        request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                   data={'types': [JobType.COPY, JobType.REMOVE], 'max_jobs': 1})
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual([job['id'] for job in json.loads(request.data)], [3])
+
+    def test_get_next_job_bad_max_jobs(self):
+        """test invalid max_jobs values are rejected without claiming anything."""
+        JobElement = self.__service.test_db().tables.JobElement
+        statuses = [(element.job_id, element.id, element.status)
+                    for element in JobElement.query.all()]
+        for max_jobs in (0, -1, 'two', 1.5, True):
+            request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                       data={'types': [JobType.COPY, JobType.REMOVE],
+                                             'max_jobs': max_jobs})
+            self.assertEqual(request.status_code, 400)
+        self.assertEqual([(element.job_id, element.id, element.status)
+                          for element in JobElement.query.all()], statuses)
+
+    def test_get_next_job_long_poll(self):
+        """test worker long-polling for work."""
+        for wait in (-1, 'soon', None, True):
+            request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                       data={'types': [JobType.RENAME], 'wait': wait})
+            self.assertEqual(request.status_code, 400)
+        start = time.time()
+        request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                   data={'types': [JobType.RENAME], 'wait': 0.2})
+        self.assertEqual(request.status_code, 404)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        calls = []
+        def algorithm_call(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                threading.Timer(0.1, self.__service.work_notifier.notify).start()
+                return []
+            return Algorithm.BY_NUMBER.value(*args, **kwargs)
+        with mock.patch.object(Algorithm, '__call__', side_effect=algorithm_call):
+            start = time.time()
+            request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                       data={'types': [JobType.LIST], 'wait': 10})
+        self.assertEqual(request.status_code, 200)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(json.loads(request.data)), 1)
+
     def test_return_output(self):
         request = self.__test.put('/workqueue/api/v1.0/worker/jobs/1/elements/2',
                                   data={'log': 'blah blah',
@@ -206,7 +342,17 @@ class TestWorkqueueService(unittest.TestCase):
                                         'timestamp': 'timestamp'})
         self.assertEqual(request.status_code, 404)
 
-        self.__service.fake_auth("TOKEN", "1.0")
+        # Claim tokens only cover the claimed elements of their job
+        for token in ({'job': 1, 'elements': [[1, 3]]}, {'job': 2, 'elements': [[0, 0]]}):
+            self.__service.fake_auth("TOKEN", token)
+            request = self.__test.put('/workqueue/api/v1.0/worker/jobs/1/elements/0',
+                                      data={'log': 'blah blah',
+                                            'returncode': 0,
+                                            'host': 'somehost.domain',
+                                            'timestamp': 'timestamp'})
+            self.assertEqual(request.status_code, 403)
+
+        self.__service.fake_auth("TOKEN", {'job': 1, 'elements': [[0, 0]]})
         request = self.__test.put('/workqueue/api/v1.0/worker/jobs/1/elements/0',
                                   data={'log': 'blah blah',
                                         'returncode': 0,
@@ -260,7 +406,7 @@ class TestWorkqueueService(unittest.TestCase):
         """).strip()
         with open(logfile, 'rb') as log:
             self.assertEqual(log.read(), expected_log)
-        self.assertEqual(je.listing, {'root': []})
+        self.assertEqual(je.get_listing(), {'root': []})
 
         request = self.__test.put('/workqueue/api/v1.0/worker/jobs/1/elements/0',
                                   data={'log': 'blah blah',
@@ -432,6 +578,218 @@ class TestWorkqueueService(unittest.TestCase):
         self.assertEqual(j.elements[4].src_filepath, '/site1/data/someotherdir/')
         self.assertEqual(j.elements[5].src_filepath, '/site1/data/')
 
+    def test_return_listing(self):
+        """test expanding listings streamed back in parts."""
+        db = self.__service.test_db()
+        Job = db.tables.Job
+        JobElement = db.tables.JobElement
+        for type_ in (JobType.COPY, JobType.REMOVE, JobType.COPY):
+            db.session.add(Job(user_id=3, src_siteid=15, src_filepath='/site1/data',
+                               dst_siteid=16, dst_filepath='/site2/somedir', type=type_))
+        db.session.commit()
+        reg = {'st_size': 100, 'st_mode': 0o0100655}
+        dir_ = {'st_size': 0, 'st_mode': 0o040655}
+        output = {'log': 'blah blah',
+                  'returncode': 0,
+                  'host': 'somehost.domain',
+                  'timestamp': 'timestamp'}
+
+        self.__service.fake_auth("TOKEN", "4.0")
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/4/elements/0/listing',
+                                  data={'listing': {'/site1/data': [dict(reg, name='a')]}})
+        self.assertEqual(request.status_code, 400, "Listing should only be accepted once claimed.")
+        JobElement.query.filter(JobElement.job_id.in_((4, 5, 6)))\
+                        .update({'status': JobStatus.SUBMITTED}, synchronize_session=False)
+        Job.query.filter(Job.id.in_((4, 5, 6)))\
+                 .update({'num_new': 0, 'num_submitted': 1}, synchronize_session=False)
+        db.session.commit()
+
+        # COPY: files are added as each part arrives.
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/4/elements/0/listing',
+                                  data={'listing': {'/site1/data': [dict(reg, name='a'),
+                                                                    dict(dir_, name='sub')]}})
+        self.assertEqual(request.status_code, 200)
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/4/elements/0/listing',
+                                  data={'listing': {'/site1/data/sub': [dict(reg, name='b')]}})
+        self.assertEqual(request.status_code, 200)
+        elements = JobElement.query.filter_by(job_id=4).order_by(JobElement.id).all()
+        self.assertEqual([(e.id, e.src_filepath, e.dst_filepath, e.status) for e in elements[1:]],
+                         [(1, '/site1/data/a', '/site2/somedir/a', JobStatus.NEW),
+                          (2, '/site1/data/sub/b', '/site2/somedir/sub/b', JobStatus.NEW)])
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/4/elements/0',
+                                  data=dict(output, listing={'/site1/data/sub/c':
+                                                             [dict(reg, name='d')]}))
+        self.assertEqual(request.status_code, 200)
+        elements = JobElement.query.filter_by(job_id=4).order_by(JobElement.id).all()
+        self.assertEqual(len(elements), 4)
+        self.assertEqual(elements[3].dst_filepath, '/site2/somedir/sub/c/d')
+        self.assertEqual(elements[3].size, 100)
+        self.assertEqual(Job.query.get(4).status, JobStatus.SUBMITTED)
+        self.assertEqual((Job.query.get(4).num_new, Job.query.get(4).num_done), (3, 1))
+        # The stored listing is the whole of the streamed listing, not just the last part.
+        self.assertEqual(elements[0].get_listing(),
+                         {'/site1/data': [dict(reg, name='a'), dict(dir_, name='sub')],
+                          '/site1/data/sub': [dict(reg, name='b')],
+                          '/site1/data/sub/c': [dict(reg, name='d')]})
+
+        # REMOVE: directories are held back until the listing is complete.
+        self.__service.fake_auth("TOKEN", "5.0")
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/5/elements/0/listing',
+                                  data={'listing': {'/site1/data': [dict(dir_, name='sub'),
+                                                                    dict(reg, name='a')]}})
+        self.assertEqual(request.status_code, 200)
+        elements = JobElement.query.filter_by(job_id=5).order_by(JobElement.id).all()
+        self.assertEqual([e.src_filepath for e in elements[1:]], ['/site1/data/a'])
+        self.assertEqual(elements[0].get_listing(), {'/site1/data': [dict(reg, name='a'),
+                                                                     dict(dir_, name='sub')]})
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/5/elements/0/listing',
+                                  data={'listing': {'/site1/data/sub': [dict(reg, name='c')]}})
+        self.assertEqual(request.status_code, 200)
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/5/elements/0',
+                                  data=dict(output, listing={'/site1/data/sub':
+                                                             [dict(reg, name='b')]}))
+        self.assertEqual(request.status_code, 200)
+        elements = JobElement.query.filter_by(job_id=5).order_by(JobElement.id).all()
+        self.assertEqual([e.src_filepath for e in elements[1:]],
+                         ['/site1/data/a', '/site1/data/sub/c', '/site1/data/sub/b',
+                          '/site1/data/sub/', '/site1/data/'])
+        # The stored listing still holds the files of the earlier parts.
+        self.assertEqual(elements[0].get_listing(),
+                         {'/site1/data': [dict(reg, name='a'), dict(dir_, name='sub')],
+                          '/site1/data/sub': [dict(reg, name='b'), dict(reg, name='c')]})
+
+        # Retried listings don't add files already expanded by an earlier attempt.
+        self.__service.fake_auth("TOKEN", "6.0")
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/6/elements/0/listing',
+                                  data={'listing': {'/site1/data': [dict(reg, name='a')]}})
+        self.assertEqual(request.status_code, 200)
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/6/elements/0',
+                                  data=dict(output, returncode=1))
+        self.assertEqual(request.status_code, 200)
+        self.__service.fake_auth("ALL")
+        request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                   data={'types': [JobType.COPY]})
+        self.assertEqual(request.status_code, 200)
+        job = [job for job in json.loads(request.data) if job['id'] == 6][0]
+        self.assertEqual([element['id'] for element in job['elements']], [0],
+                         "Retried listing should be claimed on its own.")
+        self.__service.fake_auth("TOKEN", "6.0")
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/6/elements/0/listing',
+                                  data={'listing': {'/site1/data': [dict(reg, name='a'),
+                                                                    dict(reg, name='b')]}})
+        self.assertEqual(request.status_code, 200)
+        elements = JobElement.query.filter_by(job_id=6).order_by(JobElement.id).all()
+        self.assertEqual([e.src_filepath for e in elements[1:]],
+                         ['/site1/data/a', '/site1/data/b'])
+
+        # Partial listings are only for COPY/REMOVE jobs.
+        self.__service.fake_auth("TOKEN", "1.0")
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/1/elements/0/listing',
+                                  data={'listing': {'/site1/data': [dict(reg, name='a')]}})
+        self.assertEqual(request.status_code, 400)
+
+    def test_return_compact_listing(self):
+        """test listings sent as columns and rows."""
+        output = {'log': 'blah blah',
+                  'returncode': 0,
+                  'host': 'somehost.domain',
+                  'timestamp': 'timestamp'}
+        self.__service.fake_auth("TOKEN", "1.0")
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/1/elements/0',
+                                  data=dict(output, columns=['name', 'st_mode', 'st_size'],
+                                            listing={'/site1/data': 5}))
+        self.assertEqual(request.status_code, 400)
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/1/elements/0',
+                                  data=dict(output, columns=['name', 'st_mode', 'st_size'],
+                                            listing={'/site1/data': [['a', 0o0100644, 10],
+                                                                     ['b', 0o040755, 0]]}))
+        self.assertEqual(request.status_code, 200)
+        JobElement = self.__service.test_db().tables.JobElement
+        element = JobElement.query.get((0, 1))
+        self.assertEqual(element.get_listing(),
+                         {'/site1/data': [{'name': 'a', 'st_mode': 0o0100644, 'st_size': 10},
+                                          {'name': 'b', 'st_mode': 0o040755, 'st_size': 0}]})
+
+    def test_return_results(self):
+        """test worker returning a batch of results."""
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/elements',
+                                  data={'job_id': 1})
+        self.assertEqual(request.status_code, 400)
+
+        token_svc = self.__service.token_svc
+        output = {'log': 'blah blah',
+                  'returncode': 1,
+                  'host': 'somehost.domain',
+                  'timestamp': 'timestamp'}
+        monitoring = {'transferred': 100,
+                      'elapsed': 2,
+                      'instant': 50,
+                      'average': 50}
+        results = [{'job_id': 2, 'element_id': 1, 'token': token_svc.issue('2.1'),
+                    'monitoring': True, 'payload': monitoring},
+                   {'job_id': 1, 'element_id': 0, 'token': token_svc.issue('1.0'),
+                    'payload': output},
+                   {'job_id': 2, 'element_id': 2, 'token': token_svc.issue('2.3'),
+                    'payload': output},
+                   {'job_id': 2, 'element_id': 3, 'token': 'garbage',
+                    'payload': output},
+                   {'job_id': 2, 'element_id': 4, 'payload': output},
+                   {'job_id': 2, 'element_id': 5, 'token': token_svc.issue('2.5'),
+                    'monitoring': True, 'payload': {'transferred': 100}},
+                   {'job_id': 2, 'element_id': 6,
+                    'token': token_svc.issue({'job': 2, 'elements': [[1, 5]]}),
+                    'payload': output},
+                   {'job_id': 2, 'element_id': 3, 'token': ['garbage'],
+                    'payload': output}]
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/elements',
+                                  data=results)
+        self.assertEqual(request.status_code, 200)
+        responses = json.loads(request.data)
+        self.assertEqual([response['code'] for response in responses],
+                         [200, 200, 403, 403, 400, 400, 403, 403])
+        self.assertEqual([(response['job_id'], response['element_id'])
+                          for response in responses[:4]],
+                         [(2, 1), (1, 0), (2, 2), (2, 3)])
+
+        JobElement = self.__service.test_db().tables.JobElement
+        je = JobElement.query.filter_by(job_id=2, id=1).one()
+        self.assertEqual(je.status, JobStatus.RUNNING)
+        self.assertEqual(je.monitoring_info['transferred'], 100)
+        je = JobElement.query.filter_by(job_id=1, id=0).one()
+        self.assertEqual(je.status, JobStatus.FAILED)
+        self.assertEqual(je.attempts, 1)
+        for element_id in xrange(2, 6):
+            je = JobElement.query.filter_by(job_id=2, id=element_id).one()
+            self.assertEqual(je.status, JobStatus.NEW)
+
+    def test_return_results_errors(self):
+        """test a failing result doesn't affect the rest of the batch."""
+        token_svc = self.__service.token_svc
+        output = {'log': 'blah blah',
+                  'returncode': 1,
+                  'host': 'somehost.domain',
+                  'timestamp': 'timestamp'}
+        # transferred -1 with no elapsed time divides by zero.
+        monitoring = {'transferred': -1, 'elapsed': 0, 'instant': 0, 'average': 0}
+        results = [{'job_id': 2, 'element_id': 1, 'token': token_svc.issue('2.1'),
+                    'monitoring': True, 'payload': monitoring},
+                   {'job_id': 'two', 'element_id': 1, 'token': token_svc.issue('2.1'),
+                    'payload': output},
+                   {'job_id': 1, 'element_id': 0, 'token': token_svc.issue('1.0'),
+                    'payload': output}]
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/elements',
+                                  data=results)
+        self.assertEqual(request.status_code, 200)
+        responses = json.loads(request.data)
+        self.assertEqual([response['code'] for response in responses], [500, 400, 200])
+
+        JobElement = self.__service.test_db().tables.JobElement
+        je = JobElement.query.filter_by(job_id=2, id=1).one()
+        self.assertEqual(je.status, JobStatus.NEW)
+        self.assertIsNone(je.monitoring_info)
+        je = JobElement.query.filter_by(job_id=1, id=0).one()
+        self.assertEqual(je.status, JobStatus.FAILED)
+
     @mock.patch('pdm.workqueue.WorkqueueService.current_app')
     @mock.patch('pdm.userservicedesk.HRService.HRService.check_token')
     def test_post_job(self, mock_hrservice, mock_siteclient):
@@ -584,6 +942,60 @@ class TestWorkqueueService(unittest.TestCase):
         self.assertEqual(job.type, JobType.REMOVE)
         self.assertEqual(returned_job['type'], 'REMOVE')
 
+    def test_status_counters(self):
+        """test job status is derived from the element status counters."""
+        Job = self.__service.test_db().tables.Job
+        request = self.__test.post('/workqueue/api/v1.0/worker/jobs',
+                                   data={'types': [JobType.COPY]})
+        self.assertEqual(request.status_code, 200)
+        job = Job.query.get(3)
+        self.assertEqual(job.status, JobStatus.SUBMITTED)
+        self.assertEqual((job.num_new, job.num_submitted), (0, 6))
+
+        monitoring = {'transferred': 100, 'elapsed': 1, 'instant': 100, 'average': 100}
+        self.__service.fake_auth("TOKEN", "3.1")
+        for _ in xrange(2):
+            request = self.__test.put('/workqueue/api/v1.0/worker/jobs/3/elements/1/monitoring',
+                                      data=monitoring)
+            self.assertEqual(request.status_code, 200)
+            job = Job.query.get(3)
+            self.assertEqual(job.status, JobStatus.RUNNING)
+            self.assertEqual((job.num_submitted, job.num_running), (5, 1))
+
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/3/elements/1',
+                                  data={'log': 'blah blah',
+                                        'returncode': 0,
+                                        'host': 'somehost.domain',
+                                        'timestamp': 'timestamp'})
+        self.assertEqual(request.status_code, 200)
+        job = Job.query.get(3)
+        self.assertEqual(job.status, JobStatus.SUBMITTED)
+        self.assertEqual((job.num_submitted, job.num_running, job.num_done), (5, 0, 1))
+
+        for element_id in xrange(2, 6):
+            self.__service.fake_auth("TOKEN", "3.%d" % element_id)
+            request = self.__test.put('/workqueue/api/v1.0/worker/jobs/3/elements/%d' % element_id,
+                                      data={'log': 'blah blah',
+                                            'returncode': element_id % 2,
+                                            'host': 'somehost.domain',
+                                            'timestamp': 'timestamp'})
+            self.assertEqual(request.status_code, 200)
+        job = Job.query.get(3)
+        self.assertEqual(job.status, JobStatus.SUBMITTED)
+        self.assertEqual((job.num_submitted, job.num_done, job.num_failed), (1, 3, 2))
+
+        self.__service.fake_auth("TOKEN", "3.0")
+        request = self.__test.put('/workqueue/api/v1.0/worker/jobs/3/elements/0',
+                                  data={'log': 'blah blah',
+                                        'returncode': 1,
+                                        'host': 'somehost.domain',
+                                        'timestamp': 'timestamp'})
+        self.assertEqual(request.status_code, 200)
+        job = Job.query.get(3)
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual((job.num_new, job.num_submitted, job.num_running,
+                          job.num_done, job.num_failed), (0, 0, 0, 3, 3))
+
     @mock.patch('pdm.userservicedesk.HRService.HRService.check_token')
     def test_get_jobs(self, mock_hrservice):
         mock_hrservice.return_value = 10
@@ -601,6 +1013,56 @@ class TestWorkqueueService(unittest.TestCase):
                                        'type': 'LIST',
                                        'status': 'NEW'}, returned_jobs[0])
 
+    @mock.patch('pdm.userservicedesk.HRService.HRService.check_token')
+    def test_get_jobs_counts_and_paging(self, mock_hrservice):
+        db = self.__service.test_db()
+        Job = db.tables.Job
+        JobElement = db.tables.JobElement
+        JobElement.query.filter_by(job_id=2, id=1).update({'status': JobStatus.DONE})
+        JobElement.query.filter_by(job_id=2, id=2).update({'status': JobStatus.FAILED})
+        # The counts come from the counters on the job, kept in step as the service would.
+        Job.query.get(2).update_counters({JobStatus.NEW: -2, JobStatus.DONE: 1,
+                                          JobStatus.FAILED: 1})
+        db.session.add(Job(user_id=2, src_siteid=14,
+                           src_filepath='/data/somefile4', type=JobType.LIST))
+        db.session.commit()
+
+        mock_hrservice.return_value = 2
+        request = self.__test.get('/workqueue/api/v1.0/jobs')
+        self.assertEqual(request.status_code, 200)
+        returned_jobs = json.loads(request.data)
+        self.assertEqual([job['id'] for job in returned_jobs], [2, 4])
+        self.assertDictContainsSubset({'num_elements': 6,
+                                       'num_new': 4,
+                                       'num_done': 1,
+                                       'num_failed': 1,
+                                       'num_submitted': 0,
+                                       'num_running': 0}, returned_jobs[0])
+        self.assertDictContainsSubset({'num_elements': 1, 'num_new': 1}, returned_jobs[1])
+
+        request = self.__test.get('/workqueue/api/v1.0/jobs?limit=1')
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual([job['id'] for job in json.loads(request.data)], [2])
+        request = self.__test.get('/workqueue/api/v1.0/jobs?limit=1&offset=1')
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual([job['id'] for job in json.loads(request.data)], [4])
+
+        request = self.__test.get('/workqueue/api/v1.0/jobs?limit=0')
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(json.loads(request.data), [])
+        for bad_paging in ('limit=-1', 'offset=-1', 'limit=ten', 'offset=1.5', 'limit='):
+            request = self.__test.get('/workqueue/api/v1.0/jobs?' + bad_paging)
+            self.assertEqual(request.status_code, 400, bad_paging)
+
+        request = self.__test.get('/workqueue/api/v1.0/jobs?since=2000-01-01T00:00:00')
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(len(json.loads(request.data)), 2)
+        request = self.__test.get('/workqueue/api/v1.0/jobs?since=2999-01-01T00:00:00.000001')
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(json.loads(request.data), [])
+        request = self.__test.get('/workqueue/api/v1.0/jobs?since=yesterday')
+        self.assertEqual(request.status_code, 400)
+
     @mock.patch('pdm.userservicedesk.HRService.HRService.check_token')
     def test_get_job(self, mock_hrservice):
         mock_hrservice.return_value = 10
@@ -745,10 +1207,11 @@ class TestWorkqueueService(unittest.TestCase):
         list_job.elements[0].attempts = 1
         remove_job.elements[0].attempts = 1
         remove_job.elements[1].attempts = 1
-        list_job.elements[0].listing = {'root': [{'name': 'somefile'}]}
-        remove_job.elements[0].listing = {'root': [{'name': 'somefile'}]}
         session.merge(list_job)
         session.merge(remove_job)
+        ListingEntry = self.__service.test_db().tables.ListingEntry
+        ListingEntry.add_listing(session, 1, 0, {'root': [{'name': 'somefile'}]})
+        ListingEntry.add_listing(session, 2, 0, {'root': [{'name': 'somefile'}]})
         session.commit()
 
         mock_hrservice.return_value = 1
@@ -825,6 +1288,20 @@ class TestWorkqueueService(unittest.TestCase):
         returned_dict = json.loads(request.data)
         self.assertEqual(returned_dict, [[{'status': 'DONE', 'attempt': 1, 'log': 'la la la\n', 'jobid': 1, 'listing': {'root': [{'name': 'somefile'}]}, 'type': 'LIST', 'elementid': 0}]])
 
+        # Listings can be paged, entries are ordered by path.
+        ListingEntry.add_listing(session, 1, 0, {'other': [{'name': 'b', 'st_size': 1},
+                                                           {'name': 'a', 'st_size': 2}]})
+        session.commit()
+        request = self.__test.get('/workqueue/api/v1.0/jobs/1/elements/0/output/1?listing_limit=2')
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(json.loads(request.data)['listing'],
+                         {'other': [{'name': 'a', 'st_size': 2}, {'name': 'b', 'st_size': 1}],
+                          'root': []})
+        request = self.__test.get('/workqueue/api/v1.0/jobs/1/elements/0/output'
+                                  '?listing_limit=2&listing_offset=2')
+        self.assertEqual(request.status_code, 200)
+        self.assertEqual(json.loads(request.data)[0]['listing'], {'root': [{'name': 'somefile'}]})
+
 ## check jobs in status
 ## check check_token is called
 ## dont hardcode /tmp/workerslogs get it from self.config